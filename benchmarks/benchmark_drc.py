@@ -0,0 +1,124 @@
+'''
+Benchmark for the SiEPICfab-EBeam-ZEP DRC decks, rule by rule (siepicfab_ebeam_zep/run_drc.py)
+
+Generates the benchmark layout set (synthetic_layouts.py, with metal heaters) with 1k to 1M shapes,
+flat and hierarchical, and runs the DRC decks on each layout with the runtime, memory and number
+of markers of each rule, to find the rules that dominate the runtime and to measure rule rewrites.
+The decks need the klayout executable (see run_drc.py); without it, only the incremental
+DRC (run_drc --incremental) is measured, the first time and again with its cache.
+The results are appended to a history file (one JSON record per line).
+
+Usage:
+  python benchmarks/benchmark_drc.py
+  python benchmarks/benchmark_drc.py --sizes 1000 10000 --decks SiEPICfab_EBeam_ZEP --layouts-dir drc_layouts
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, path)
+sys.path.insert(0, os.path.abspath(os.path.join(path, '..')))
+
+from benchmark_export import git_commit
+
+SIZES = [1000, 10000, 100000, 1000000]
+DECKS = ['SiEPICfab_EBeam_ZEP', 'ELEC463-2021', 'incremental']
+HISTORY = os.path.join(path, 'benchmark_drc_history.jsonl')
+
+
+def write_layouts(folder, sizes=SIZES, layouts=('flat', 'hierarchical')):
+    '''
+    The benchmark layout set: drc_<size>_<layout>.oas in folder; existing files are reused.
+    Returns a list of (size, layout, filename).
+    '''
+    from synthetic_layouts import make_layout
+    files = []
+    for n_shapes in sizes:
+        for layout in layouts:
+            file_out = os.path.join(folder, 'drc_%s_%s.oas' % (n_shapes, layout))
+            if not os.path.exists(file_out):
+                ly, topcell = make_layout(n_shapes, hierarchical=(layout == 'hierarchical'), heaters=True)
+                ly.write(file_out)
+            files.append((n_shapes, layout, file_out))
+    return files
+
+
+def run_case(file_in, deck, output_dir):
+    # one benchmark case; runs in its own process, for the memory of the incremental DRC
+    import siepicfab_ebeam_zep
+    from siepicfab_ebeam_zep import run_drc
+    incremental = deck.startswith('incremental')
+    file_cache = os.path.join(output_dir, 'cache.json')
+    if deck == 'incremental' and os.path.exists(file_cache):
+        os.remove(file_cache)
+    file_rdb, summary = run_drc.drc_file(file_in, output_dir=output_dir, deck=deck, incremental=incremental,
+                                         file_cache=file_cache, profile=True)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SiEPICfab-EBeam-ZEP DRC decks, rule by rule.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='number of shapes')
+    parser.add_argument('--decks', nargs='+', default=DECKS, help='DRC decks, and/or incremental')
+    parser.add_argument('--layouts', nargs='+', default=['flat', 'hierarchical'], help='flat and/or hierarchical')
+    parser.add_argument('--layouts-dir', default=None,
+                        help='folder for the benchmark layout set, to keep it (default: a temporary folder)')
+    parser.add_argument('--history', default=HISTORY, help='history file (JSON lines)')
+    parser.add_argument('--label', default='', help='label for this run, e.g., the rule rewrite being measured')
+    args = parser.parse_args(argv)
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    from siepicfab_ebeam_zep import run_drc
+
+    decks = []
+    for deck in args.decks:
+        if deck != 'incremental' and run_drc.find_klayout() is None:
+            print('skipping %s: the klayout executable is not found' % deck)
+            continue
+        decks.append(deck)
+        if deck == 'incremental':
+            decks.append('incremental (cached)')
+
+    run = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+    records = []
+    with tempfile.TemporaryDirectory() as folder:
+        layouts_dir = args.layouts_dir or folder
+        os.makedirs(layouts_dir, exist_ok=True)
+        print('%10s %-13s %-22s %-24s %9s %9s %9s %9s' %
+              ('shapes', 'layout', 'deck', 'rule', 'seconds', 'peak MB', '+peak MB', 'count'))
+        for n_shapes, layout, file_in in write_layouts(layouts_dir, args.sizes, args.layouts):
+            for deck in decks:
+                # a new process for each case, for the peak memory
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    summary = executor.submit(run_case, file_in, deck, folder).result()
+                records.append(dict(run, size=n_shapes, layout=layout, deck=deck, seconds=summary['seconds'],
+                                    violations=summary['violations'], rules=summary['rules']))
+                for r in sorted(summary['rules'], key=lambda r: -(r['seconds'] or 0)):
+                    print('%10s %-13s %-22s %-24s %9.3f %9.1f %9.1f %9s' %
+                          (n_shapes, layout, deck, r['rule'], r['seconds'] or 0, r['peak_memory'] or 0,
+                           r['peak_increase'] or 0, r['count']))
+                print('%10s %-13s %-22s %-24s %9.3f' % (n_shapes, layout, deck, 'total', summary['seconds']))
+
+    with open(args.history, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record)+'\n')
+    print('saving results: %s' % args.history)
+    return records
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''
+Benchmark for the SiEPICfab-EBeam-ZEP fabrication export (pymacros/SiEPICfab_ZEP_export.py)
+
+Generates synthetic layouts (synthetic_layouts.py) with 1k to 1M shapes, flat and hierarchical,
+and times boolean_layer_operations and the write of the fabrication file, for each boolean engine.
+Each case runs in a new process, to measure its peak memory.
+The results are appended to a history file (one JSON record per line), to compare
+engines and to find performance regressions between commits.
+
+Usage:
+  python benchmarks/benchmark_export.py
+  python benchmarks/benchmark_export.py --sizes 1000 10000 --engines Region --label "my change"
+'''
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, path)
+sys.path.insert(0, os.path.abspath(os.path.join(path, '..')))
+
+SIZES = [1000, 10000, 100000, 1000000]
+ENGINES = ['ShapeProcessor', 'Region', 'Tiled']
+HISTORY = os.path.join(path, 'benchmark_export_history.jsonl')
+
+
+def peak_memory_mb():
+    # peak resident memory of this process
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return rss/1e6 if sys.platform == 'darwin' else rss/1e3
+
+
+def run_case(n_shapes, hierarchical, engine):
+    # one benchmark case; runs in its own process
+    import siepicfab_ebeam_zep
+    from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_export
+    from synthetic_layouts import make_layout, count_shapes
+
+    t0 = time.time()
+    ly, topcell = make_layout(n_shapes, hierarchical=hierarchical)
+    generate_seconds = time.time()-t0
+    shapes = count_shapes(topcell, [ly.layer(1, 0), ly.layer(1, 2), ly.layer(100, 0)])
+    memory_before = peak_memory_mb()
+
+    profile = SiEPICfab_ZEP_export.ExportProfile()
+    with tempfile.TemporaryDirectory() as folder:
+        t0 = time.time()
+        # the export prints every cell name
+        with contextlib.redirect_stdout(io.StringIO()):
+            file_out = SiEPICfab_ZEP_export.export_topcell_for_fabrication(
+                topcell, os.path.join(folder, 'benchmark.oas'), flatten=(engine == 'Tiled'),
+                engine=engine, profile=profile)
+        export_seconds = time.time()-t0
+        file_size = os.path.getsize(file_out)
+
+    phases = {}
+    for e in profile.phases:
+        phases[e['name']] = phases.get(e['name'], 0) + e['seconds']
+    return {
+        'shapes': shapes,
+        'cells': len(list(ly.each_cell())),
+        'generate_seconds': generate_seconds,
+        'export_seconds': export_seconds,
+        'copy_seconds': phases.get('copy', 0),
+        'flatten_seconds': phases.get('flatten', 0),
+        'boolean_seconds': phases.get('booleans', 0),
+        'write_seconds': phases.get('write', 0),
+        'file_bytes': file_size,
+        'memory_before_mb': memory_before,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SiEPICfab-EBeam-ZEP fabrication export.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='number of shapes')
+    parser.add_argument('--engines', nargs='+', default=ENGINES, help='boolean engines')
+    parser.add_argument('--layouts', nargs='+', default=['flat', 'hierarchical'], help='flat and/or hierarchical')
+    parser.add_argument('--history', default=HISTORY, help='history file (JSON lines)')
+    parser.add_argument('--label', default='', help='label for this run, e.g., the change being measured')
+    args = parser.parse_args(argv)
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    run = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+    print('%10s %-13s %-15s %9s %9s %9s %9s %10s' %
+          ('shapes', 'layout', 'engine', 'export', 'boolean', 'write', 'peak MB', 'file kB'))
+    records = []
+    for n_shapes in args.sizes:
+        for layout in args.layouts:
+            for engine in args.engines:
+                # a new process for each case, for the peak memory
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(run_case, n_shapes, layout == 'hierarchical', engine).result()
+                record = dict(run, size=n_shapes, layout=layout, engine=engine, **result)
+                records.append(record)
+                print('%10s %-13s %-15s %9.3f %9.3f %9.3f %9.1f %10.1f' %
+                      (result['shapes'], layout, engine, result['export_seconds'], result['boolean_seconds'],
+                       result['write_seconds'], result['peak_memory_mb'] or 0, result['file_bytes']/1e3))
+
+    with open(args.history, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record)+'\n')
+    print('saving results: %s' % args.history)
+    return records
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+'''
+Synthetic SiEPICfab-EBeam-ZEP layouts, for benchmarking the export, EBL and DRC tools
+
+The layouts contain realistic device cells on the ZEP layers:
+ - waveguides: Si_core (1/0) paths inside Si_clad (1/2)
+ - Bragg gratings: corrugated Si_core boxes, with Gaussian apodization variants
+ - ring resonators, with photonic crystal holes on Si_etch_highres (100/0)
+ - FloorPlan (99/0) and EBL-Regions (8100/0) fields of up to 1 mm
+ - optionally, metal heaters (M1, 11/0) over the rings, for the DRC
+Devices are grouped into designs, and designs into groups, as on a multi-project chip.
+
+Usage:
+  from synthetic_layouts import make_layout
+  ly, topcell = make_layout(100000, hierarchical=True)
+'''
+
+import math
+import pya
+
+LAYERS = {
+    'Si_core': (1, 0),
+    'Si_clad': (1, 2),
+    'Si_etch_highres': (100, 0),
+    'Si_etch_highres_nobias': (101, 0),
+    'M1': (11, 0),
+    'FloorPlan': (99, 0),
+    'EBL-Regions': (8100, 0),
+    'DevRec': (68, 0),
+}
+
+# device pitch within a design, and design size, in microns
+DEVICE_PITCH = 25.0
+DESIGN_WIDTH = 250.0
+
+
+def _layers(ly):
+    return {name: ly.layer(*ld) for name, ld in LAYERS.items()}
+
+
+def _waveguide(ly, l, name, length=200.0, width=0.5, clad=2.0):
+    cell = ly.create_cell(name)
+    dbu = ly.dbu
+    pts = [pya.DPoint(0, 0), pya.DPoint(length/3, 0), pya.DPoint(length/3+5, 5),
+           pya.DPoint(2*length/3, 5), pya.DPoint(2*length/3+5, 0), pya.DPoint(length, 0)]
+    path = pya.DPath(pts, width).to_itype(dbu)
+    cell.shapes(l['Si_core']).insert(path)
+    cell.shapes(l['Si_clad']).insert(pya.DPath(pts, width+2*clad).to_itype(dbu))
+    cell.shapes(l['DevRec']).insert(pya.DPath(pts, width+2*clad).to_itype(dbu))
+    return cell
+
+
+def _bragg(ly, l, name, periods=100, period=0.32, width=0.5, corrugation=0.05, apodization=None):
+    cell = ly.create_cell(name)
+    dbu = ly.dbu
+    shapes = cell.shapes(l['Si_core'])
+    for i in range(periods):
+        profile = corrugation/2
+        if apodization:
+            profile *= math.exp(-0.5*(2*apodization*(i-periods/2)/periods)**2)
+        x = i*period
+        shapes.insert(pya.DBox(x, -width/2-profile, x+period/2, width/2+profile).to_itype(dbu))
+        shapes.insert(pya.DBox(x+period/2, -width/2+profile, x+period, width/2-profile).to_itype(dbu))
+    length = periods*period
+    cell.shapes(l['Si_clad']).insert(pya.DBox(0, -width/2-2, length, width/2+2).to_itype(dbu))
+    cell.shapes(l['DevRec']).insert(pya.DBox(0, -width/2-2, length, width/2+2).to_itype(dbu))
+    return cell
+
+
+def _ring(ly, l, name, radius=10.0, width=0.5, gap=0.2, holes=50, vertices=64, heater=False):
+    cell = ly.create_cell(name)
+    dbu = ly.dbu
+    outer = [pya.DPoint((radius+width/2)*math.cos(2*math.pi*i/vertices),
+                        (radius+width/2)*math.sin(2*math.pi*i/vertices)) for i in range(vertices)]
+    inner = [pya.DPoint((radius-width/2)*math.cos(2*math.pi*i/vertices),
+                        (radius-width/2)*math.sin(2*math.pi*i/vertices)) for i in range(vertices)]
+    ring = pya.DPolygon(outer)
+    ring.insert_hole(inner)
+    cell.shapes(l['Si_core']).insert(ring.to_itype(dbu))
+    y = -radius-width-gap
+    cell.shapes(l['Si_core']).insert(pya.DBox(-radius-5, y-width/2, radius+5, y+width/2).to_itype(dbu))
+    cell.shapes(l['Si_clad']).insert(pya.DBox(-radius-5, y-3, radius+5, radius+3).to_itype(dbu))
+    # photonic crystal holes, inside the ring
+    for i in range(holes):
+        a = 2*math.pi*i/holes
+        c = pya.DPoint((radius-4)*math.cos(a), (radius-4)*math.sin(a))
+        hole = pya.DPolygon(pya.DBox(c.x-0.1, c.y-0.1, c.x+0.1, c.y+0.1)).round_corners(0, 0.1, 16)
+        cell.shapes(l['Si_etch_highres']).insert(hole.to_itype(dbu))
+    cell.shapes(l['DevRec']).insert(pya.DBox(-radius-5, y-3, radius+5, radius+3).to_itype(dbu))
+    if heater:
+        # a 3 µm wide heater over the ring, and its 2 contacts: metal width and Si-metal spacing violations
+        outer = [pya.DPoint((radius+1.5)*math.cos(math.pi*i/vertices), (radius+1.5)*math.sin(math.pi*i/vertices))
+                 for i in range(vertices+1)]
+        inner = [pya.DPoint((radius-1.5)*math.cos(math.pi*i/vertices), (radius-1.5)*math.sin(math.pi*i/vertices))
+                 for i in range(vertices, -1, -1)]
+        cell.shapes(l['M1']).insert(pya.DPolygon(outer+inner).to_itype(dbu))
+        for x in (-radius, radius):
+            cell.shapes(l['M1']).insert(pya.DBox(x-3, -6, x+3, 0).to_itype(dbu))
+    return cell
+
+
+def count_shapes(cell, layers):
+    # number of shapes in the cell, flattened
+    count = 0
+    for li in layers:
+        it = cell.begin_shapes_rec(li)
+        while not it.at_end():
+            count += 1
+            it.next()
+    return count
+
+
+def make_layout(n_shapes, hierarchical=True, variants=5, heaters=False):
+    '''
+    Create a synthetic layout with approximately n_shapes shapes (flattened) on the Si and etch layers.
+    hierarchical: True: devices > designs > groups > top cell; False: all shapes in the top cell
+    variants: number of different devices of each type (e.g., Bragg grating apodizations)
+    heaters: metal heaters over the rings
+    Returns (layout, topcell).
+    '''
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    l = _layers(ly)
+    topcell = ly.create_cell('Top')
+
+    # device cells
+    devices = []
+    for v in range(variants):
+        devices.append(_waveguide(ly, l, 'Waveguide_%s' % v, length=200.0-10*v))
+        devices.append(_bragg(ly, l, 'Bragg_%s' % v, corrugation=0.02+0.01*v, apodization=2*v or None))
+        devices.append(_ring(ly, l, 'Ring_%s' % v, radius=8.0+v, heater=heaters))
+
+    # a design contains each device once, stacked vertically
+    design = ly.create_cell('Design')
+    for i, device in enumerate(devices):
+        design.insert(pya.DCellInstArray(device.cell_index(), pya.DTrans(0 if device.name.startswith('W') else 20,
+                                                                          i*DEVICE_PITCH)))
+    design_height = len(devices)*DEVICE_PITCH
+    shapes_per_design = sum(count_shapes(d, [l['Si_core'], l['Si_clad'], l['Si_etch_highres']]) for d in devices)
+
+    # groups of 10 designs
+    group = ly.create_cell('Group')
+    for i in range(10):
+        group.insert(pya.DCellInstArray(design.cell_index(), pya.DTrans(i*DESIGN_WIDTH, 0)))
+
+    # place the groups in a square grid on the chip
+    n_designs = max(1, int(round(n_shapes/shapes_per_design)))
+    n_groups, n_single = divmod(n_designs, 10)
+    columns = max(1, int(math.ceil(math.sqrt(n_groups*design_height/(10*DESIGN_WIDTH)))))
+    group_pitch = (10*DESIGN_WIDTH, design_height+50)
+    for i in range(n_groups):
+        topcell.insert(pya.DCellInstArray(group.cell_index(),
+                       pya.DTrans((i % columns)*group_pitch[0], (i//columns)*group_pitch[1])))
+    y = (n_groups+columns-1)//columns*group_pitch[1]
+    for i in range(n_single):
+        topcell.insert(pya.DCellInstArray(design.cell_index(), pya.DTrans(i*DESIGN_WIDTH, y)))
+    if not n_groups:
+        ly.delete_cell(group.cell_index())
+
+    # floor plan and EBL write fields, 1 mm or smaller
+    bbox = topcell.dbbox()
+    topcell.shapes(l['FloorPlan']).insert(bbox.enlarged(10, 10).to_itype(ly.dbu))
+    field = 1000.0
+    nx = max(1, int(math.ceil(bbox.width()/field)))
+    ny = max(1, int(math.ceil(bbox.height()/field)))
+    for ix in range(nx):
+        for iy in range(ny):
+            box = pya.DBox(bbox.left+ix*field, bbox.bottom+iy*field,
+                           min(bbox.left+(ix+1)*field, bbox.right), min(bbox.bottom+(iy+1)*field, bbox.top))
+            topcell.shapes(l['EBL-Regions']).insert(box.to_itype(ly.dbu))
+
+    if not hierarchical:
+        topcell.flatten(-1, True)
+
+    return ly, topcell
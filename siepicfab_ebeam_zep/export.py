@@ -0,0 +1,139 @@
+'''
+Headless export for SiEPICfab-EBeam-ZEP fabrication, without the KLayout application (GUI)
+
+Runs the same export as SiEPIC > Export > "Export design for SiEPICfab-ZEP fabrication",
+on many layouts in parallel worker processes, e.g., for all the submissions of a shuttle run.
+
+Usage, with the standalone klayout Python module:
+  python -m siepicfab_ebeam_zep.export design1.gds design2.oas --flatten --replace-ip
+  python -m siepicfab_ebeam_zep.export submissions/*.gds -o export/ -j 8
+
+Each input in.gds is exported as in_static.oas (or in_static.gds, for long cell names),
+next to the input file or in the --output-dir folder.
+
+Within KLayout in batch mode (klayout -zz), import the module and call export_files().
+'''
+
+import os
+import sys
+import time
+
+# what to append at the end of the filename, same as export_for_fabrication
+extra = "static"
+
+
+def export_file(file_in, output_dir=None, topcell_name=None, flatten=False, replace_IP=False,
+                engine=None, tile_size=None, threads=None, cache_dir=None, cache_max_size_mb=None,
+                profile=False, deduplicate=None):
+    '''
+    Export one layout file for fabrication.
+    Returns the filename that was written.
+    '''
+    import pya
+    import siepicfab_ebeam_zep
+    from siepicfab_ebeam_zep.pymacros.SiEPICfab_ZEP_export import export_topcell_for_fabrication, ExportCache
+
+    ly = pya.Layout()
+    ly.technology_name = 'SiEPICfab_EBeam_ZEP'
+    ly.read(file_in)
+
+    # find the top cell to export
+    if topcell_name:
+        topcell = ly.cell(topcell_name)
+        if topcell is None:
+            raise Exception("Top cell %s not found in %s." % (topcell_name, file_in))
+    elif len(ly.top_cells()) == 1:
+        topcell = ly.top_cells()[0]
+    else:
+        raise Exception("You may only have one top cell in your hierarchy (%s). Choose the top cell using --topcell." % file_in)
+
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(file_in))
+    file_out = os.path.join(output_dir, os.path.splitext(os.path.basename(file_in))[0]+'_%s.oas' % extra)
+
+    cache = ExportCache(cache_dir, cache_max_size_mb) if cache_dir else None
+
+    return export_topcell_for_fabrication(topcell, file_out, flatten=flatten, replace_IP=replace_IP,
+                                          engine=engine, tile_size=tile_size, threads=threads, cache=cache,
+                                          profile=profile, deduplicate=deduplicate)
+
+
+def _export_file_worker(args):
+    file_in, kwargs = args
+    t0 = time.time()
+    try:
+        file_out = export_file(file_in, **kwargs)
+        return file_in, file_out, time.time()-t0, None
+    except Exception as e:
+        return file_in, None, time.time()-t0, '%s: %s' % (type(e).__name__, e)
+
+
+def export_files(files_in, processes=None, **kwargs):
+    '''
+    Export many layout files for fabrication, in a pool of worker processes.
+    kwargs are passed to export_file.
+    Returns a list of (file_in, file_out, seconds, error), in the order of files_in.
+    '''
+    jobs = [(f, kwargs) for f in files_in]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [_export_file_worker(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_export_file_worker, jobs))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m siepicfab_ebeam_zep.export',
+        description='Export layouts for SiEPICfab-EBeam-ZEP fabrication, without the KLayout GUI.')
+    parser.add_argument('files', nargs='+', help='input layouts (GDS or OASIS)')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='folder for the exported files (default: next to each input)')
+    parser.add_argument('--topcell', default=None,
+                        help='name of the top cell to export (default: the single top cell)')
+    parser.add_argument('--flatten', action='store_true', help='flatten the layout')
+    parser.add_argument('--replace-ip', action='store_true', help='replace black box cells with the IP cells')
+    parser.add_argument('--engine', default=None,
+                        help='boolean engine: ShapeProcessor, Region or Tiled (Tiled requires --flatten)')
+    parser.add_argument('--tile-size', type=float, default=None, help='tile size in microns, for the Tiled engine')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads, for the Tiled engine')
+    parser.add_argument('--cache-dir', default=None,
+                        help='folder for the per-cell boolean cache, reused between exports (default: no cache)')
+    parser.add_argument('--cache-size', type=float, default=None,
+                        help='maximum size of the cache folder in MB (default: 1000)')
+    parser.add_argument('--deduplicate', action='store_true', default=None,
+                        help='merge the cells with identical geometry, after the boolean operations')
+    parser.add_argument('--profile', action='store_true',
+                        help='save a timing profile (<output>_profile.json, and a Chrome trace)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = export_files(args.files, processes=args.processes,
+                           output_dir=args.output_dir, topcell_name=args.topcell,
+                           flatten=args.flatten, replace_IP=args.replace_ip,
+                           engine=args.engine, tile_size=args.tile_size, threads=args.threads,
+                           cache_dir=args.cache_dir, cache_max_size_mb=args.cache_size,
+                           profile=args.profile, deduplicate=args.deduplicate)
+
+    errors = 0
+    for file_in, file_out, seconds, error in results:
+        if error:
+            errors += 1
+            print('FAILED  %s (%.1f s): %s' % (file_in, seconds, error))
+        else:
+            print('OK      %s -> %s (%.1f s)' % (file_in, file_out, seconds))
+    print('Exported %s of %s layouts.' % (len(results)-errors, len(results)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
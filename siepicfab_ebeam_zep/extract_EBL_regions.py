@@ -0,0 +1,156 @@
+'''
+Headless EBL write field extraction for SiEPICfab-EBeam-ZEP, without the KLayout application (GUI)
+
+Runs the same extraction as SiEPIC > Export > "Extract EBL Write Field Regions",
+on many layouts in parallel worker processes, e.g., for all the chips of a shuttle run.
+
+Usage, with the standalone klayout Python module:
+  python -m siepicfab_ebeam_zep.extract_EBL_regions chip1.gds chip2.oas
+  python -m siepicfab_ebeam_zep.extract_EBL_regions chips/*.oas -o fields/ -j 8 --generate
+
+Each input in.gds gives the manual field control file in_EBLfields.txt,
+next to the input file or in the --output-dir folder.
+With --stitching, the features crossing the field boundaries are saved in
+in_stitching.csv and in_stitching.lyrdb.
+With --statistics, the pattern density and shot count of each field are saved in
+in_EBLfields_stats.csv.
+
+Within KLayout in batch mode (klayout -zz), import the module and call extract_files().
+'''
+
+import os
+import sys
+import time
+
+# what to append at the end of the filename, same as the extract_EBL_regions macro
+extra = "EBLfields.txt"
+
+
+def extract_file(file_in, output_dir=None, topcell_name=None, optimize=None, generate=False,
+                 max_field_size=1000.0, stitching=False, statistics=False, beam_step=None, threads=None):
+    '''
+    Extract the EBL write fields of one layout file, and write the field control file.
+    generate: generate the EBL-Regions (generate_EBL_regions), instead of using those in the layout
+    stitching: save the features crossing the field boundaries (stitching_crossings)
+    statistics: save the pattern density and shot count of each field (EBL_field_statistics),
+      for a beam step size of beam_step (microns)
+    Returns (the filename that was written, number of fields, (stage travel, optimized stage travel) in microns)
+    '''
+    import pya
+    from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_EBL
+
+    ly = pya.Layout()
+    ly.read(file_in)
+
+    # find the top cell
+    if topcell_name:
+        topcell = ly.cell(topcell_name)
+        if topcell is None:
+            raise Exception("Top cell %s not found in %s." % (topcell_name, file_in))
+    elif len(ly.top_cells()) == 1:
+        topcell = ly.top_cells()[0]
+    else:
+        raise Exception("You may only have one top cell in your hierarchy (%s). Choose the top cell using --topcell." % file_in)
+
+    if generate:
+        SiEPICfab_ZEP_EBL.generate_EBL_regions(topcell, max_field_size=max_field_size)
+    fields, travel = SiEPICfab_ZEP_EBL.extract_EBL_regions(topcell, optimize=optimize, max_field_size=max_field_size)
+    if not fields:
+        raise Exception("No EBL-Regions found in %s." % file_in)
+
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(file_in))
+    name = os.path.join(output_dir, os.path.splitext(os.path.basename(file_in))[0])
+    file_out = name+'_%s' % extra
+    SiEPICfab_ZEP_EBL.write_EBL_fields(fields, ly.dbu, file_out)
+
+    if stitching:
+        crossings = SiEPICfab_ZEP_EBL.stitching_crossings(topcell, fields, threads=threads)
+        SiEPICfab_ZEP_EBL.write_stitching_report(topcell, crossings, file_rdb=name+'_stitching.lyrdb',
+                                                 file_csv=name+'_stitching.csv')
+    if statistics:
+        SiEPICfab_ZEP_EBL.write_EBL_field_statistics(
+            SiEPICfab_ZEP_EBL.EBL_field_statistics(topcell, fields, beam_step=beam_step, threads=threads),
+            os.path.splitext(file_out)[0]+'_stats.csv')
+    return file_out, len(fields), travel
+
+
+def _extract_file_worker(args):
+    file_in, kwargs = args
+    t0 = time.time()
+    try:
+        result = extract_file(file_in, **kwargs)
+        return (file_in,) + result + (time.time()-t0, None)
+    except Exception as e:
+        return file_in, None, 0, None, time.time()-t0, '%s: %s' % (type(e).__name__, e)
+
+
+def extract_files(files_in, processes=None, **kwargs):
+    '''
+    Extract the EBL write fields of many layout files, in a pool of worker processes.
+    kwargs are passed to extract_file.
+    Returns a list of (file_in, file_out, fields, travel, seconds, error), in the order of files_in.
+    '''
+    jobs = [(f, kwargs) for f in files_in]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [_extract_file_worker(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_extract_file_worker, jobs))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m siepicfab_ebeam_zep.extract_EBL_regions',
+        description='Extract the EBL write field regions of layouts for SiEPICfab-EBeam-ZEP, without the KLayout GUI.')
+    parser.add_argument('files', nargs='+', help='input layouts (GDS or OASIS)')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='folder for the field control files (default: next to each input)')
+    parser.add_argument('--topcell', default=None,
+                        help='name of the top cell (default: the single top cell)')
+    parser.add_argument('--optimize', action='store_true', default=None,
+                        help='optimize the write order for the stage travel (default: off)')
+    parser.add_argument('--generate', action='store_true',
+                        help='generate the EBL-Regions automatically, instead of using those in the layout')
+    parser.add_argument('--max-field-size', type=float, default=1000.0,
+                        help='maximum field width/height in microns (default: 1000)')
+    parser.add_argument('--stitching', action='store_true',
+                        help='save the features crossing the field boundaries (<input>_stitching.csv and .lyrdb)')
+    parser.add_argument('--statistics', action='store_true',
+                        help='save the pattern density and shot count of each field (<input>_EBLfields_stats.csv)')
+    parser.add_argument('--beam-step', type=float, default=None,
+                        help='beam step size in microns, for the shot count (default: 0.005)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='number of threads per layout, for the stitching analysis and statistics')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = extract_files(args.files, processes=args.processes,
+                            output_dir=args.output_dir, topcell_name=args.topcell,
+                            optimize=args.optimize, generate=args.generate,
+                            max_field_size=args.max_field_size, stitching=args.stitching,
+                            statistics=args.statistics, beam_step=args.beam_step, threads=args.threads)
+
+    errors = 0
+    for file_in, file_out, fields, travel, seconds, error in results:
+        if error:
+            errors += 1
+            print('FAILED  %s (%.1f s): %s' % (file_in, seconds, error))
+        else:
+            print('OK      %s -> %s, %s fields, stage travel %.3f mm (was %.3f mm) (%.1f s)' %
+                  (file_in, file_out, fields, travel[1]/1e3, travel[0]/1e3, seconds))
+    print('Extracted %s of %s layouts.' % (len(results)-errors, len(results)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -35,6 +35,7 @@ class ebeam_pcell_nanobeam_cavity(pya.PCellDeclarationHelper):
     self.param("pitch_scale", self.TypeDouble, "linear pitch scale (the m in y=mx+b) (unitless)", default=1.22)
     self.param("pitch_offset", self.TypeDouble, "linear pitch offset (the b in y=mx+b) (in nm)", default=308)
     self.param("n_vertices", self.TypeInt, "Vertices of a hole", default = 32)
+    self.param("hole_cells", self.TypeBoolean, "Hole cells (one cell per hole size, instantiated)", default = False)
     self.param("n_type", self.TypeInt, "1 if ZEP, 0 if HSQ", default = 0)  
     self.param("layer", self.TypeLayer, "Layer - Waveguide", default = TECHNOLOGY['Si_core'])
     self.param("cladlayer", self.TypeLayer, "Cladding Layer", default = TECHNOLOGY['Si_clad'])
@@ -185,15 +186,20 @@ class ebeam_pcell_nanobeam_cavity(pya.PCellDeclarationHelper):
     # ------------------------------------------------------------
     # Place all holes
     # ------------------------------------------------------------
-    for i in range(0, len(r)):
-        hole_cell = circle(0,0,r[i])
-        hole_poly = Polygon(hole_cell)  
-        hole_x = x_all[i]
-        hole_y = 0
-        hole_trans = Trans(Trans.R0,hole_x,hole_y)
-        hole_t = hole_poly.transformed(hole_trans)
-        hole.insert(hole_t)  
-        self.cell.shapes(LayerHighResHoles).insert(hole) 
+    if self.hole_cells:
+      # one cell per hole size, shared by the PCell variants, instantiated at x_all
+      insert_holes(self.cell, LayerHighResHoles, r, x_all, n_vertices)
+      hole_x = x_all[len(r)-1]
+    else:
+      for i in range(0, len(r)):
+          hole_cell = circle(0,0,r[i])
+          hole_poly = Polygon(hole_cell)  
+          hole_x = x_all[i]
+          hole_y = 0
+          hole_trans = Trans(Trans.R0,hole_x,hole_y)
+          hole_t = hole_poly.transformed(hole_trans)
+          hole.insert(hole_t)  
+      self.cell.shapes(LayerHighResHoles).insert(hole) 
 
     if n_type == 1:      
       trench_length = round(hole_x*2+16.666/dbu)
@@ -1,6 +1,7 @@
 # from . import *
 import pya
 from pya import *
+from . import insert_holes
 import math
 
 
@@ -32,6 +33,7 @@ class ebeam_pcell_taper_nanobeam_cw(pya.PCellDeclarationHelper):
 
 
         self.param("n_vertices", self.TypeInt, "Vertices of a hole", default=32)
+        self.param("hole_cells", self.TypeBoolean, "Hole cells (one cell per hole size, instantiated)", default=False)
         self.param("layer", self.TypeLayer, "Layer - Waveguide", default=TECHNOLOGY['Si_core'])
         self.param("cladlayer", self.TypeLayer, "Cladding Layer", default=TECHNOLOGY['Si_clad'])
         self.param("pinrec", self.TypeLayer, "PinRec Layer", default=TECHNOLOGY['PinRec'])
@@ -192,11 +194,15 @@ class ebeam_pcell_taper_nanobeam_cw(pya.PCellDeclarationHelper):
         x_all = x_neg + x_pos
         r_all = list(r_neg) + list(r_pos)
 
-        hole = Region()
-        for i in range(len(r_all)):
-            hole_poly = Polygon(circle(0, 0, r_all[i]))
-            hole.insert(hole_poly.transformed(Trans(Trans.R0, x_all[i], 0)))
-        self.cell.shapes(LayerHighResHoles).insert(hole)
+        if self.hole_cells:
+            # one cell per hole size, shared by the PCell variants, instantiated at x_all
+            insert_holes(self.cell, LayerHighResHoles, r_all, x_all, n_vertices)
+        else:
+            hole = Region()
+            for i in range(len(r_all)):
+                hole_poly = Polygon(circle(0, 0, r_all[i]))
+                hole.insert(hole_poly.transformed(Trans(Trans.R0, x_all[i], 0)))
+            self.cell.shapes(LayerHighResHoles).insert(hole)
 
         beam_l = max(abs(x_all[0]) if x_all else 0, abs(x_all[-1]) if x_all else 0) + wg_l
 
@@ -23,6 +23,7 @@ class BraggWaveguide_holes(pya.PCellDeclarationHelper):
     self.param("fill_factor", self.TypeDouble, "Grating fill factor", default = 0.5)     
     self.param("hole_width", self.TypeDouble, "Corrugration width (microns)", default = 0.07)     
     self.param("wg_width", self.TypeDouble, "Waveguide width", default = 0.35)     
+    self.param("unit_cell", self.TypeBoolean, "Unit cell (one period, instantiated in an array)", default = False)
     self.param("layer", self.TypeLayer, "Layer", default = pya.LayerInfo(1, 0))
     self.param("clad", self.TypeLayer, "Cladding Layer", default = TECHNOLOGY['Si_clad'])
     self.param("pinrec", self.TypeLayer, "PinRec Layer", default = TECHNOLOGY['PinRec'])
@@ -61,14 +62,22 @@ class BraggWaveguide_holes(pya.PCellDeclarationHelper):
     hole_width = to_itype(self.hole_width,dbu)
     fill_factor = self.fill_factor
     
-    for i in range(0,self.number_of_periods):
+    # the boxes of a period, at x = 0
+    boxes = [Box(0, -w/2, grating_period * (1-fill_factor), w/2),
+             Box(grating_period * (1-fill_factor), -hole_width/2, grating_period, -w/2),
+             Box(grating_period * (1-fill_factor), hole_width/2, grating_period, w/2)]
+
+    if self.unit_cell:
+      # one unit cell, placed with a regular CellInstArray of number_of_periods columns
+      cell_index = period_cells(ly, 'BraggWaveguide_holes_period', [LayerSiN], [boxes])[0]
+      self.cell.insert(CellInstArray(cell_index, Trans(), Vector(grating_period, 0), Vector(0, 0),
+                                     self.number_of_periods, 1))
+      length = self.number_of_periods * grating_period
+    else:
+      for i in range(0,self.number_of_periods):
         x = i * grating_period
-        box1 = Box(x, -w/2, x + grating_period * (1-fill_factor), w/2)
-        box2 = Box(x + grating_period * (1-fill_factor), -hole_width/2, x + grating_period, -w/2)
-        box3 = Box(x + grating_period * (1-fill_factor), hole_width/2, x + grating_period, w/2)
-        shapes(LayerSiN).insert(box1)
-        shapes(LayerSiN).insert(box2)
-        shapes(LayerSiN).insert(box3)
+        for box in boxes:
+          shapes(LayerSiN).insert(box.moved(x, 0))
         length = x + grating_period
 
     # Draw the cladding
@@ -1,2 +1,8 @@
 import os, sys
 import SiEPIC
+
+# unit cells shared by the PCell libraries, in pymacros/SiEPICfab_ZEP_unit_cells.py
+_pymacros = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if _pymacros not in sys.path:
+    sys.path.append(_pymacros)
+from SiEPICfab_ZEP_unit_cells import period_cells, insert_periods
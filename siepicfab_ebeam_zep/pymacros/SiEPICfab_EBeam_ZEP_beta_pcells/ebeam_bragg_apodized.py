@@ -1,6 +1,7 @@
 import pya
 from pya import *
 from SiEPIC.utils import get_technology_by_name
+from . import period_cells, insert_periods
 
 
 class ebeam_bragg_apodized(pya.PCellDeclarationHelper):
@@ -41,6 +42,12 @@ class ebeam_bragg_apodized(pya.PCellDeclarationHelper):
         )
         self.param("wg_width", self.TypeDouble, "Waveguide width", default=0.5)
         self.param("index", self.TypeDouble, "Gaussian Index", default=3)
+        self.param(
+            "unit_cells",
+            self.TypeBoolean,
+            "Unit cells (one cell per corrugation depth, instantiated)",
+            default=False,
+        )
         self.param("layer", self.TypeLayer, "Layer", default=TECHNOLOGY["Si_core"])
         self.param(
             "pinrec", self.TypeLayer, "PinRec Layer", default=TECHNOLOGY["PinRec"]
@@ -91,6 +98,9 @@ class ebeam_bragg_apodized(pya.PCellDeclarationHelper):
         half_corrugation_w = int(round(self.corrugation_width / 2 / dbu))
         misalignment = int(round(self.misalignment / dbu))
         N = self.number_of_periods
+        # the shapes of each period, at x = 0, and the position of each period
+        periods = []
+        period_x = []
         if self.sinusoidal:
             npoints_sin = 40
             for i in range(0, self.number_of_periods):
@@ -99,28 +109,19 @@ class ebeam_bragg_apodized(pya.PCellDeclarationHelper):
                     -0.5 * (2 * GaussianIndex * (i - N / 2) / (N)) ** 2
                 )
                 profile = int(round(self.corrugation_width / 2 / dbu)) * profileFunction
-                box1 = Box(x, 0, x + box_width, half_w + profile)
-                pts1 = [Point(x, 0)]
-                pts3 = [Point(x + misalignment, 0)]
+                pts1 = [Point(0, 0)]
+                pts3 = [Point(misalignment, 0)]
                 for i1 in range(0, npoints_sin + 1):
                     x1 = i1 * 2 * math.pi / npoints_sin
                     y1 = round(profile * math.sin(x1))
                     x1 = round(x1 / 2 / math.pi * grating_period)
                     #          print("x: %s, y: %s" % (x1,y1))
-                    pts1.append(Point(x + x1, half_w + y1))
-                    pts3.append(Point(x + misalignment + x1, -half_w - y1))
-                pts1.append(Point(x + grating_period, 0))
-                pts3.append(Point(x + grating_period + misalignment, 0))
-                shapes(LayerSiN).insert(Polygon(pts1))
-                shapes(LayerSiN).insert(Polygon(pts3))
-            length = x + grating_period + misalignment
-            if misalignment > 0:
-                # extra piece at the end:
-                box2 = Box(x + grating_period, 0, length, half_w)
-                shapes(LayerSiN).insert(box2)
-                # extra piece at the beginning:
-                box3 = Box(0, 0, misalignment, -half_w)
-                shapes(LayerSiN).insert(box3)
+                    pts1.append(Point(x1, half_w + y1))
+                    pts3.append(Point(misalignment + x1, -half_w - y1))
+                pts1.append(Point(grating_period, 0))
+                pts3.append(Point(grating_period + misalignment, 0))
+                periods.append([Polygon(pts1), Polygon(pts3)])
+                period_x.append(x)
 
         else:
             for i in range(0, self.number_of_periods):
@@ -130,29 +131,43 @@ class ebeam_bragg_apodized(pya.PCellDeclarationHelper):
                     -0.5 * (2 * GaussianIndex * (i - N / 2) / (N)) ** 2
                 )
                 profile = int(round(self.corrugation_width / 2 / dbu)) * profileFunction
-                box1 = Box(x, 0, x + box_width, half_w + profile)
-                box2 = Box(x + box_width, 0, x + grating_period, half_w - profile)
+                box1 = Box(0, 0, box_width, half_w + profile)
+                box2 = Box(box_width, 0, grating_period, half_w - profile)
                 box3 = Box(
-                    x + misalignment, 0, x + box_width + misalignment, -half_w - profile
+                    misalignment, 0, box_width + misalignment, -half_w - profile
                 )
                 box4 = Box(
-                    x + box_width + misalignment,
+                    box_width + misalignment,
                     0,
-                    x + grating_period + misalignment,
+                    grating_period + misalignment,
                     -half_w + profile,
                 )
-                shapes(LayerSiN).insert(box1)
-                shapes(LayerSiN).insert(box2)
-                shapes(LayerSiN).insert(box3)
-                shapes(LayerSiN).insert(box4)
-            length = x + grating_period + misalignment
-            if misalignment > 0:
-                # extra piece at the end:
-                box2 = Box(x + grating_period, 0, length, half_w)
-                shapes(LayerSiN).insert(box2)
-                # extra piece at the beginning:
-                box3 = Box(0, 0, misalignment, -half_w)
-                shapes(LayerSiN).insert(box3)
+                periods.append([box1, box2, box3, box4])
+                period_x.append(x)
+
+        if self.unit_cells:
+            # one child cell per distinct corrugation depth (the profile on the dbu grid),
+            # placed with CellInstArray runs
+            keys = [" ".join(str(s) for s in period) for period in periods]
+            distinct = dict(zip(keys, periods))
+            cells = period_cells(
+                ly, "ebeam_bragg_apodized_period", [LayerSiN], distinct.values()
+            )
+            cells = dict(zip(distinct, cells))
+            insert_periods(self.cell, [cells[key] for key in keys], period_x)
+        else:
+            for x, period in zip(period_x, periods):
+                for shape in period:
+                    shapes(LayerSiN).insert(shape.moved(x, 0))
+
+        length = x + grating_period + misalignment
+        if misalignment > 0:
+            # extra piece at the end:
+            box2 = Box(x + grating_period, 0, length, half_w)
+            shapes(LayerSiN).insert(box2)
+            # extra piece at the beginning:
+            box3 = Box(0, 0, misalignment, -half_w)
+            shapes(LayerSiN).insert(box3)
 
                 # Draw the cladding
         path = Path([Point(0, 0), Point(length, 0)], 4/dbu + w)
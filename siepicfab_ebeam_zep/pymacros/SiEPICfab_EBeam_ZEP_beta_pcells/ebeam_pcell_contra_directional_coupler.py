@@ -3,10 +3,64 @@ Author:   Mustafa Hammood, 2023
           Mustafa@siepic.com; mustafa.hammood@dreamphotonics.com; mustafa@ece.ubc.ca
 """
 
+import math
+import numpy as np
 import pya
 from pya import *
 from SiEPIC.utils import get_technology_by_name
 from SiEPIC.utils.layout import make_pin, make_devrec_label
+from . import period_cells, insert_periods
+
+
+def _apodization(N, GaussianIndex):
+    # Gaussian apodization profile of each period (math.exp, so the profile is the same in every numpy version)
+    return np.array([math.exp(-0.5*(2*GaussianIndex*(i-N/2)/(N))**2) for i in range(N)])
+
+
+def _period_x(N, grating_period, dbu):
+    # start of each period, in dbu
+    return np.rint(np.arange(N)*grating_period/dbu)
+
+
+def _boxes(N, boxes):
+    '''
+    Boxes of the N periods of a grating
+    boxes: (left, bottom, right, top) of each box in a period at x = 0, as arrays over the periods or numbers;
+    the coordinates are truncated to integers, as in pya.Box(float, ...)
+    Returns the boxes of each distinct period, and the distinct period of each period
+    '''
+    coords = np.empty((N, len(boxes), 4))
+    for j, box in enumerate(boxes):
+        for k, c in enumerate(box):
+            coords[:, j, k] = c
+    coords, period = np.unique(np.trunc(coords).astype(np.int64).reshape(N, -1), axis=0, return_inverse=True)
+    return [[pya.Box(*b) for b in c.reshape(-1, 4).tolist()] for c in coords], period.ravel().tolist()
+
+
+def _sinusoids(profile, grating_period, npoints_sin, sides):
+    '''
+    Sinusoidal corrugations of the periods of a grating, one polygon per side:
+    from (offset, y0), along y1 + sign * round(profile * sin), to (grating_period + offset, y0), at x = 0
+    sides: (offset, y0, y1, sign) of each side
+    Returns the polygons of each distinct period, and the distinct period of each period
+    '''
+    phase = [i1 * 2 * math.pi / npoints_sin for i1 in range(0, npoints_sin+1)]
+    sin = np.array([math.sin(x1) for x1 in phase])
+    x1 = [0] + [round(x1/2/math.pi*grating_period) for x1 in phase] + [grating_period]
+    # the periods with the same corrugation on the dbu grid share their polygons
+    y1, period = np.unique(np.rint(profile[:, None]*sin[None, :]), axis=0, return_inverse=True)
+    zero = np.zeros((len(y1), 1))
+    polygons = []
+    for offset, y0, y_side, sign in sides:
+        x = [x + offset for x in x1]
+        y = np.hstack([zero + y0, y_side + y1 if sign > 0 else y_side - y1, zero + y0])
+        polygons.append([pya.Polygon([pya.Point(*p) for p in zip(x, row)]) for row in y.tolist()])
+    return [list(shapes) for shapes in zip(*polygons)], period.ravel().tolist()
+
+
+def _periods(shapes, period, period_x):
+    # Region of the periods of a grating: the shapes of the distinct periods, moved to each period
+    return pya.Region([shape.moved(x, 0) for k, x in zip(period, period_x) for shape in shapes[k]])
 
 
 class ebeam_pcell_contra_directional_coupler(pya.PCellDeclarationHelper):
@@ -35,6 +89,8 @@ class ebeam_pcell_contra_directional_coupler(pya.PCellDeclarationHelper):
         self.param("sbend_length", self.TypeDouble, "S-bend length (microns)", default=11)
         self.param("apodization_index", self.TypeDouble,
                    "Gaussian Apodization Index", default=10.0)
+        self.param("unit_cells", self.TypeBoolean,
+                   "Unit cells (one cell per corrugation depth, instantiated)", default=False)
         self.param("port_w", self.TypeDouble, "Port Waveguide width", default=0.5)
         self.param("accuracy", self.TypeBoolean,
                    "Simulation Accuracy (on = high, off = fast)", default=True, hidden=True)
@@ -103,67 +159,37 @@ class ebeam_pcell_contra_directional_coupler(pya.PCellDeclarationHelper):
 
         self.number_of_periods = int(self.number_of_periods)
         N = self.number_of_periods
+        # the gratings of all the periods are computed as arrays, see _boxes and _sinusoids:
+        # the shapes of each distinct period, the distinct period of each period, and the transformation
+        gratings = []
+        apodization = _apodization(N, GaussianIndex)
+        period_x = _period_x(N, self.grating_period, dbu)
         if self.sinusoidal:
             npoints_sin = 40
-            for i in range(0, self.number_of_periods):
-                x = (round((i * self.grating_period)/dbu))
-                profileFunction = math.exp(-0.5*(2*GaussianIndex*(i-N/2)/(N))**2)
-                profile = int(round(self.corrugation1_width/2/dbu))*profileFunction
-                box1 = Box(x, y_offset_top, x + box_width, y_offset_top + half_w+profile)
-                pts1 = [Point(x, y_offset_top)]
-                pts3 = [Point(x + misalignment, y_offset_top)]
-
-                for i1 in range(0, npoints_sin+1):
-                    x1 = i1 * 2 * math.pi / npoints_sin
-                    y1 = round(profile*math.sin(x1))
-                    x1 = round(x1/2/math.pi*grating_period)
-                    pts1.append(Point(x + x1, y_offset_top + half_w+y1))
-                    pts3.append(Point(x + misalignment + x1, y_offset_top - half_w-y1))
-
-                pts1.append(Point(x + grating_period, y_offset_top))
-                pts3.append(Point(x + grating_period + misalignment, y_offset_top))
-
-                shapes_wg += Polygon(pts1)
-                shapes_wg += Polygon(pts3)
-
-            length = x + grating_period + misalignment
-            if misalignment > 0:
-                # extra piece at the end:
-                box2 = Box(x + grating_period, y_offset_top, length, y_offset_top + half_w)
-                # extra piece at the beginning:
-                box3 = Box(0, y_offset_top, misalignment, y_offset_top - half_w)
-
-                shapes_wg += box2
-                shapes_wg += box3
-
+            profile = int(round(self.corrugation1_width/2/dbu))*apodization
+            gratings.append(_sinusoids(profile, grating_period, npoints_sin,
+                                       [(0, y_offset_top, y_offset_top + half_w, 1),
+                                        (misalignment, y_offset_top, y_offset_top - half_w, -1)]) + (Trans(),))
         else:
-            for i in range(0, self.number_of_periods):
-                x = int(round((i * self.grating_period)/dbu))
-
-                profileFunction = math.exp(-0.5*(2*GaussianIndex*(i-N/2)/(N))**2)
-                profile = int(round(self.corrugation1_width/2/dbu))*profileFunction
-
-                box1 = Box(x, y_offset_top, x + box_width, y_offset_top +
-                           to_itype(half_w+profile, dbu*1000))
-                box2 = Box(x + box_width, y_offset_top, x + grating_period,
-                           y_offset_top + to_itype(half_w-profile, dbu*1000))
-                box3 = Box(x + misalignment, y_offset_top, x + box_width +
-                           misalignment, y_offset_top + to_itype(-half_w-profile, dbu*1000))
-                box4 = Box(x + box_width + misalignment, y_offset_top, x + grating_period +
-                           misalignment, y_offset_top + to_itype(-half_w+profile, dbu*1000))
-
-                shapes_wg += box1
-                shapes_wg += box2
-                shapes_wg += box3
-                shapes_wg += box4
-            length = x + grating_period + misalignment
-            if misalignment > 0:
-                # extra piece at the end:
-                box2 = Box(x + grating_period, y_offset_top, length, y_offset_top + half_w)
-                shapes_wg += box2
-                # extra piece at the beginning:
-                box3 = Box(0, y_offset_top, misalignment, y_offset_top - half_w)
-                shapes_wg += box3
+            profile = int(round(self.corrugation1_width/2/dbu))*apodization
+            x = 0  # the periods are drawn at x = 0
+            gratings.append(_boxes(N, [
+                (x, y_offset_top, x + box_width, y_offset_top + np.rint((half_w+profile)/(dbu*1000))),
+                (x + box_width, y_offset_top, x + grating_period,
+                 y_offset_top + np.rint((half_w-profile)/(dbu*1000))),
+                (x + misalignment, y_offset_top, x + box_width + misalignment,
+                 y_offset_top + np.rint((-half_w-profile)/(dbu*1000))),
+                (x + box_width + misalignment, y_offset_top, x + grating_period + misalignment,
+                 y_offset_top + np.rint((-half_w+profile)/(dbu*1000)))]) + (Trans(),))
+        x = int(period_x[-1])
+        length = x + grating_period + misalignment
+        if misalignment > 0:
+            # extra piece at the end:
+            box2 = Box(x + grating_period, y_offset_top, length, y_offset_top + half_w)
+            shapes_wg += box2
+            # extra piece at the beginning:
+            box3 = Box(0, y_offset_top, misalignment, y_offset_top - half_w)
+            shapes_wg += box3
 
         vertical_offset = int(round(self.wg2_width/2/dbu))+int(round(self.gap/2/dbu))
 
@@ -182,60 +208,27 @@ class ebeam_pcell_contra_directional_coupler(pya.PCellDeclarationHelper):
         N = self.number_of_periods
         if self.sinusoidal:
             npoints_sin = 40
-            for i in range(0, self.number_of_periods):
-                x = (round((i * self.grating_period)/dbu))
-                profileFunction = math.exp(-0.5*(2*GaussianIndex*(i-N/2)/(N))**2)
-                profile = int(round(self.corrugation2_width/2/dbu))*profileFunction
-                box1 = Box(x, 0, x + box_width, -half_w+profile).transformed(t)
-                pts1 = [Point(x, 0)]
-                pts3 = [Point(x + misalignment, 0)]
-                for i1 in range(0, npoints_sin+1):
-                    x1 = i1 * 2 * math.pi / npoints_sin
-                    y1 = round(profile*math.sin(x1))
-                    x1 = round(x1/2/math.pi*grating_period)
-#          print("x: %s, y: %s" % (x1,y1))
-                    pts1.append(Point(x + x1, -half_w-y1))
-                    pts3.append(Point(x + misalignment + x1, +half_w+y1))
-                pts1.append(Point(x + grating_period, 0))
-                pts3.append(Point(x + grating_period + misalignment, 0))
-
-                shapes_wg += Polygon(pts1).transformed(t)
-                shapes_wg += Polygon(pts3).transformed(t)
-            length = x + grating_period + misalignment
-            if misalignment > 0:
-                # extra piece at the end:
-                box2 = Box(x + grating_period, 0, length, -half_w).transformed(t)
-                shapes_wg += box2
-                # extra piece at the beginning:
-                box3 = Box(0, 0, misalignment, half_w).transformed(t)
-                shapes_wg += box3
-
+            profile = int(round(self.corrugation2_width/2/dbu))*apodization
+            gratings.append(_sinusoids(profile, grating_period, npoints_sin,
+                                       [(0, 0, -half_w, -1), (misalignment, 0, +half_w, 1)]) + (t,))
         else:
-            for i in range(0, self.number_of_periods):
-                x = int(round((i * self.grating_period)/dbu))
-                profileFunction = math.exp(-0.5*(2*GaussianIndex*(i-N/2)/(N))**2)
-                profile = int(round(self.corrugation2_width/2/dbu))*profileFunction
-                box1 = Box(x, 0, x + box_width, -half_w-profile).transformed(t)
-                box2 = Box(x + box_width, 0, x + grating_period, -
-                           half_w+profile).transformed(t)
-                box3 = Box(x + misalignment, 0, x + box_width +
-                           misalignment, half_w+profile).transformed(t)
-                box4 = Box(x + box_width + misalignment, 0, x + grating_period +
-                           misalignment, half_w-profile).transformed(t)
-
-                shapes_wg += box1
-                shapes_wg += box2
-                shapes_wg += box3
-                shapes_wg += box4
-
-            length = x + grating_period + misalignment
-            if misalignment > 0:
-                # extra piece at the end:
-                box2 = Box(x + grating_period, 0, length, -half_w).transformed(t)
-                shapes_wg += box2
-                # extra piece at the beginning:
-                box3 = Box(0, 0, misalignment, half_w).transformed(t)
-                shapes_wg += box3
+            profile = int(round(self.corrugation2_width/2/dbu))*apodization
+            x = 0  # the periods are drawn at x = 0
+            gratings.append(_boxes(N, [
+                (x, 0, x + box_width, -half_w-profile),
+                (x + box_width, 0, x + grating_period, -half_w+profile),
+                (x + misalignment, 0, x + box_width + misalignment, half_w+profile),
+                (x + box_width + misalignment, 0, x + grating_period + misalignment, half_w-profile)]) + (t,))
+
+        x = int(period_x[-1])
+        length = x + grating_period + misalignment
+        if misalignment > 0:
+            # extra piece at the end:
+            box2 = Box(x + grating_period, 0, length, -half_w).transformed(t)
+            shapes_wg += box2
+            # extra piece at the beginning:
+            box3 = Box(0, 0, misalignment, half_w).transformed(t)
+            shapes_wg += box3
 
         # Create the pins on the waveguides, as short paths:
         from SiEPIC._globals import PIN_LENGTH as pin_length
@@ -356,9 +349,24 @@ class ebeam_pcell_contra_directional_coupler(pya.PCellDeclarationHelper):
         DevRecBox = box
         shapes(LayerDevRecN).insert(box)
 
+        # Draw the gratings: shapes_flat are the shapes inserted in the cell, shapes_wg all the waveguides
+        grating_x = period_x.astype(np.int64).tolist()
+        shapes_flat = shapes_wg.dup()
+        if not self.unit_cells or self.rib:
+            for period_shapes, period, trans in gratings:
+                shapes_wg += _periods(period_shapes, period, grating_x).transformed(trans)
+        if self.unit_cells:
+            # one child cell per distinct corrugation depth, placed with CellInstArray runs
+            layers = [LayerSiN] if self.rib == False else [LayerSiN, LayerRib]
+            for period_shapes, period, trans in gratings:
+                cells = period_cells(ly, "contra_directional_coupler_period", layers, period_shapes)
+                insert_periods(self.cell, [cells[k] for k in period], grating_x, trans)
+        else:
+            shapes_flat = shapes_wg
+
         # Draw the waveguide layer
         if self.rib == False:
-            shapes(LayerSiN).insert(shapes_wg)
+            shapes(LayerSiN).insert(shapes_flat)
         else:  # turn shape into a rib waveguide
             region_devrec = Region(DevRecBox)
             region_devrec2 = Region(DevRecBox).size(2500)
@@ -366,5 +374,5 @@ class ebeam_pcell_contra_directional_coupler(pya.PCellDeclarationHelper):
             shapeRib = shapes_rib.size(2000) - shapes_wg - (region_devrec2-region_devrec)
 
             shapes(LayerRib).insert(shapeRib)
-            shapes(LayerRib).insert(shapes_wg)
-            shapes(LayerSiN).insert(shapes_wg)
+            shapes(LayerRib).insert(shapes_flat)
+            shapes(LayerSiN).insert(shapes_flat)
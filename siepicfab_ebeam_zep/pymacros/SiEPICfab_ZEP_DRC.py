@@ -0,0 +1,232 @@
+'''
+Incremental Design Rule Check (DRC) for SiEPICfab-EBeam-ZEP
+Used by run_drc.py --incremental
+
+The local rules of SiEPICfab_EBeam_ZEP.lydrc (Si and metal width/space) are checked cell by cell:
+the markers of each cell are cached by a hash of the cell contents on the rule's layer (its own shapes
+and its instances, with the hashes of the child cells), so unchanged cells are not checked again.
+In a parent cell, only the interaction zones are checked on the flattened layout: the areas where
+the rule distance around two instances, or around an instance and the cell's own shapes, overlap.
+Outside of these zones, the markers are those of the child cells and of the own shapes.
+
+The markers are the edges of the violations (the edges of the edge pairs of the checks); after merging,
+they are the same as those of the check on the flat layout.
+'''
+
+import hashlib
+import json
+import os
+import sys
+import time
+import pya
+
+tol = 1e-3  # same as SiEPICfab_EBeam_ZEP.lydrc
+# rules checked incrementally: (name, layer, check, distance in microns, description)
+incremental_rules = [
+    ('Si_width', (1, 0), 'width', 0.06-tol, 'Si minimum feature size violation; min 60 nm'),
+    ('Si_space', (1, 0), 'space', 0.06-tol, 'Si minimum space violation; min 60 nm'),
+    ('M_width', (11, 0), 'width', 5.0, 'Metal minimum feature size violation; min 5 µm'),
+    ('M_space', (11, 0), 'space', 5.0, 'Metal minimum space violation; min 5 µm'),
+]
+angle_limit = 80
+
+
+def memory_mb():
+    '''
+    The memory (resident) and peak memory of this process, in MB; None if unknown.
+    '''
+    memory, peak = None, None
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    memory = int(line.split()[1])/1e3
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1])/1e3
+    else:
+        try:
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kB on Linux, bytes on macOS
+            peak = rss/1e6 if sys.platform == 'darwin' else rss/1e3
+        except ImportError:
+            pass
+    return memory, peak
+
+
+def check_markers(region, check, d):
+    '''
+    The markers (Edges) of a width or space check with distance d (dbu), on a Region.
+    '''
+    if check == 'width':
+        edge_pairs = region.width_check(d, ignore_angle=angle_limit)
+    elif check == 'space':
+        edge_pairs = region.space_check(d)
+    else:
+        raise Exception("Unknown check %s." % check)
+    return edge_pairs.edges().merged()
+
+
+def _shapes_hash(shapes):
+    # hash of the polygons on a layer of a cell, independent of their order
+    polygons = sorted(str(s.polygon) for s in shapes.each() if s.is_box() or s.is_polygon() or s.is_path())
+    if not polygons:
+        return None
+    return hashlib.sha1('\n'.join(polygons).encode()).hexdigest()
+
+
+def layer_hashes(layout, layer_index):
+    '''
+    The hash of the contents of each cell on a layer, {cell_index: (own shapes hash, cell hash)},
+    where the cell hash includes the instances and the hashes of the child cells.
+    Hashes are None for cells without shapes on the layer.
+    '''
+    hashes = {}
+    for ci in layout.each_cell_bottom_up():
+        cell = layout.cell(ci)
+        own = _shapes_hash(cell.shapes(layer_index))
+        insts = []
+        for inst in cell.each_inst():
+            child = hashes[inst.cell_index][1]
+            if child is not None:
+                insts.append('%s %s %s %s %s %s' % (child, inst.cplx_trans, inst.a, inst.b, inst.na, inst.nb))
+        if own is None and not insts:
+            hashes[ci] = (None, None)
+        else:
+            contents = '%s\n%s' % (own, '\n'.join(sorted(insts)))
+            hashes[ci] = (own, hashlib.sha1(contents.encode()).hexdigest())
+    return hashes
+
+
+class IncrementalDRC:
+    '''
+    Incremental DRC of the incremental_rules, with the markers of the cells cached in file_cache.
+    '''
+    version = 2
+
+    def __init__(self, file_cache=None):
+        self.file_cache = file_cache
+        self.cache = {}
+        if file_cache and os.path.exists(file_cache):
+            with open(file_cache) as f:
+                data = json.load(f)
+            if data.get('version') == self.version:
+                self.cache = data['markers']
+        self.used = {}
+        # number of cells and own shapes checked, and reused from the cache
+        self.checked = 0
+        self.reused = 0
+        # runtime and memory of each rule in the last run (see run_drc.read_rule_profile)
+        self.profile = {}
+
+    def save(self, file_cache=None):
+        '''
+        Save the markers of the cells of the last run.
+        '''
+        with open(file_cache or self.file_cache, 'w') as f:
+            json.dump({'version': self.version, 'markers': self.used}, f)
+
+    def _cached(self, key, compute):
+        # the markers of key, from the cache, or computed
+        if key in self.used:
+            return pya.Edges([pya.Edge.from_s(e) for e in self.used[key]])
+        if key in self.cache:
+            self.reused += 1
+            self.used[key] = self.cache[key]
+            return pya.Edges([pya.Edge.from_s(e) for e in self.cache[key]])
+        self.checked += 1
+        markers = compute()
+        self.used[key] = [str(e) for e in markers.each()]
+        return markers
+
+    def _cell_markers(self, cell, li, rule, check, d, hashes):
+        own_hash, cell_hash = hashes[cell.cell_index()]
+        if cell_hash is None:
+            return pya.Edges()
+        rule_key = '%s %s %s %s' % (rule, check, d, angle_limit)
+        return self._cached('%s cell %s' % (rule_key, cell_hash),
+                            lambda: self._compute_cell_markers(cell, li, rule, check, d, hashes, rule_key, own_hash))
+
+    def _compute_cell_markers(self, cell, li, rule, check, d, hashes, rule_key, own_hash):
+        layout = cell.layout()
+        own = pya.Region(cell.shapes(li))
+        if own_hash is None:
+            markers = pya.Edges()
+        else:
+            markers = self._cached('%s own %s' % (rule_key, own_hash), lambda: check_markers(own, check, d))
+
+        # the rule distance around each instance, and around the own shapes
+        halos = pya.Region()
+        halos.merged_semantics = False
+        own_halo = pya.Region()
+        for p in own.each():
+            own_halo.insert(p.bbox().enlarged(d, d))
+        for p in own_halo.merged().each():
+            halos.insert(p)
+        children = []
+        for inst in cell.each_inst():
+            child = layout.cell(inst.cell_index)
+            if hashes[inst.cell_index][1] is None:
+                continue
+            child_box = child.bbox(li).enlarged(d, d)
+            transformations = list(inst.cell_inst.each_cplx_trans())
+            for t in transformations:
+                halos.insert(t * child_box)
+            children.append((child, transformations))
+        if not children:
+            return markers.merged()
+
+        for child, transformations in children:
+            child_markers = self._cell_markers(child, li, rule, check, d, hashes)
+            for t in transformations:
+                markers += child_markers.transformed(t)
+
+        # the interaction zones are checked again on the flattened layout
+        zone = halos.merged(False, 2)
+        if zone.is_empty():
+            return markers.merged()
+        flat = pya.Region(pya.RecursiveShapeIterator(layout, cell, li, zone.sized(3*d), True))
+        return ((markers - zone) + (check_markers(flat, check, d) & zone)).merged()
+
+    def run(self, topcell, rules=None):
+        '''
+        Check the rules (default: incremental_rules) on topcell.
+        Returns {rule: markers (Edges, in dbu)}.
+        '''
+        layout = topcell.layout()
+        results = {}
+        hashes_of_layer = {}
+        for rule, layer, check, distance, description in rules or incremental_rules:
+            peak0 = memory_mb()[1]
+            t0 = time.time()
+            li = layout.find_layer(pya.LayerInfo(*layer))
+            if li is None:
+                results[rule] = pya.Edges()
+            else:
+                if li not in hashes_of_layer:
+                    hashes_of_layer[li] = layer_hashes(layout, li)
+                d = int(round(distance/layout.dbu))
+                results[rule] = self._cell_markers(topcell, li, rule, check, d, hashes_of_layer[li]).merged()
+            seconds = time.time()-t0
+            memory, peak = memory_mb()
+            self.profile[rule] = {'seconds': seconds, 'memory': memory, 'peak_memory': peak,
+                                  'peak_increase': None if peak is None else peak-peak0}
+        return results
+
+
+def write_markers(topcell, results, file_rdb, rules=None):
+    '''
+    Save the markers of IncrementalDRC.run in a marker database (in the top cell).
+    '''
+    dbu = topcell.layout().dbu
+    rdb = pya.ReportDatabase('SiEPICfab_EBeam_ZEP_PDK DRC (incremental)')
+    rdb.top_cell_name = topcell.name
+    rdb_cell = rdb.create_cell(topcell.name)
+    for rule, layer, check, distance, description in rules or incremental_rules:
+        category = rdb.create_category(rule)
+        category.description = description
+        for e in results.get(rule, pya.Edges()).each():
+            item = rdb.create_item(rdb_cell.rdb_id(), category.rdb_id())
+            item.add_value(e.to_dtype(dbu))
+    rdb.save(file_rdb)
+    return rdb
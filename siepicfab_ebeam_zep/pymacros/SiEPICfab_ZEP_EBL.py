@@ -0,0 +1,760 @@
+'''
+EBL Write Field Regions (layer EBL-Regions, 8100/0) for SiEPICfab-EBeam-ZEP
+Used by extract_EBL_regions.lym
+
+'''
+
+import bisect
+import csv
+import json
+import math
+import os
+import re
+import pya
+
+# Optimize the write order of the EBL fields to minimize the stage travel
+#  (off by default: the fields are written in the order of the original extraction)
+optimize_travel = False
+# 2-opt passes over the order of the clusters (skipped above max_2opt_clusters clusters)
+max_2opt_passes = 10
+max_2opt_clusters = 500
+# above this number of clusters, they are ordered in a serpentine raster instead of a nearest-neighbour path
+max_nn_clusters = 2000
+
+# Automatic EBL write fields (generate_EBL_regions)
+EBL_regions_layer = (8100, 0)
+# layers written by EBL, that the fields need to cover
+EBL_layers = [(1, 0), (1, 2), (100, 0), (101, 0)]
+# waveguide guiding paths, that the field boundaries should not cross
+waveguide_layer = (1, 99)
+waveguide_clearance = 2.0  # microns, in addition to half the waveguide width
+# grating regions: the DevRec of cells with these names, that the field boundaries should not cross
+devrec_layer = (68, 0)
+grating_cell_names = r'bragg|grating|contra|swg|nanobeam|gc'
+grating_weight = 1000  # a grating crossing costs as much as this many waveguide crossings
+# smallest field, as a fraction of the maximum field size (except the last row and column)
+min_field_fraction = 0.5
+# grid for the field boundaries, in microns (the field control file is in microns)
+field_grid = 1.0
+
+# Stitching analysis (stitching_crossings): layers checked for features crossing the field boundaries
+stitching_layers = [('Si_core', (1, 0)), ('Si_etch_highres', (100, 0)), ('Si_etch_highres_nobias', (101, 0))]
+# severity, by the feature width at the crossing (microns, less or equal); wider features are 'low'
+stitching_severity = [(0.15, 'critical'), (0.6, 'high'), (3.0, 'medium')]
+stitching_tile_size = 1000.0  # microns, tiles for the region engine
+
+# Field statistics (EBL_field_statistics): exposed layers, and beam step size for the shot count (microns)
+exposure_layers = [('Si_etch_highres', (100, 0)), ('Si_etch_highres_nobias', (101, 0))]
+beam_step_size = 0.005
+statistics_tile_size = 250.0  # microns, tiles for the region engine
+statistics_tile_border = 10.0  # microns, polygons are merged within the tile and its border
+
+# number of threads for the tiled region engine (None: number of cores)
+region_threads = None
+
+# EBL write time estimate (WriteTimeEstimate), for the fabrication layout (output of boolean_layer_operations)
+#  per exposure pass: beam current (nA), dose (uC/cm^2), and shot pitch (beam step size, microns)
+#  'high': Si_etch_highres (100/0); 'low': Si_etch_highres_nobias (101/0), a separate pass when HighandLowRes
+write_beam_conditions = {
+    'high': {'current': 2.0, 'dose': 300.0, 'shot_pitch': 0.005},
+    'low': {'current': 20.0, 'dose': 300.0, 'shot_pitch': 0.02},
+}
+field_settling_time = 0.5  # seconds, stage move and settling, per field and pass
+beam_change_time = 600.0  # seconds, to change the beam current between the passes
+max_shot_frequency = 50e6  # Hz, fastest beam deflection: the shortest time per shot
+
+
+def touching_EBL_regions(boxes):
+    '''
+    Find the pairs of touching boxes (sharing an edge or a corner), using a grid hash.
+    Raises an Exception if two boxes overlap.
+    Returns the list of neighbours of each box.
+    '''
+    neighbours = [[] for b in boxes]
+    if not boxes:
+        return neighbours
+
+    # grid size: the largest box, so each box is in at most 2x2 grid cells
+    grid = max(max(b.width(), b.height()) for b in boxes) or 1
+    cells = {}
+    for i, b in enumerate(boxes):
+        # closed intervals: touching boxes share a grid cell
+        for gx in range(b.left//grid, b.right//grid+1):
+            for gy in range(b.bottom//grid, b.top//grid+1):
+                cells.setdefault((gx, gy), []).append(i)
+
+    pairs = set()
+    for indexes in cells.values():
+        for n, i in enumerate(indexes):
+            a = boxes[i]
+            for j in indexes[n+1:]:
+                if (i, j) in pairs:
+                    continue
+                b = boxes[j]
+                if a.left <= b.right and b.left <= a.right and a.bottom <= b.top and b.bottom <= a.top:
+                    if a.left < b.right and b.left < a.right and a.bottom < b.top and b.bottom < a.top:
+                        raise Exception("Problem with the regions.  EBL-Regions are overlapping: %s, %s" % (a, b))
+                    pairs.add((i, j))
+                    neighbours[i].append(j)
+                    neighbours[j].append(i)
+    return neighbours
+
+
+def order_EBL_regions(boxes):
+    '''
+    Order the EBL write field regions so that touching fields are written sequentially.
+    Touching regions are grouped into clusters (union-find); each cluster starts with its lowest box
+    (the leftmost one, for equal bottoms), followed by the boxes touching the cluster so far, in rings
+    (a breadth-first search over the touching boxes); each ring is sorted by (bottom, left).
+    The clusters are in the order of their first box, sorted the same way.
+    Returns a list of (index in boxes, cluster number), in the write order.
+    '''
+    neighbours = touching_EBL_regions(boxes)
+
+    # union-find, to group the touching regions into clusters
+    parent = list(range(len(boxes)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, js in enumerate(neighbours):
+        for j in js:
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+    # the first box of each cluster: the lowest, then leftmost
+    def key(i):
+        return (boxes[i].bottom, boxes[i].left, i)
+    seeds = {}
+    for i in range(len(boxes)):
+        r = find(i)
+        if r not in seeds or key(i) < key(seeds[r]):
+            seeds[r] = i
+
+    order = []
+    visited = [False]*len(boxes)
+    for cluster_count, seed in enumerate(sorted(seeds.values(), key=key), 1):
+        visited[seed] = True
+        ring = [seed]
+        while ring:
+            order += [(i, cluster_count) for i in ring]
+            # the next ring: boxes touching the cluster, that are not yet in the cluster
+            next_ring = sorted(set(j for i in ring for j in neighbours[i] if not visited[j]), key=key)
+            for j in next_ring:
+                visited[j] = True
+            ring = next_ring
+    return order
+
+
+def _center(box):
+    return ((box.left+box.right)/2, (box.bottom+box.top)/2)
+
+
+def EBL_travel(boxes):
+    '''
+    Total stage travel (in dbu) between the centers of the fields, in the write order.
+    '''
+    points = [_center(b) for b in boxes]
+    return sum(math.hypot(p[0]-q[0], p[1]-q[1]) for p, q in zip(points, points[1:]))
+
+
+def _nearest_neighbour_path(points, start):
+    # open path through the points, starting at index start, always visiting the nearest point next
+    left = set(range(len(points)))
+    left.discard(start)
+    path = [start]
+    while left:
+        x, y = points[path[-1]]
+        path.append(min(left, key=lambda j: ((points[j][0]-x)**2+(points[j][1]-y)**2, j)))
+        left.discard(path[-1])
+    return path
+
+
+def _serpentine_path(points, band):
+    # path through the points in horizontal bands of height band, alternating left-right and right-left
+    y0 = min(p[1] for p in points)
+    def key(j):
+        row = int((points[j][1]-y0)//band)
+        return (row, points[j][0] if row % 2 == 0 else -points[j][0], points[j][1], j)
+    return sorted(range(len(points)), key=key)
+
+
+def _two_opt(points, path, max_passes):
+    # improve an open path by reversing segments, while the total length decreases
+    def d(i, j):
+        return math.hypot(points[i][0]-points[j][0], points[i][1]-points[j][1])
+    n = len(path)
+    for p in range(max_passes):
+        improved = False
+        for i in range(1, n-1):
+            for j in range(i+1, n):
+                # reverse path[i:j+1]: edges (i-1, i) and (j, j+1) become (i-1, j) and (i, j+1)
+                delta = d(path[i-1], path[j]) - d(path[i-1], path[i])
+                if j+1 < n:
+                    delta += d(path[i], path[j+1]) - d(path[j], path[j+1])
+                if delta < -1e-9:
+                    path[i:j+1] = path[i:j+1][::-1]
+                    improved = True
+        if not improved:
+            break
+    return path
+
+
+def optimize_EBL_order(boxes, order):
+    '''
+    Reorder the EBL write fields to minimize the stage travel, keeping the clusters of touching
+    fields from order_EBL_regions written back to back:
+     - the clusters are ordered using a nearest-neighbour path through their centers, improved by 2-opt
+       (for many clusters, in a serpentine raster)
+     - each cluster starts at its field nearest to the end of the previous cluster
+     - within a cluster, the next field is the nearest of the fields touching those already written,
+       so that every field is adjacent to a field written before it
+    Returns a list of (index in boxes, cluster number), in the write order.
+    '''
+    if not order:
+        return []
+    neighbours = touching_EBL_regions(boxes)
+    points = [_center(b) for b in boxes]
+
+    clusters = {}
+    for i, cluster in order:
+        clusters.setdefault(cluster, []).append(i)
+    clusters = list(clusters.values())
+
+    # order of the clusters, starting with the one nearest to the lower left corner of the fields
+    x0 = min(b.left for b in boxes)
+    y0 = min(b.bottom for b in boxes)
+    centers = []
+    for c in clusters:
+        centers.append((sum(points[i][0] for i in c)/len(c), sum(points[i][1] for i in c)/len(c)))
+    if len(clusters) > max_nn_clusters:
+        path = _serpentine_path(centers, max(b.height() for b in boxes))
+    else:
+        start = min(range(len(clusters)), key=lambda k: (math.hypot(centers[k][0]-x0, centers[k][1]-y0), k))
+        path = _nearest_neighbour_path(centers, start)
+        if len(path) <= max_2opt_clusters:
+            path = _two_opt(centers, path, max_2opt_passes)
+
+    new_order = []
+    position = (x0, y0)
+    for cluster_count, k in enumerate(path, 1):
+        # start at the field nearest to the stage position;
+        # for equal distances, the lowest field first, giving a serpentine raster on a grid of fields
+        def distance(i):
+            return ((points[i][0]-position[0])**2+(points[i][1]-position[1])**2, points[i][1], points[i][0], i)
+        i = min(clusters[k], key=distance)
+        frontier = set()
+        written = set()
+        while True:
+            new_order.append((i, cluster_count))
+            written.add(i)
+            frontier.discard(i)
+            frontier.update(j for j in neighbours[i] if j not in written)
+            position = points[i]
+            if not frontier:
+                break
+            i = min(frontier, key=distance)
+    return new_order
+
+
+def EBL_region_boxes(topcell, layer):
+    '''
+    Collect the EBL write field regions (boxes on layer), in the coordinates of the topcell.
+    Returns a list of pya.Box.
+    '''
+    boxes = []
+    iter = topcell.begin_shapes_rec(layer)
+    while not(iter.at_end()):
+        if iter.shape().is_box():
+            boxes.append(iter.shape().box.transformed(iter.itrans()))
+        iter.next()
+    return boxes
+
+
+def EBL_field_control_text(boxes, dbu):
+    '''
+    Manual field control file for the EBL system, with the boxes in the write order.
+    '''
+    lines = ['#MANUAL FIELD CONTROL FILE\n']
+    for count, b in enumerate(boxes, 1):
+        lines.append("%s\t%s\t%s\t%s\tR%s\n" % (int(b.left * dbu), int(b.bottom * dbu), int(b.right * dbu), int(b.top * dbu), count))
+    return ''.join(lines)
+
+
+def extract_EBL_regions(topcell, optimize=None, max_field_size=1000.0):
+    '''
+    Extract the EBL write field regions (EBL-Regions, 8100/0) of the topcell, in the write order:
+    touching fields sequentially (order_EBL_regions), optimized for the stage travel (optimize_EBL_order).
+    optimize: True/False, default optimize_travel
+    Returns (list of pya.Box in the write order, (stage travel, optimized stage travel) in microns)
+    '''
+    if optimize is None:
+        optimize = optimize_travel
+    ly = topcell.layout()
+    dbu = ly.dbu
+    li = ly.find_layer(pya.LayerInfo(*EBL_regions_layer))
+    boxes = EBL_region_boxes(topcell, li) if li is not None else []
+    for b in boxes:
+        if b.width()*dbu > max_field_size or b.height()*dbu > max_field_size:
+            raise Exception("Maximum region width/height of %s µm, exceeded: %s" % (max_field_size, b.to_dtype(dbu)))
+    order = order_EBL_regions(boxes)
+    travel = EBL_travel([boxes[i] for i, cluster in order])*dbu
+    if optimize:
+        order = optimize_EBL_order(boxes, order)
+    fields = [boxes[i] for i, cluster in order]
+    return fields, (travel, EBL_travel(fields)*dbu)
+
+
+def write_EBL_fields(fields, dbu, file_out):
+    '''
+    Write the manual field control file for the EBL system.
+    '''
+    with open(file_out, 'w') as f:
+        f.write(EBL_field_control_text(fields, dbu))
+
+
+def _EBL_keepout_boxes(topcell, clearance):
+    # boxes around the waveguide segments, and the grating regions, in the coordinates of the topcell
+    ly = topcell.layout()
+    waveguides, gratings = [], []
+    li = ly.find_layer(pya.LayerInfo(*waveguide_layer))
+    if li is not None:
+        iter = topcell.begin_shapes_rec(li)
+        while not(iter.at_end()):
+            shape = iter.shape()
+            if shape.is_path():
+                path = shape.path.transformed(iter.itrans())
+                hw = path.width//2 + clearance
+                pts = list(path.each_point())
+                for p, q in zip(pts, pts[1:]):
+                    waveguides.append(pya.Box(p, q).enlarged(hw, hw))
+            elif not shape.is_text():
+                waveguides.append(shape.bbox().transformed(iter.itrans()).enlarged(clearance, clearance))
+            iter.next()
+    li = ly.find_layer(pya.LayerInfo(*devrec_layer))
+    if li is not None:
+        names = re.compile(grating_cell_names, re.IGNORECASE)
+        iter = topcell.begin_shapes_rec(li)
+        while not(iter.at_end()):
+            if names.search(ly.cell(iter.cell_index()).name) and not iter.shape().is_text():
+                gratings.append(iter.shape().bbox().transformed(iter.itrans()))
+            iter.next()
+    return waveguides, gratings
+
+
+def _best_cut(waveguides, gratings, lo, hi, grid):
+    '''
+    Sweep for the cut position on the grid in [lo, hi] crossing the fewest keep-out intervals.
+    waveguides, gratings: (sorted starts, sorted ends) of closed intervals
+    For equal cost, the largest position, to make the fewest fields.
+    Returns (position, waveguide crossings, grating crossings)
+    '''
+    def crossings(intervals, x):
+        starts, ends = intervals
+        return bisect.bisect_right(starts, x) - bisect.bisect_left(ends, x)
+    # the cost is piecewise constant, and its lowest values end at hi or just before an interval starts
+    candidates = [hi]
+    for starts, ends in (waveguides, gratings):
+        candidates += [(a-1)//grid*grid for a in starts[bisect.bisect_left(starts, lo+1):bisect.bisect_right(starts, hi)]]
+    candidates = [x for x in candidates if x >= lo]
+    best = None
+    for x in candidates:
+        w, g = crossings(waveguides, x), crossings(gratings, x)
+        if best is None or (w+grating_weight*g, -x) < (best[1]+grating_weight*best[2], -best[0]):
+            best = (x, w, g)
+    return best
+
+
+def _cuts(lo, hi, max_size, grid, boxes_waveguides, boxes_gratings, horizontal):
+    # cut positions from lo to hi, with fields of up to max_size
+    def intervals(boxes):
+        if horizontal:
+            return sorted(b.bottom for b in boxes), sorted(b.top for b in boxes)
+        return sorted(b.left for b in boxes), sorted(b.right for b in boxes)
+    waveguides, gratings = intervals(boxes_waveguides), intervals(boxes_gratings)
+    cuts = [lo]
+    crossings = [0, 0]
+    min_size = int(max_size*min_field_fraction)
+    while hi - cuts[-1] > max_size:
+        x, w, g = _best_cut(waveguides, gratings, cuts[-1]+min_size, cuts[-1]+max_size, grid)
+        cuts.append(x)
+        crossings[0] += w
+        crossings[1] += g
+    cuts.append(hi)
+    return cuts, crossings
+
+
+def generate_EBL_regions(topcell, max_field_size=1000.0, replace=True):
+    '''
+    Generate the EBL write field regions (EBL-Regions, 8100/0) for the topcell, covering all
+    the shapes on the EBL layers, with fields of up to max_field_size (microns).
+    The layout is cut in columns, then each column in rows; each cut is placed by a sweep-line over
+    the Waveguide (1/99) guiding paths and the grating regions, to cross the fewest of them.
+    replace: remove the existing EBL-Regions boxes in the topcell and all the cells below it,
+      except in the library cells and PCell variants
+    Returns (list of pya.Box written, [waveguide crossings, grating crossings])
+    '''
+    ly = topcell.layout()
+    dbu = ly.dbu
+    layers = [li for li in (ly.find_layer(pya.LayerInfo(*l)) for l in EBL_layers) if li is not None]
+    extent = pya.Box()
+    for li in layers:
+        extent += topcell.bbox_per_layer(li)
+    if extent.empty():
+        raise Exception("No shapes on the EBL layers, in cell %s." % topcell.name)
+
+    # field boundaries on the grid
+    grid = max(1, int(round(field_grid/dbu)))
+    extent = pya.Box(extent.left//grid*grid, extent.bottom//grid*grid,
+                     -(-extent.right//grid)*grid, -(-extent.top//grid)*grid)
+    max_size = int(max_field_size/dbu)//grid*grid
+    if max_size <= 0:
+        raise Exception("The maximum field size (%s) is smaller than the field grid (%s)." % (max_field_size, field_grid))
+    waveguides, gratings = _EBL_keepout_boxes(topcell, int(round(waveguide_clearance/dbu)))
+
+    boxes = []
+    columns, crossings = _cuts(extent.left, extent.right, max_size, grid, waveguides, gratings, horizontal=False)
+    for x1, x2 in zip(columns, columns[1:]):
+        # only the keep-out regions within the column
+        column_waveguides = [b for b in waveguides if b.left <= x2 and b.right >= x1]
+        column_gratings = [b for b in gratings if b.left <= x2 and b.right >= x1]
+        rows, c = _cuts(extent.bottom, extent.top, max_size, grid, column_waveguides, column_gratings, horizontal=True)
+        crossings = [crossings[0]+c[0], crossings[1]+c[1]]
+        for y1, y2 in zip(rows, rows[1:]):
+            box = pya.Box(x1, y1, x2, y2)
+            # skip the empty fields
+            iter = pya.RecursiveShapeIterator(ly, topcell, layers, box, True)
+            if not iter.at_end():
+                boxes.append(box)
+
+    li = ly.layer(pya.LayerInfo(*EBL_regions_layer))
+    if replace:
+        # the fields are extracted hierarchically, so also those in the sub-cells;
+        # the library cells and PCell variants are not changed, since they are regenerated from their source
+        for ci in [topcell.cell_index()] + list(topcell.called_cells()):
+            cell = ly.cell(ci)
+            if not cell.is_proxy():
+                cell.shapes(li).clear()
+            elif not cell.shapes(li).is_empty():
+                print(' - warning: EBL-Regions in the library cell or PCell %s are kept' % cell.name)
+    shapes = topcell.shapes(li)
+    for box in boxes:
+        shapes.insert(box)
+    print(' - EBL write fields: %s, waveguide crossings: %s, grating crossings: %s' % (len(boxes), crossings[0], crossings[1]))
+    return boxes, crossings
+
+
+def stitching_severity_of(width):
+    '''
+    Severity of a feature of width (microns) crossing a field boundary:
+    a stitching offset is a larger fraction of narrower features.
+    '''
+    for max_width, severity in stitching_severity:
+        if width <= max_width:
+            return severity
+    return 'low'
+
+
+def stitching_crossings(topcell, fields=None, tile_size=None, threads=None):
+    '''
+    Find the features on the stitching_layers crossing the EBL write field boundaries.
+    fields: list of pya.Box, default: the EBL-Regions of the topcell
+    The field edges are intersected with the features in a tiled, multi-threaded region engine,
+    reading the hierarchy only within each tile.
+    The width at a crossing is the smaller of the feature length along the boundary
+    and across it (for features running along the boundary).
+    Returns a list of dict(layer, edge (pya.DEdge), width (microns), severity), the most severe first.
+    '''
+    ly = topcell.layout()
+    dbu = ly.dbu
+    if fields is None:
+        li = ly.find_layer(pya.LayerInfo(*EBL_regions_layer))
+        fields = EBL_region_boxes(topcell, li) if li is not None else []
+    if not fields:
+        return []
+    if tile_size is None:
+        tile_size = stitching_tile_size
+    if threads is None:
+        threads = region_threads or os.cpu_count() or 1
+
+    # the edges of all the fields; shared edges are found twice
+    edges = pya.Edges()
+    for b in fields:
+        edges.insert(pya.Edges(b))
+    # only the shapes near the field edges are read
+    search = pya.Region([pya.Box(e.bbox()).enlarged(1, 1) for e in edges.each()])
+
+    crossings = []
+    for name, layer in stitching_layers:
+        li = ly.find_layer(pya.LayerInfo(*layer))
+        if li is None or topcell.bbox_per_layer(li).empty():
+            continue
+        tp = pya.TilingProcessor()
+        tp.dbu = dbu
+        tp.tile_size(tile_size, tile_size)
+        tp.tile_border(1.0, 1.0)
+        tp.threads = threads
+        tp.input('features', pya.RecursiveShapeIterator(ly, topcell, li, search, False))
+        tp.input('edges', edges)
+        out = pya.Edges()
+        tp.output('out', out)
+        tp.queue('_output(out, edges.inside_part(features), true)')
+        tp.execute('Stitching analysis: %s' % name)
+
+        # join the pieces split at the tiles, and the shared edges of touching fields
+        out = pya.Edges([e if (e.p1.x, e.p1.y) < (e.p2.x, e.p2.y) else e.swapped_points() for e in out.each()]).merged()
+        for e in out.each():
+            # the feature width across the boundary, probing at the middle of the crossing, as far as its length
+            c = pya.Point((e.p1.x+e.p2.x)//2, (e.p1.y+e.p2.y)//2)
+            normal = pya.Vector(-e.dy(), e.dx())
+            probe = pya.Edge(c - normal, c + normal)
+            local = pya.Region(pya.RecursiveShapeIterator(ly, topcell, li, probe.bbox(), False))
+            across = [p.length() for p in pya.Edges(probe).inside_part(local).each() if p.contains(c)]
+            width = min([e.length()] + across)*dbu
+            crossings.append({'layer': name, 'edge': e.to_dtype(dbu), 'width': width,
+                              'severity': stitching_severity_of(width)})
+
+    ranks = [severity for w, severity in stitching_severity] + ['low']
+    crossings.sort(key=lambda c: (ranks.index(c['severity']), c['width']))
+    return crossings
+
+
+def write_stitching_report(topcell, crossings, file_rdb=None, file_csv=None, rdb=None):
+    '''
+    Save the stitching crossings as a marker database (file_rdb, .lyrdb) and/or a CSV file.
+    rdb: add the crossings to this pya.ReportDatabase (e.g., of a LayoutView), instead of a new one
+    Returns the pya.ReportDatabase
+    '''
+    if rdb is None:
+        rdb = pya.ReportDatabase("EBL stitching: features crossing the EBL-Regions boundaries")
+        rdb.top_cell_name = topcell.name
+    rdb_cell = rdb.cell_by_qname(topcell.name) or rdb.create_cell(topcell.name)
+    rdb_cat_stitching = rdb.create_category("EBL stitching")
+    rdb_cat_stitching.description = "Features crossing an EBL write field boundary, by severity"
+    categories = {}
+    for c in crossings:
+        if c['severity'] not in categories:
+            cat = rdb.create_category(rdb_cat_stitching, c['severity'])
+            cat.description = "Features crossing an EBL write field boundary, severity: %s" % c['severity']
+            categories[c['severity']] = cat
+        item = rdb.create_item(rdb_cell.rdb_id(), categories[c['severity']].rdb_id())
+        item.add_value(pya.RdbItemValue(c['edge']))
+        item.add_value(pya.RdbItemValue("%s, width: %.3f um" % (c['layer'], c['width'])))
+    if file_rdb:
+        rdb.save(file_rdb)
+    if file_csv:
+        with open(file_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['severity', 'layer', 'width_um', 'x1_um', 'y1_um', 'x2_um', 'y2_um'])
+            for c in crossings:
+                e = c['edge']
+                writer.writerow([c['severity'], c['layer'], '%.3f' % c['width'],
+                                 '%.3f' % e.p1.x, '%.3f' % e.p1.y, '%.3f' % e.p2.x, '%.3f' % e.p2.y])
+    return rdb
+
+
+class _FieldStatistics(pya.TileOutputReceiver):
+    # sums the [area, polygons, vertices] of the tiles
+    def __init__(self):
+        self.values = [0, 0, 0]
+
+    def put(self, ix, iy, tile, obj, dbu, clip):
+        for i in range(3):
+            self.values[i] += obj[i]
+
+
+# per tile: the area clipped to the tile, and the polygons clipped to the field, counted in
+# the tile containing their lower left corner (not interacting with the field to the left or below the tile)
+_statistics_script = '''
+var t = _tile.bbox;
+var f = _frame.bbox;
+var r = features & _frame;
+var own = r.interacting(_tile);
+own = t.left > f.left ? own.not_interacting(Region.new(Box.new(f.left-1, f.bottom-1, t.left, f.top+1))) : own;
+own = t.bottom > f.bottom ? own.not_interacting(Region.new(Box.new(f.left-1, f.bottom-1, f.right+1, t.bottom))) : own;
+_output(statistics, [(r & _tile).area, own.count, own.edges.count])
+'''
+
+
+def EBL_field_statistics(topcell, fields=None, beam_step=None, tile_size=None, threads=None, layers=None):
+    '''
+    Pattern density and shot count of each EBL write field, for the exposure_layers
+    (or layers: list of (name, (layer, datatype)), or (name, list of (layer, datatype)) for their union):
+    exposed area, density, polygon and vertex counts (after merging, and clipping to the field),
+    and the shot count for a beam step size of beam_step (microns), as area / beam_step^2.
+    Each field is processed in tiles, in a multi-threaded region engine.
+    fields: list of pya.Box, default: the EBL-Regions of the topcell, in the write order
+    Returns a list of dict(field (pya.DBox), shots, layers: {layer name: dict(area (um^2), density, polygons, vertices, shots)})
+    '''
+    ly = topcell.layout()
+    dbu = ly.dbu
+    if fields is None:
+        fields, travel = extract_EBL_regions(topcell)
+    if beam_step is None:
+        beam_step = beam_step_size
+    if tile_size is None:
+        tile_size = statistics_tile_size
+    if threads is None:
+        threads = region_threads or os.cpu_count() or 1
+    if layers is None:
+        layers = exposure_layers
+
+    statistics = []
+    for field in fields:
+        s = {'field': field.to_dtype(dbu), 'shots': 0, 'layers': {}}
+        for name, layer in layers:
+            values = [0, 0, 0]
+            lis = [ly.find_layer(pya.LayerInfo(*l)) for l in ([layer] if isinstance(layer[0], int) else layer)]
+            lis = [li for li in lis if li is not None and not topcell.bbox_per_layer(li).empty()]
+            if lis:
+                tp = pya.TilingProcessor()
+                tp.dbu = dbu
+                tp.frame = field.to_dtype(dbu)
+                tp.tile_size(tile_size, tile_size)
+                tp.tile_border(statistics_tile_border, statistics_tile_border)
+                tp.threads = threads
+                tp.input('features', pya.RecursiveShapeIterator(ly, topcell, lis, field, False))
+                receiver = _FieldStatistics()
+                tp.output('statistics', receiver)
+                tp.queue(_statistics_script)
+                tp.execute('EBL field statistics: %s' % name)
+                values = receiver.values
+            area = values[0]*dbu*dbu
+            shots = int(round(area/beam_step**2))
+            s['layers'][name] = {'area': area, 'density': area/(field.area()*dbu*dbu) if field.area() else 0,
+                                 'polygons': values[1], 'vertices': values[2], 'shots': shots}
+            s['shots'] += shots
+        statistics.append(s)
+    return statistics
+
+
+def write_EBL_field_statistics(statistics, file_csv):
+    '''
+    Save the field statistics (EBL_field_statistics) as a CSV file, one line per field,
+    numbered as in the field control file.
+    '''
+    names = [name for name, layer in exposure_layers]
+    with open(file_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        header = ['field', 'x1_um', 'y1_um', 'x2_um', 'y2_um']
+        for name in names:
+            header += ['%s_%s' % (name, c) for c in ['area_um2', 'density', 'polygons', 'vertices', 'shots']]
+        writer.writerow(header + ['shots'])
+        for count, s in enumerate(statistics, 1):
+            b = s['field']
+            row = ['R%s' % count, '%.3f' % b.left, '%.3f' % b.bottom, '%.3f' % b.right, '%.3f' % b.top]
+            for name in names:
+                l = s['layers'][name]
+                row += ['%.3f' % l['area'], '%.5f' % l['density'], l['polygons'], l['vertices'], l['shots']]
+            writer.writerow(row + [s['shots']])
+
+
+class WriteTimeEstimate:
+    '''
+    EBL write time estimate, for a fabrication layout (the output of boolean_layer_operations):
+    for each exposure pass, the shots (area / shot pitch^2) times the dwell time
+    (dose x shot pitch^2 / current, at least 1 / max_shot_frequency), plus the settling time of
+    each field with shapes; plus the beam current changes between the passes.
+    The exposed areas of the fields are computed once (and can be saved and loaded), and
+    estimate() only evaluates the time model, for fast what-if runs (beam conditions, HighandLowRes).
+    The layout needs the Si_etch_highres layers exported with HighandLowRes, for both options.
+    '''
+    version = 1
+    layers = {'high': (100, 0), 'low': (101, 0)}
+
+    def __init__(self, topcell=None, fields=None, tile_size=None, threads=None, statistics=None):
+        '''
+        topcell: of the fabrication layout; fields: default: its EBL-Regions
+        statistics: the cached areas (from load), instead of topcell
+        '''
+        if statistics is None:
+            layers = [('high', self.layers['high']), ('low', self.layers['low']),
+                      ('high+low', [self.layers['high'], self.layers['low']])]
+            statistics = []
+            for s in EBL_field_statistics(topcell, fields, tile_size=tile_size, threads=threads, layers=layers):
+                b = s['field']
+                statistics.append({'field': [b.left, b.bottom, b.right, b.top],
+                                   'area': {name: l['area'] for name, l in s['layers'].items()}})
+        self.statistics = statistics
+
+    def save(self, filename, parameters=None):
+        '''
+        Save the areas; parameters: what they were computed for (JSON), checked by load
+        '''
+        with open(filename, 'w') as f:
+            json.dump({'version': self.version, 'parameters': parameters, 'fields': self.statistics}, f)
+
+    @classmethod
+    def load(cls, filename, parameters=None):
+        '''
+        Load the cached areas; returns None if the file is from another version,
+        or was saved with other parameters.
+        '''
+        with open(filename) as f:
+            data = json.load(f)
+        if data.get('version') != cls.version or data.get('parameters') != parameters:
+            return None
+        return cls(statistics=data['fields'])
+
+    def estimate(self, HighandLowRes=True, beam_conditions=None, settling_time=None, change_time=None,
+                 shot_frequency=None):
+        '''
+        Estimate the write time; the arguments default to the module settings
+        (write_beam_conditions, field_settling_time, beam_change_time, max_shot_frequency).
+        HighandLowRes: True: Si_etch_highres_nobias is written in a separate 'low' pass;
+                       False: both layers are written in the 'high' pass
+        beam_conditions: {pass: dict(current, dose, shot_pitch)}, updating write_beam_conditions
+        Returns dict(seconds, beam_changes, passes: {pass: dict(seconds, exposure, settling, fields, shots, dwell)},
+                     fields: list of seconds per field)
+        '''
+        conditions = {name: dict(c) for name, c in write_beam_conditions.items()}
+        for name, c in (beam_conditions or {}).items():
+            conditions.setdefault(name, {}).update(c)
+        if settling_time is None:
+            settling_time = field_settling_time
+        if change_time is None:
+            change_time = beam_change_time
+        if shot_frequency is None:
+            shot_frequency = max_shot_frequency
+
+        passes = [('high', 'high'), ('low', 'low')] if HighandLowRes else [('high', 'high+low')]
+        result = {'seconds': 0, 'beam_changes': 0, 'passes': {}, 'fields': [0]*len(self.statistics)}
+        for name, area_name in passes:
+            c = conditions[name]
+            # dwell time per shot: uC/cm^2 x um^2 / nA = 1e-5 s
+            dwell = c['dose']*c['shot_pitch']**2/c['current']*1e-5
+            shot_time = max(dwell, 1/shot_frequency)
+            p = {'seconds': 0, 'exposure': 0, 'settling': 0, 'fields': 0, 'shots': 0, 'dwell': dwell}
+            for i, s in enumerate(self.statistics):
+                area = s['area'][area_name]
+                if area <= 0:
+                    continue
+                shots = area/c['shot_pitch']**2
+                seconds = shots*shot_time + settling_time
+                p['shots'] += shots
+                p['exposure'] += shots*shot_time
+                p['settling'] += settling_time
+                p['fields'] += 1
+                result['fields'][i] += seconds
+            p['seconds'] = p['exposure'] + p['settling']
+            result['passes'][name] = p
+            result['seconds'] += p['seconds']
+        # beam current changes, between the passes with shapes
+        result['beam_changes'] = max(0, len([p for p in result['passes'].values() if p['fields']]) - 1)
+        result['seconds'] += result['beam_changes']*change_time
+        return result
+
+    @staticmethod
+    def summary(result):
+        '''
+        Text summary of an estimate
+        '''
+        lines = []
+        for name, p in result['passes'].items():
+            lines.append('%-5s pass: %8.2f h  (%s fields, %.3g shots, dwell %.3g ns, exposure %.2f h, settling %.2f h)' % (
+                name, p['seconds']/3600, p['fields'], p['shots'], p['dwell']*1e9, p['exposure']/3600, p['settling']/3600))
+        lines.append('beam current changes: %s' % result['beam_changes'])
+        lines.append('total write time: %.2f h' % (result['seconds']/3600))
+        return '\n'.join(lines)
@@ -8,9 +8,392 @@ from pya import *
 # 2020/12: process currently only uses high resolution
 HighandLowRes = True
 
-def boolean_layer_operations(topcell_in, flatten=False):
+# Boolean engine used by boolean_layer_operations
+#  'ShapeProcessor': three ShapeProcessor passes per cell (original implementation)
+#  'Region': one Region pass per cell; cells without Si or etch shapes are skipped
+#  'Tiled': multi-threaded TilingProcessor on the flattened top cell (flatten=True only)
+# All engines produce the same geometry and polygons; 'Tiled' merges the results of the tiles once at the end.
+boolean_engines = ['ShapeProcessor', 'Region', 'Tiled']
+boolean_engine = 'ShapeProcessor'
+
+# Configure the 'Tiled' engine
+#  tile_size_um: tile width and height, in microns
+#  tile_border_um: minimum overlap between the tiles, in microns; raised to the largest input shape
+#  tile_threads: number of threads, None to use all the cores
+tile_size_um = 500.0
+tile_border_um = 1.0
+tile_threads = None
+
+# Layers copied from the design for the export: the boolean inputs (1/0, 1/2), and the layers
+# that are written to the fabrication file. Other layers (DevRec, PinRec, Waveguide, etc.) are
+# not copied, to reduce the memory and time of the copy. None: copy all the layers.
+copy_layers = [(1,0), (1,2), (100,0), (101,0), (11,0), (12,0), (13,0), (99,0), (8100,0), (10,0), (201,0)]
+
+# Cell names longer than 64 characters
+#  True: renamed to a short name with a stable hash, listed in <file>_cellnames.csv; always saved as OASIS
+#  False: the layout is saved as GDS, with the cell names truncated to 64 characters
+short_cellnames = True
+max_cellname_length = 64
+
+# Merge cells with identical geometry (after the boolean operations) before writing
+merge_identical_cells = False
+
+# Configure the export cache (ExportCache)
+#  cache_dir: folder for the cached boolean results, None to disable the cache
+#  cache_max_size_mb: size limit of the cache folder; least recently used results are evicted
+cache_dir = None
+cache_max_size_mb = 1000
+
+def boolean_cell_ShapeProcessor(layout, cell, layer_core, layer_clad, layer_etch_high, layer_etch_low):
+    # temporary layers
+    layer_temp = layout.layer(pya.LayerInfo(1, 455))
+    layer_temp2 = layout.layer(pya.LayerInfo(1, 456))
+
+    # shape containers            
+    shapes_etch_high = cell.shapes(layer_etch_high)
+    shapes_etch_low = cell.shapes(layer_etch_low)
+    shapes_core = cell.shapes(layer_core)
+    shapes_clad = cell.shapes(layer_clad)
+    shapes_temp = cell.shapes(layer_temp)
+    shapes_temp2 = cell.shapes(layer_temp2)
+
+    # NOT draw with clad
+    pya.ShapeProcessor().boolean(
+        layout,cell,layer_core,
+        layout,cell,layer_clad,
+        shapes_temp2,pya.EdgeProcessor.ModeBNotA,False,True,True)
+    shapes_core.clear()   
+    shapes_clad.clear()
+    
+    if not HighandLowRes:
+        # merge low etch layer, into high layer
+        pya.ShapeProcessor().boolean(
+            layout,cell,layer_etch_high,
+            layout,cell,layer_etch_low,
+            shapes_temp,pya.EdgeProcessor.ModeOr,False,True,True)
+        shapes_etch_high.clear()
+        shapes_etch_low.clear()
+                    
+        # OR etch with calculated etch
+        pya.ShapeProcessor().boolean(
+            layout,cell,layer_temp,
+            layout,cell,layer_temp2,
+            shapes_etch_high,pya.EdgeProcessor.ModeOr,False,True,True)
+    else:
+        # OR etch with calculated etch
+        pya.ShapeProcessor().boolean(
+            layout,cell,layer_etch_high,
+            layout,cell,layer_temp2,
+            shapes_etch_high,pya.EdgeProcessor.ModeOr,False,True,True)
+
+    shapes_temp.clear()
+    shapes_temp2.clear()
+
+def boolean_cell_Region(layout, cell, layer_core, layer_clad, layer_etch_high, layer_etch_low):
+    # shape containers            
+    shapes_etch_high = cell.shapes(layer_etch_high)
+    shapes_etch_low = cell.shapes(layer_etch_low)
+    shapes_core = cell.shapes(layer_core)
+    shapes_clad = cell.shapes(layer_clad)
+
+    if shapes_clad.is_empty() and shapes_etch_high.is_empty() \
+            and (HighandLowRes or shapes_etch_low.is_empty()):
+        # nothing to etch in this cell
+        shapes_core.clear()
+        return
+
+    # etch = (clad NOT core) OR etch, merged in a single pass
+    etch = pya.Region(shapes_clad) - pya.Region(shapes_core)
+    etch += pya.Region(shapes_etch_high)
+    if not HighandLowRes:
+        # merge low etch layer, into high layer
+        etch += pya.Region(shapes_etch_low)
+        shapes_etch_low.clear()
+    etch.min_coherence = True
+    etch.merge()
+
+    shapes_core.clear()   
+    shapes_clad.clear()
+    shapes_etch_high.clear()
+    for polygon in etch.each():
+        # same as the ShapeProcessor: no polygons with holes in the output
+        if polygon.holes():
+            polygon = polygon.resolved_holes()
+        shapes_etch_high.insert(polygon)
+
+def boolean_topcell_Tiled(layout, topcell, layer_core, layer_clad, layer_etch_high, layer_etch_low, tile_size=None, threads=None):
+    import os
+    if tile_size is None:
+        tile_size = tile_size_um
+    if threads is None:
+        threads = tile_threads or os.cpu_count() or 1
+
+    # the border is at least the largest input shape, so that a shape touching a tile is complete
+    # in the tile and its border; the border is the overlap between the tiles
+    tile_border = tile_border_um
+    for layer in [layer_core, layer_clad, layer_etch_high, layer_etch_low]:
+        shapes = pya.Region(topcell.shapes(layer))
+        shapes.merged_semantics = False
+        for polygon in shapes.with_bbox_max(int(tile_border / layout.dbu) + 1, None).each():
+            tile_border = max(tile_border, polygon.bbox().width() * layout.dbu, polygon.bbox().height() * layout.dbu)
+
+    tp = pya.TilingProcessor()
+    tp.dbu = layout.dbu
+    tp.tile_size(tile_size, tile_size)
+    tp.tile_border(tile_border, tile_border)
+    tp.threads = threads
+    tp.input("core", layout, topcell.cell_index(), layer_core)
+    tp.input("clad", layout, topcell.cell_index(), layer_clad)
+    tp.input("etch_high", layout, topcell.cell_index(), layer_etch_high)
+    tp.input("etch_low", layout, topcell.cell_index(), layer_etch_low)
+    tp.var("border", int(tile_border / layout.dbu))
+    etch = pya.Region()
+    tp.output("etch", etch)
+    # the result of a tile is complete up to the end of its border, where all the inputs are known;
+    # it is not clipped to the tile, and the overlapping results of the tiles are merged below
+    if HighandLowRes:
+        # OR etch with calculated etch
+        tp.queue("_output(etch, ((clad - core) + etch_high).merged & _tile.bbox.enlarged(border, border), false)")
+    else:
+        # merge low etch layer, into high layer, and OR with calculated etch
+        tp.queue("_output(etch, ((clad - core) + etch_high + etch_low).merged & _tile.bbox.enlarged(border, border), false)")
+    print(" - tiled boolean operations: %s um tiles, %s um borders, %s threads" % (tile_size, tile_border, threads))
+    tp.execute("SiEPICfab EBeam ZEP tiled boolean operations")
+    etch.min_coherence = True
+    etch.merge()
+
+    layout.clear_layer(layer_core)
+    layout.clear_layer(layer_clad)
+    layout.clear_layer(layer_etch_high)
+    if not HighandLowRes:
+        layout.clear_layer(layer_etch_low)
+    shapes_etch_high = topcell.shapes(layer_etch_high)
+    for polygon in etch.each():
+        # same as the ShapeProcessor: no polygons with holes in the output
+        if polygon.holes():
+            polygon = polygon.resolved_holes()
+        shapes_etch_high.insert(polygon)
+
+class ExportCache:
+    '''
+    Persistent on-disk cache of the boolean results, per cell.
+    The key is a hash of the cell's shapes on layers 1/0, 1/2, 100/0 and 101/0, and of the export settings,
+    so a cell is only processed again when its own geometry changes.
+    '''
+    version = 1
+
+    def __init__(self, cache_dir, max_size_mb=None):
+        import os
+        self.cache_dir = cache_dir
+        self.max_size_mb = cache_max_size_mb if max_size_mb is None else max_size_mb
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def key(self, cell, layers):
+        import hashlib
+        h = hashlib.sha1()
+        h.update(('SiEPICfab_ZEP_export cache v%s, dbu=%s, HighandLowRes=%s\n'
+                  % (self.version, cell.layout().dbu, HighandLowRes)).encode())
+        for layer in layers:
+            # the booleans don't depend on the order of the shapes
+            shapes = sorted(str(s) for s in cell.shapes(layer).each(pya.Shapes.SRegions))
+            h.update(('layer %s\n' % len(shapes)).encode())
+            h.update('\n'.join(shapes).encode())
+        return h.hexdigest()
+
+    def filename(self, key):
+        import os
+        return os.path.join(self.cache_dir, key[0:2], key + '.txt')
+
+    def load(self, key, cell, layer_etch_high):
+        import os
+        filename = self.filename(key)
+        try:
+            with open(filename) as f:
+                polygons = [pya.Polygon.from_s(line) for line in f if line.strip()]
+        except OSError:
+            self.misses += 1
+            return False
+        shapes = cell.shapes(layer_etch_high)
+        shapes.clear()
+        for polygon in polygons:
+            shapes.insert(polygon)
+        # mark as recently used
+        os.utime(filename)
+        self.hits += 1
+        return True
+
+    def store(self, key, cell, layer_etch_high):
+        import os
+        filename = self.filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # write to a temporary file first, so that parallel exports never read a partial result
+        filename_temp = '%s.%s' % (filename, os.getpid())
+        with open(filename_temp, 'w') as f:
+            for s in cell.shapes(layer_etch_high).each(pya.Shapes.SRegions):
+                f.write('%s\n' % s.polygon)
+        os.replace(filename_temp, filename)
+
+    def evict(self):
+        # remove the least recently used results, to keep the cache within max_size_mb
+        import os
+        files = []
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # removed by another export running in parallel
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        size = sum(f[1] for f in files)
+        max_size = self.max_size_mb * 1e6
+        for mtime, file_size, path in sorted(files):
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                pass
+            size -= file_size
+        return size
+
+    def report(self):
+        size = self.evict()
+        total = self.hits + self.misses
+        print(" - export cache: %s hits, %s misses (%.0f%% hits), %s evicted, %.1f MB in %s"
+              % (self.hits, self.misses, 100.0*self.hits/total if total else 0,
+                 self.evicted, size/1e6, self.cache_dir))
+
+
+class ExportProfile:
+    '''
+    Profiling of the export: wall time of each phase (IP replacement, copy, flatten, booleans,
+    character replacement, write), and per cell, the boolean time and the polygon and vertex
+    counts on the Si and etch layers, before and after the booleans.
+    '''
+
+    def __init__(self):
+        import time
+        self.t0 = time.time()
+        self.phases = []
+        self.cells = []
+
+    def phase(self, name):
+        import time
+        from contextlib import contextmanager
+        @contextmanager
+        def timer():
+            start = time.time()
+            try:
+                yield
+            finally:
+                self.add_phase(name, start, time.time()-start)
+        return timer()
+
+    def add_phase(self, name, start, seconds):
+        self.phases.append({'name': name, 'start': start-self.t0, 'seconds': seconds})
+
+    @staticmethod
+    def count(cell, layers):
+        # number of polygons and vertices
+        polygons, vertices = 0, 0
+        for layer in layers:
+            for s in cell.shapes(layer).each(pya.Shapes.SRegions):
+                polygons += 1
+                vertices += 4 if s.is_box() else s.polygon.num_points()
+        return polygons, vertices
+
+    def add_cell(self, name, start, seconds, boolean_seconds, count_in, count_out):
+        self.cells.append({'name': name, 'start': start-self.t0, 'seconds': seconds,
+                           'boolean_seconds': boolean_seconds,
+                           'polygons_in': count_in[0], 'vertices_in': count_in[1],
+                           'polygons_out': count_out[0], 'vertices_out': count_out[1]})
+
+    def write(self, filename_json, filename_trace=None):
+        import json
+        with open(filename_json, 'w') as f:
+            json.dump({'phases': self.phases, 'cells': self.cells}, f, indent=1)
+        if filename_trace:
+            # Chrome trace format, for chrome://tracing or https://ui.perfetto.dev
+            events = []
+            for e in self.phases:
+                events.append({'name': e['name'], 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': e['start']*1e6, 'dur': e['seconds']*1e6})
+            for e in self.cells:
+                events.append({'name': e['name'], 'cat': 'cell', 'ph': 'X', 'pid': 1, 'tid': 2,
+                               'ts': e['start']*1e6, 'dur': e['seconds']*1e6,
+                               'args': {k: v for k, v in e.items() if k not in ['name', 'start', 'seconds']}})
+            with open(filename_trace, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def print_summary(self, top=10):
+        print(" - export profile:")
+        for e in self.phases:
+            print("   - %-24s %9.3f s" % (e['name'], e['seconds']))
+        cells = sorted(self.cells, key=lambda e: e['seconds'], reverse=True)[0:top]
+        if cells:
+            print("   - slowest cells:")
+            print("     %9s %9s %9s %11s %9s %11s  %s"
+                  % ('time (s)', 'boolean', 'poly in', 'vertex in', 'poly out', 'vertex out', 'cell'))
+            for e in cells:
+                print("     %9.4f %9.4f %9s %11s %9s %11s  %s"
+                      % (e['seconds'], e['boolean_seconds'], e['polygons_in'], e['vertices_in'],
+                         e['polygons_out'], e['vertices_out'], e['name']))
+
+
+def profile_phase(profile, name):
+    # time a phase of the export, if profiling
+    from contextlib import nullcontext
+    return profile.phase(name) if profile else nullcontext()
+
+
+def copy_tree_layers(topcell, topcell_in, layers):
+    '''
+    Copy the hierarchy of topcell_in into topcell (in a different layout), 
+    with the shapes on the selected layers only.
+    layers: list of (layer, datatype)
+    '''
+    layout = topcell.layout()
+    layout_in = topcell_in.layout()
+
+    # create the cells and instances
+    cell_mapping = pya.CellMapping()
+    cell_mapping.for_single_cell_full(layout, topcell.cell_index(), layout_in, topcell_in.cell_index())
+
+    # copy the shapes, only for the selected layers
+    layer_mapping = pya.LayerMapping()
+    for layer, datatype in layers:
+        layer_in = layout_in.find_layer(layer, datatype)
+        if layer_in is not None:
+            layer_mapping.map(layer_in, layout.layer(layer, datatype))
+    topcell.copy_tree_shapes(topcell_in, cell_mapping, layer_mapping)
+
+def boolean_layer_operations(topcell_in, flatten=False, engine=None, tile_size=None, threads=None, cache=None, profile=None):
+
+    if engine is None:
+        engine = boolean_engine
+    if engine not in boolean_engines:
+        raise Exception("Unknown boolean engine: %s. Choose one of: %s" % (engine, boolean_engines))
+    if engine == 'Tiled':
+        if not flatten:
+            raise Exception("The Tiled boolean engine requires a flat layout; use flatten=True.")
+        # the booleans are done on the top cell after flattening
+        boolean_cell = None
+    else:
+        boolean_cell = globals()['boolean_cell_%s' % engine]
+    if cache is None and cache_dir:
+        cache = ExportCache(cache_dir)
+    if cache is not None and not boolean_cell:
+        # the tiled engine processes a single flat cell, which is not worth caching
+        cache = None
 
     from pya import Layout
+    import time
     p = pya.AbsoluteProgress("SiEPICfab EBeam ZEP layer boolean operations")
     p.format_unit = topcell_in.layout().cells()+1
     
@@ -27,17 +410,26 @@ def boolean_layer_operations(topcell_in, flatten=False):
     layer_etch_low = layout.layer(pya.LayerInfo(101, 0))
     layer_core=layout.layer(pya.LayerInfo(1, 0))
     layer_clad = layout.layer(pya.LayerInfo(1, 2))
-    layer_temp = layout.layer(pya.LayerInfo(1, 455))
-    layer_temp2 = layout.layer(pya.LayerInfo(1, 456))
 
     # copy layout
-    topcell.copy_tree(topcell_in)    
+    with profile_phase(profile, 'copy'):
+        if copy_layers is None:
+            topcell.copy_tree(topcell_in)    
+        else:
+            copy_tree_layers(topcell, topcell_in, copy_layers)
     p.inc
     
     # flatten the layout
     if flatten:
-        topcell.flatten(-1, True)
+        with profile_phase(profile, 'flatten'):
+            topcell.flatten(-1, True)
+        if engine == 'Tiled':
+            with profile_phase(profile, 'booleans'):
+                boolean_topcell_Tiled(layout, topcell, layer_core, layer_clad, layer_etch_high, layer_etch_low,
+                                      tile_size=tile_size, threads=threads)
     
+    start_booleans = time.time()
+
     # scan through all cells
     for i in range(0,layout.cells()):
         if not layout.is_valid_cell_index(i):
@@ -52,110 +444,214 @@ def boolean_layer_operations(topcell_in, flatten=False):
             flag_longcellnames = True
             print("   - WARNING: too many characters in cell name")
 
-        # shape containers            
-        shapes_etch_high = cell.shapes(layer_etch_high)
-        shapes_etch_low = cell.shapes(layer_etch_low)
-        shapes_core = cell.shapes(layer_core)
-        shapes_clad = cell.shapes(layer_clad)
-        shapes_temp = cell.shapes(layer_temp)
-        shapes_temp2 = cell.shapes(layer_temp2)
+        if boolean_cell:
+            layers = [layer_core, layer_clad, layer_etch_high, layer_etch_low]
+            if profile:
+                start = time.time()
+                count_in = profile.count(cell, layers)
+            boolean_seconds = 0
+            if cache is None or all(cell.shapes(layer).is_empty() for layer in layers):
+                t0 = time.time()
+                boolean_cell(layout, cell, layer_core, layer_clad, layer_etch_high, layer_etch_low)
+                boolean_seconds = time.time()-t0
+            else:
+                key = cache.key(cell, layers)
+                if cache.load(key, cell, layer_etch_high):
+                    # same result as boolean_cell
+                    cell.shapes(layer_core).clear()
+                    cell.shapes(layer_clad).clear()
+                    if not HighandLowRes:
+                        cell.shapes(layer_etch_low).clear()
+                else:
+                    t0 = time.time()
+                    boolean_cell(layout, cell, layer_core, layer_clad, layer_etch_high, layer_etch_low)
+                    boolean_seconds = time.time()-t0
+                    cache.store(key, cell, layer_etch_high)
+            if profile:
+                profile.add_cell(cell.name, start, time.time()-start, boolean_seconds,
+                                 count_in, profile.count(cell, layers))
 
-        # NOT draw with clad
-        pya.ShapeProcessor().boolean(
-            layout,cell,layer_core,
-            layout,cell,layer_clad,
-            shapes_temp2,pya.EdgeProcessor.ModeBNotA,False,True,True)
-        shapes_core.clear()   
-        shapes_clad.clear()
-        
-        if not HighandLowRes:
-            # merge low etch layer, into high layer
-            pya.ShapeProcessor().boolean(
-                layout,cell,layer_etch_high,
-                layout,cell,layer_etch_low,
-                shapes_temp,pya.EdgeProcessor.ModeOr,False,True,True)
-            shapes_etch_high.clear()
-            shapes_etch_low.clear()
-                        
-            # OR etch with calculated etch
-            pya.ShapeProcessor().boolean(
-                layout,cell,layer_temp,
-                layout,cell,layer_temp2,
-                shapes_etch_high,pya.EdgeProcessor.ModeOr,False,True,True)
-        else:
-            # OR etch with calculated etch
-            pya.ShapeProcessor().boolean(
-                layout,cell,layer_etch_high,
-                layout,cell,layer_temp2,
-                shapes_etch_high,pya.EdgeProcessor.ModeOr,False,True,True)
-
-        shapes_temp.clear()
-        shapes_temp2.clear()
-        
         p.inc
         
     p.destroy
+    if profile:
+        profile.add_phase('booleans' if boolean_cell else 'cell names', start_booleans, time.time()-start_booleans)
+
+    if cache is not None:
+        cache.report()
 
     return layout, flag_longcellnames
 
 
 
-def export_for_fabrication(flatten=False, replace_IP=False):
- 
-    extra = "static" # what to append at the end of the filename.
-  
+def deduplicate_cells(topcell):
+    '''
+    Merge the cells that have identical geometry, e.g., PCell variants with different names.
+    Cells are compared bottom-up, using a hash of their shapes on all layers and of their instances,
+    and the instances of a duplicate cell are re-pointed to the first identical cell.
+    Returns the number of cells removed.
+    '''
+    import hashlib
+    layout = topcell.layout()
+    layers = [(li, str(layout.get_info(li))) for li in layout.layer_indexes()]
+
+    cells = {}  # hash -> cell index
+    duplicates = 0
+    called_cells = set(topcell.called_cells())
+    # child cells come first, so parents are compared with instances already re-pointed
+    for ci in [ci for ci in layout.each_cell_bottom_up() if ci in called_cells]:
+        cell = layout.cell(ci)
+        h = hashlib.sha1()
+        for li, name in layers:
+            shapes = cell.shapes(li)
+            if shapes.is_empty():
+                continue
+            h.update(('layer %s\n' % name).encode())
+            h.update('\n'.join(sorted(str(s) for s in shapes.each())).encode())
+        h.update(b'instances\n')
+        h.update('\n'.join(sorted(str(inst.cell_inst) for inst in cell.each_inst())).encode())
+        key = h.hexdigest()
+
+        if key not in cells:
+            cells[key] = ci
+            continue
+        # re-point the instances to the identical cell, and delete the duplicate
+        for parent_inst in list(cell.each_parent_inst()):
+            parent_inst.child_inst().cell_index = cells[key]
+        layout.delete_cell(ci)
+        duplicates += 1
+
+    print(" - deduplicate cells: %s identical cells merged" % duplicates)
+    return duplicates
+
+
+def shorten_cell_names(layout, max_length=None):
+    '''
+    Rename the cells with names longer than max_length characters,
+    to the beginning of the name followed by a hash of the full name, e.g., 
+    ebeam_pcell_contra_directional_coupler_1000N-320.0nm_period_..._3f2a9c1d
+    The names are deterministic: the same cell name is always renamed the same way.
+    Returns a dictionary {short name: original name}.
+    '''
+    import hashlib
+    if max_length is None:
+        max_length = max_cellname_length
+    names = {}
+    for cell in list(layout.each_cell()):
+        name = cell.name
+        if len(name) <= max_length:
+            continue
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        hash_length = 8
+        while True:
+            short_name = name[0:max_length-hash_length-1] + '_' + digest[0:hash_length]
+            if not layout.has_cell(short_name) and short_name not in names:
+                break
+            # name collision, use a longer hash
+            hash_length += 1
+        cell.name = short_name
+        names[short_name] = name
+    return names
+
+
+def load_IP_replacement_list(filename=None):
+    '''
+    Read the IP replacement list, default: replace_IP_cells.csv
+    Each line: black box cell name, replacement cell name, library; # for comments
+    '''
+    import os
+    if filename is None:
+        filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'replace_IP_cells.csv')
+    cell_list = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            fields = [field.strip() for field in line.split(',')]
+            if len(fields) != 3:
+                raise Exception("IP replacement list %s: expected 3 fields, found: %s" % (filename, line))
+            cell_list.append(fields)
+    return cell_list
+
+
+def replace_IP_cells(ly, cell_list=None):
+    '''
+    Replace the black box cells with the IP cells, in a single pass through the layout.
+    A black box cell matches with its exact name, or its name followed by $... 
+    (as for SiEPIC.scripts.replace_cell, Exact = False).
+    Each replacement cell is loaded from its library once, and all the instances are re-pointed to it;
+    the black box cells are then deleted.
+    cell_list: [black box cell name, replacement cell name, library], default: load_IP_replacement_list()
+    Returns the number of instances replaced.
+    '''
+    ly.technology_name='SiEPICfab_EBeam_ZEP'
+    if cell_list is None:
+        cell_list = load_IP_replacement_list()
+    replacements = {cell_x_name: (cell_y_name, cell_y_library) for cell_x_name, cell_y_name, cell_y_library in cell_list}
+
+    # index the cells to be replaced
+    cells_x = []
+    for cell in ly.each_cell():
+        name = cell.name
+        if name in replacements:
+            cells_x.append((cell.cell_index(), name))
+            continue
+        for i, c in enumerate(name):
+            if c == '$' and name[0:i] in replacements:
+                cells_x.append((cell.cell_index(), name[0:i]))
+                break
+
+    # replace the instances
+    cells_y = {}
+    count = 0
+    for cell_x_index, cell_x_name in cells_x:
+        cell_y_name, cell_y_library = replacements[cell_x_name]
+        if (cell_y_name, cell_y_library) not in cells_y:
+            cell_y = ly.create_cell(cell_y_name, cell_y_library)
+            if not cell_y:
+                raise Exception ('Cannot import cell %s from library %s' % (cell_y_name, cell_y_library))
+            cells_y[(cell_y_name, cell_y_library)] = cell_y.cell_index()
+        cell_x = ly.cell(cell_x_index)
+        print(" - IP replacement: %s, with cell %s (%s)" % (cell_x.name, cell_y_name, cell_y_library))
+        for parent_inst in list(cell_x.each_parent_inst()):
+            parent_inst.child_inst().cell_index = cells_y[(cell_y_name, cell_y_library)]
+            count += 1
+
+    # delete the black box cells, which are now unused top cells, with their sub-cells that are not used elsewhere
+    for cell_x_index, cell_x_name in cells_x:
+        if ly.is_valid_cell_index(cell_x_index) and ly.cell(cell_x_index).is_top():
+            ly.prune_cell(cell_x_index, -1)
+    return count
+
+
+def export_topcell_for_fabrication(topcell, file_out, flatten=False, replace_IP=False, engine=None, tile_size=None, threads=None, cache=None, profile=False, deduplicate=None):
+    '''
+    Export a top cell for fabrication, without using the KLayout application (GUI).
+    The extension of file_out is set by the file format (.oas, or .gds for long cell names).
+    profile: True (or an ExportProfile), to save <file_out>_profile.json and <file_out>_profile_trace.json
+    deduplicate: merge the cells with identical geometry, default: the merge_identical_cells setting
+    Returns the filename that was written.
+    '''
     import SiEPIC
-    from SiEPIC import _globals
-    from SiEPIC.utils import get_layout_variables
-    TECHNOLOGY, lv, ly, topcell = get_layout_variables()
     import os
 
-    # Save the layout prior to exporting, if there are changes.
-    mw = pya.Application.instance().main_window()
-    if mw.manager().has_undo():
-        mw.cm_save()
-    layout_filename = mw.current_view().active_cellview().filename()
+    if profile is True:
+        profile = ExportProfile()
 
-    if len(layout_filename) == 0:
-        raise Exception("Please save your layout before exporting.")
-   
-    # check if the currently selected cell is a top cell
-    if topcell in ly.top_cells():
-#    if topcell.name in [n.name for n in ly.top_cells()]:
-        if len(ly.top_cells()) > 1:
-            print(' - Warning: You may only have one top cell in your hierarchy. Clean up using SiEPIC > Layout > Delete Extra Top Cells.')
-            print(' - Warning: Exporting top cell: %s' % topcell.name)
-    else:
-        if len(ly.top_cells()) == 1:
-            # choose the single top cell for export
-            topcell = ly.top_cells()[0]
-        else:
-            raise Exception("You may only have one top cell in your hierarchy. \nClean up using SiEPIC > Layout > Delete Extra Top Cells. \nOr, select the desired top cell using Show as New Top.")
-        
     if replace_IP:
-        ly.technology_name='SiEPICfab_EBeam_ZEP'
-        cell_list = [
-        #['GC_1550_220_Blackbox', 'GC_1550_te_220', 'SiEPICfab_EBeam_ZEP_UBC'],
-        #['ebeam_gc_te1550', 'GC_1550_te_220', 'SiEPICfab_EBeam_ZEP_UBC'],
-        ['y_splitter_1310', 'drp_o_y_splitter', 'SiEPICfab_EBeam_ZEP_UBC'],
-        #['GC_1270_te_220_Blackbox','GC_1270_te_220', 'SiEPICfab_EBeam_ZEP_UBC'], 
-#        ['GC_1290_te_220_Blackbox','GC_1290_te_220', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        #['GC_1310_te_220_Blackbox','GC_1310_te_220', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ['GC_1550_te_220','ebeam_GC_Air_te1550', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ['ebeam_GC_Air_te1550_BB','ebeam_GC_Air_te1550', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ['ebeam_GC_Air_te1310_BB','ebeam_GC_Air_te1310', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ['GC_Air_te1310_BB','ebeam_GC_Air_te1310', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ['GC_TE_1550_8degOxide_BB','ebeam_GC_Air_te1550', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        #['ebeam_GC_Air_tm1310_BB','GC_1310_te_220', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ['laser_1310nm_DFB_BB','laser_1270nm_DFB', 'SiEPICfab_EBeam_ZEP_UBC'], 
-        ]
-        from SiEPIC.scripts import replace_cell
-        text_out = ''
-        for i in range(len(cell_list)):
-            text_out = replace_cell(ly, cell_x_name=cell_list[i][0], cell_y_name=cell_list[i][1], cell_y_library=cell_list[i][2], Exact = False)
-
-    ly, flag_longcellnames = boolean_layer_operations(topcell, flatten=flatten)
+        with profile_phase(profile, 'IP replacement'):
+            replace_IP_cells(topcell.layout())
+
+    ly, flag_longcellnames = boolean_layer_operations(topcell, flatten=flatten, engine=engine,
+                                                      tile_size=tile_size, threads=threads, cache=cache,
+                                                      profile=profile)
 
+    if deduplicate is None:
+        deduplicate = merge_identical_cells
+    if deduplicate and not flatten:
+        with profile_phase(profile, 'deduplication'):
+            deduplicate_cells(ly.top_cell())
 
     # Save the layout, without PCell info, for fabrication
     save_options = pya.SaveLayoutOptions()
@@ -163,6 +659,19 @@ def export_for_fabrication(flatten=False, replace_IP=False):
     # remove $$$CONTEXT_INFO$$$ PCells
     save_options.write_context_info=False  
 
+    if SiEPIC.__version__ < '0.3.73':
+        print(" - Warning: Please upgrade to SiEPIC-Tools version 0.3.73 or greater.")
+    else:
+        with profile_phase(profile, 'character replacement'):
+            ly.cell_character_replacement(forbidden_cell_characters = '=', replacement_cell_character = '_')
+
+    cellnames = {}
+    if flag_longcellnames and short_cellnames:
+        # rename the long cell names, so the layout can be saved as OASIS
+        cellnames = shorten_cell_names(ly)
+        flag_longcellnames = False
+        print(" - %s long cell names shortened" % len(cellnames))
+
     # file format
     if flag_longcellnames:
         # GDS save option allows for a max cell name
@@ -178,11 +687,6 @@ def export_for_fabrication(flatten=False, replace_IP=False):
         save_options.oasis_recompress = True
         save_options.oasis_substitution_char = "-"
 
-    if SiEPIC.__version__ < '0.3.73':
-        pya.MessageBox.warning("Errors", "Please upgrade to SiEPIC-Tools version 0.3.73 or greater.", pya.MessageBox.Ok)
-    else:
-        ly.cell_character_replacement(forbidden_cell_characters = '=', replacement_cell_character = '_')
-
     # only export the layers that will be fabricated
     save_options.add_layer(ly.layer(LayerInfo(100,0)), LayerInfo())# Si etch high res
     save_options.add_layer(ly.layer(LayerInfo(101,0)), LayerInfo())# Si etch low res
@@ -195,12 +699,75 @@ def export_for_fabrication(flatten=False, replace_IP=False):
     save_options.add_layer(ly.layer(LayerInfo(201,0)), LayerInfo())# Deep trench etch
 
     # filename
-    file_out = os.path.join(os.path.dirname(layout_filename), os.path.splitext(os.path.basename(layout_filename))[0]+'_%s.'%extra+save_options.format[0:3].lower())
+    file_out = os.path.splitext(file_out)[0]+'.'+save_options.format[0:3].lower()
     print("saving output %s: %s" % (save_options.format, file_out) )
 
     try:
-        ly.write(file_out,save_options)
+        with profile_phase(profile, 'write'):
+            ly.write(file_out,save_options)
     except:
         raise Exception("Problem exporting your layout.")
+
+    if cellnames:
+        # list of the renamed cells
+        import csv
+        filename = os.path.splitext(file_out)[0]+'_cellnames.csv'
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['cell name', 'original cell name'])
+            for short_name in sorted(cellnames):
+                writer.writerow([short_name, cellnames[short_name]])
+        print("saving cell names: %s" % filename)
+
+    if profile:
+        filename = os.path.splitext(file_out)[0]
+        profile.write(filename+'_profile.json', filename+'_profile_trace.json')
+        profile.print_summary()
+        print("saving profile: %s_profile.json, %s_profile_trace.json" % (filename, filename))
+
+    return file_out
+
+
+def export_for_fabrication(flatten=False, replace_IP=False, engine=None, tile_size=None, threads=None, profile=False):
+ 
+    extra = "static" # what to append at the end of the filename.
+  
+    import SiEPIC
+    from SiEPIC import _globals
+    from SiEPIC.utils import get_layout_variables
+    TECHNOLOGY, lv, ly, topcell = get_layout_variables()
+    import os
+
+    # Save the layout prior to exporting, if there are changes.
+    mw = pya.Application.instance().main_window()
+    if mw.manager().has_undo():
+        mw.cm_save()
+    layout_filename = mw.current_view().active_cellview().filename()
+
+    if len(layout_filename) == 0:
+        raise Exception("Please save your layout before exporting.")
+   
+    # check if the currently selected cell is a top cell
+    if topcell in ly.top_cells():
+#    if topcell.name in [n.name for n in ly.top_cells()]:
+        if len(ly.top_cells()) > 1:
+            print(' - Warning: You may only have one top cell in your hierarchy. Clean up using SiEPIC > Layout > Delete Extra Top Cells.')
+            print(' - Warning: Exporting top cell: %s' % topcell.name)
+    else:
+        if len(ly.top_cells()) == 1:
+            # choose the single top cell for export
+            topcell = ly.top_cells()[0]
+        else:
+            raise Exception("You may only have one top cell in your hierarchy. \nClean up using SiEPIC > Layout > Delete Extra Top Cells. \nOr, select the desired top cell using Show as New Top.")
+
+    if SiEPIC.__version__ < '0.3.73':
+        pya.MessageBox.warning("Errors", "Please upgrade to SiEPIC-Tools version 0.3.73 or greater.", pya.MessageBox.Ok)
+
+    # filename
+    file_out = os.path.join(os.path.dirname(layout_filename), os.path.splitext(os.path.basename(layout_filename))[0]+'_%s.oas'%extra)
+
+    file_out = export_topcell_for_fabrication(topcell, file_out, flatten=flatten, replace_IP=replace_IP,
+                                              engine=engine, tile_size=tile_size, threads=threads,
+                                              profile=profile)
  
     pya.MessageBox.warning("Success.", "Layout exported successfully: \n%s" %file_out, pya.MessageBox.Ok)
@@ -0,0 +1,88 @@
+'''
+Unit cells for the PCell libraries of SiEPICfab-EBeam-ZEP:
+the periods of the gratings (period_cells, insert_periods), and the holes of the
+nanobeam cavities (hole_cell, insert_holes), as cells shared by all the PCell variants of a layout.
+Imported by the PCell packages (SiEPICfab_EBeam_ZEP_*_pcells/__init__.py).
+'''
+
+import functools
+import hashlib
+import math
+import pya
+
+
+def period_cells(layout, name, layers, periods):
+    '''
+    Unit cells of a grating, one per distinct period geometry:
+    periods: list of the shapes of each distinct period, at x = 0, inserted on each of layers (layer indexes)
+    The cells are named name_<hash of the geometry>, and reused by all the cells (PCell variants)
+    with the same period geometry. Returns the list of cell indexes.
+    '''
+    info = ','.join(str(layout.get_info(li)) for li in layers)
+    cells = []
+    for shapes in periods:
+        key = '%s:%s' % (info, ';'.join(str(s) for s in shapes))
+        cell_name = '%s_%s' % (name, hashlib.sha1(key.encode()).hexdigest()[:12])
+        cell = layout.cell(cell_name)
+        if cell is None:
+            cell = layout.create_cell(cell_name)
+            for li in layers:
+                for s in shapes:
+                    cell.shapes(li).insert(s)
+        cells.append(cell.cell_index())
+    return cells
+
+
+def insert_periods(cell, cell_indexes, period_x, trans=pya.Trans()):
+    '''
+    Instances of the unit cells of a grating (period_cells) in cell:
+    period i is cell_indexes[i] at (period_x[i], 0), transformed by trans;
+    consecutive periods with the same unit cell and the same spacing make one CellInstArray
+    '''
+    i, N = 0, len(cell_indexes)
+    while i < N:
+        j = i + 1
+        if j < N and cell_indexes[j] == cell_indexes[i]:
+            dx = period_x[j] - period_x[i]
+            while j < N and cell_indexes[j] == cell_indexes[i] and period_x[j] - period_x[j-1] == dx:
+                j += 1
+        t = trans * pya.Trans(period_x[i], 0)
+        if j - i > 1:
+            cell.insert(pya.CellInstArray(cell_indexes[i], t, trans * pya.Vector(dx, 0), pya.Vector(), j - i, 1))
+        else:
+            cell.insert(pya.CellInstArray(cell_indexes[i], t))
+        i = j
+
+
+@functools.lru_cache(maxsize=None)
+def hole_polygon(r, n_vertices):
+    # hole of radius r (dbu) with n_vertices, centred at the origin, on the dbu grid
+    theta = 2 * math.pi / n_vertices  # increment, in radians
+    return pya.Polygon([pya.Point.from_dpoint(pya.DPoint(r * math.cos(i * theta), r * math.sin(i * theta)))
+                        for i in range(0, n_vertices)])
+
+
+def hole_cell(layout, layer, r, n_vertices):
+    '''
+    Cell with one hole (hole_polygon) on layer, named hole_<n_vertices>_<hash of the polygon>:
+    one cell per (radius, n_vertices) on the dbu grid, shared by all the cells (PCell variants) in layout
+    '''
+    polygon = hole_polygon(r, n_vertices)
+    key = '%s:%s' % (layout.get_info(layer), polygon)
+    cell_name = 'hole_%s_%s' % (n_vertices, hashlib.sha1(key.encode()).hexdigest()[:12])
+    cell = layout.cell(cell_name)
+    if cell is None:
+        cell = layout.create_cell(cell_name)
+        cell.shapes(layer).insert(polygon)
+    return cell.cell_index()
+
+
+def insert_holes(cell, layer, radii, x_all, n_vertices):
+    '''
+    Instances of the hole cells (hole_cell) in cell: hole i of radius radii[i] at (x_all[i], 0)
+    '''
+    cells = {}
+    for r, x in zip(radii, x_all):
+        if r not in cells:
+            cells[r] = hole_cell(cell.layout(), layer, r, n_vertices)
+        cell.insert(pya.CellInstArray(cells[r], pya.Trans(pya.Trans.R0, x, 0)))
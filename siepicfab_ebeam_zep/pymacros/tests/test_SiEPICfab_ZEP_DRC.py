@@ -0,0 +1,109 @@
+# Unit testing for the incremental DRC: SiEPICfab_ZEP_DRC
+
+import json
+import os
+import random
+import sys
+import tempfile
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(path, "../../..")))
+import siepicfab_ebeam_zep
+from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_DRC
+from siepicfab_ebeam_zep import run_drc
+
+
+def random_layout(seed=1):
+    # devices with Si and metal violations, in arrays and rotated instances that touch and overlap
+    random.seed(seed)
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    si, m = ly.layer(1, 0), ly.layer(11, 0)
+    top = ly.create_cell('TOP')
+    devices = []
+    for k in range(4):
+        c = ly.create_cell('device%s' % k)
+        for j in range(30):
+            x, y = random.randint(0, 20000), random.randint(0, 20000)
+            c.shapes(si).insert(pya.Box(x, y, x+random.randint(30, 3000), y+random.randint(30, 500)))
+        c.shapes(m).insert(pya.Box(0, 0, 4000, 20000))
+        c.shapes(m).insert(pya.Box(8000, 0, 20000, 3000))
+        devices.append(c)
+    block = ly.create_cell('block')
+    block.insert(pya.CellInstArray(devices[0].cell_index(), pya.Trans(), pya.Vector(20030, 0), pya.Vector(0, 20100), 3, 2))
+    block.insert(pya.CellInstArray(devices[1].cell_index(), pya.Trans(1, False, pya.Vector(100000, 0))))
+    block.shapes(si).insert(pya.Box(19900, 5000, 20100, 5040))
+    for i in range(6):
+        top.insert(pya.CellInstArray(block.cell_index(), pya.Trans(i % 4, i % 2 == 1, pya.Vector(i*130000, (i % 3)*51000))))
+    for k in range(5):
+        top.insert(pya.CellInstArray(devices[random.randint(0, 3)].cell_index(),
+                                     pya.Trans(random.randint(0, 3), random.random() < 0.5,
+                                               pya.Vector(random.randint(0, 300000), random.randint(0, 100000)))))
+    top.shapes(si).insert(pya.Path([pya.Point(-50000, 10000), pya.Point(800000, 10000)], 500))
+    top.shapes(m).insert(pya.Box(-40000, -2000, 900000, -1000))
+    return ly, top
+
+
+def flat_markers(topcell):
+    # the checks on the flat layout
+    ly = topcell.layout()
+    results = {}
+    for rule, layer, check, distance, description in SiEPICfab_ZEP_DRC.incremental_rules:
+        region = pya.Region(topcell.begin_shapes_rec(ly.layer(*layer)))
+        results[rule] = SiEPICfab_ZEP_DRC.check_markers(region, check, int(round(distance/ly.dbu))).merged()
+    return results
+
+
+def test_incremental_drc():
+    for seed in range(5):
+        ly, top = random_layout(seed)
+        results = SiEPICfab_ZEP_DRC.IncrementalDRC().run(top)
+        for rule, markers in flat_markers(top).items():
+            assert not markers.is_empty()
+            assert (results[rule] ^ markers).is_empty(), (seed, rule)
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_cache = os.path.join(folder, 'chip_drc_cache.json')
+        drc = SiEPICfab_ZEP_DRC.IncrementalDRC(file_cache)
+        drc.run(top)
+        drc.save()
+        assert drc.reused == 0
+
+        # unchanged: everything from the cache
+        drc = SiEPICfab_ZEP_DRC.IncrementalDRC(file_cache)
+        results = drc.run(top)
+        assert drc.checked == 0 and drc.reused == 4
+        assert all((results[rule] ^ markers).is_empty() for rule, markers in flat_markers(top).items())
+
+        # a local edit in one device: only this device and the cells above it on the Si layer
+        ly.cell('device3').shapes(ly.layer(1, 0)).insert(pya.Box(100, 100, 140, 5000))
+        drc = SiEPICfab_ZEP_DRC.IncrementalDRC(file_cache)
+        results = drc.run(top)
+        assert 0 < drc.checked <= 6 and drc.reused > 0
+        assert all((results[rule] ^ markers).is_empty() for rule, markers in flat_markers(top).items())
+        drc.save()
+
+        # the runner: marker database and summary
+        file_in = os.path.join(folder, 'chip.oas')
+        ly.write(file_in)
+        for i in range(2):
+            file_rdb, summary = run_drc.drc_file(file_in, topcell_name='TOP', incremental=True, profile=True)
+            assert summary['deck'] == 'incremental'
+            assert all(r['seconds'] is not None and r['peak_memory'] is not None for r in summary['rules'])
+            assert os.path.exists(os.path.join(folder, 'chip_drc_profile.txt'))
+            assert [r['rule'] for r in summary['rules']] == ['Si_width', 'Si_space', 'M_width', 'M_space']
+            assert summary['rules'][0]['count'] == results['Si_width'].count()
+        with open(os.path.join(folder, 'chip_drc_cache.json')) as f:
+            assert json.load(f)['version'] == SiEPICfab_ZEP_DRC.IncrementalDRC.version
+        assert run_drc.main([file_in, '-j', '1', '--topcell', 'TOP', '--incremental', '--fail-on-violations']) == 1
+        # one cache file for the parallel workers
+        try:
+            run_drc.main([file_in, file_in, '-j', '2', '--incremental', '--cache', file_cache])
+            assert False
+        except SystemExit as e:
+            assert e.code == 2
+
+
+if __name__ == "__main__":
+    test_incremental_drc()
@@ -0,0 +1,389 @@
+# Unit testing for the EBL write field regions: SiEPICfab_ZEP_EBL
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(path, "../../..")))
+import siepicfab_ebeam_zep
+from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_EBL
+from siepicfab_ebeam_zep import extract_EBL_regions, write_time
+
+
+def order_EBL_regions_Region(boxes):
+    # the original algorithm in extract_EBL_regions.lym, using Region interacting / outside
+    regions = pya.Region()
+    regions.merged_semantics = False
+    for b in boxes:
+        regions += pya.Region(b)
+    # returns the clusters of touching regions
+    clusters = []
+    while regions.count() > 0:
+        cluster = pya.Region(next(regions.each()))
+        cluster.merged_semantics = False
+        while regions.interacting(cluster).area() > cluster.area():
+            cluster = regions.interacting(cluster)
+            cluster.merged_semantics = False
+        clusters.append([str(p.bbox()) for p in cluster])
+        regions = regions.outside(cluster)
+        regions.merged_semantics = False
+    return clusters
+
+
+def random_fields(n, seed):
+    # fields on a grid, some missing, with random sizes of 1 to 4 grid cells
+    random.seed(seed)
+    boxes = []
+    used = set()
+    for i in range(n):
+        x, y = random.randrange(20), random.randrange(20)
+        w, h = random.choice([(1, 1), (1, 2), (2, 1)])
+        cells = set((x+dx, y+dy) for dx in range(w) for dy in range(h))
+        if cells & used:
+            continue
+        used |= cells
+        boxes.append(pya.Box(x*1000, y*1000, (x+w)*1000, (y+h)*1000))
+    return boxes
+
+
+def test_order_EBL_regions():
+    for seed in range(20):
+        boxes = random_fields(150, seed)
+        order = SiEPICfab_ZEP_EBL.order_EBL_regions(boxes)
+        assert sorted(i for i, cluster in order) == list(range(len(boxes)))
+        # the same clusters as the original algorithm
+        clusters = {}
+        for i, cluster in order:
+            clusters.setdefault(cluster, set()).add(str(boxes[i]))
+        assert sorted(map(sorted, clusters.values())) == sorted(map(sorted, order_EBL_regions_Region(boxes)))
+        # each field touches a field written before it, in the same cluster
+        for n, (i, cluster) in enumerate(order):
+            if n and order[n-1][1] == cluster:
+                assert any(boxes[i].touches(boxes[j]) for j, c in order[:n] if c == cluster)
+        # independent of the order of the fields in the layout
+        shuffled = boxes[:]
+        random.shuffle(shuffled)
+        assert [(str(shuffled[i]), c) for i, c in SiEPICfab_ZEP_EBL.order_EBL_regions(shuffled)] == \
+            [(str(boxes[i]), c) for i, c in order]
+
+    # clusters: touching at an edge or a corner; separated by a gap
+    boxes = [pya.Box(0, 0, 10, 10), pya.Box(20, 0, 30, 10), pya.Box(10, 10, 20, 20), pya.Box(31, 0, 40, 10)]
+    assert SiEPICfab_ZEP_EBL.order_EBL_regions(boxes) == [(0, 1), (2, 1), (1, 1), (3, 2)]
+
+    # overlapping regions
+    try:
+        SiEPICfab_ZEP_EBL.order_EBL_regions([pya.Box(0, 0, 10, 10), pya.Box(5, 5, 15, 15)])
+        assert False
+    except Exception as e:
+        assert 'overlapping' in str(e)
+
+
+def test_order_EBL_regions_large():
+    # 10,000 fields, in a 100 x 100 grid
+    boxes = [pya.Box(x*1000000, y*1000000, (x+1)*1000000, (y+1)*1000000) for x in range(100) for y in range(100)]
+    random.seed(0)
+    random.shuffle(boxes)
+    t0 = time.time()
+    order = SiEPICfab_ZEP_EBL.order_EBL_regions(boxes)
+    assert time.time()-t0 < 1
+    assert len(order) == len(boxes)
+    assert set(cluster for i, cluster in order) == {1}
+    # starting at the lower left field
+    assert (boxes[order[0][0]].left, boxes[order[0][0]].bottom) == (0, 0)
+
+    # 10,000 fields without neighbours
+    boxes = [pya.Box(x*3000, y*3000, x*3000+1000, y*3000+1000) for x in range(100) for y in range(100)]
+    random.shuffle(boxes)
+    t0 = time.time()
+    order = SiEPICfab_ZEP_EBL.order_EBL_regions(boxes)
+    assert time.time()-t0 < 1
+    assert [cluster for i, cluster in order] == list(range(1, len(boxes)+1))
+
+
+def test_optimize_EBL_order():
+    for seed in range(10):
+        boxes = random_fields(150, seed)
+        order = SiEPICfab_ZEP_EBL.order_EBL_regions(boxes)
+        optimized = SiEPICfab_ZEP_EBL.optimize_EBL_order(boxes, order)
+        assert sorted(i for i, cluster in optimized) == list(range(len(boxes)))
+        # the clusters are still written back to back, and each field touches a field written before it
+        clusters = {}
+        for i, cluster in order:
+            clusters.setdefault(cluster, set()).add(i)
+        optimized_clusters = {}
+        for n, (i, cluster) in enumerate(optimized):
+            assert n == 0 or cluster in (optimized[n-1][1], optimized[n-1][1]+1)
+            if n and optimized[n-1][1] == cluster:
+                assert any(boxes[i].touches(boxes[j]) for j, c in optimized[:n] if c == cluster)
+            optimized_clusters.setdefault(cluster, set()).add(i)
+        assert sorted(map(sorted, clusters.values())) == sorted(map(sorted, optimized_clusters.values()))
+        assert SiEPICfab_ZEP_EBL.EBL_travel([boxes[i] for i, c in optimized]) <= \
+            SiEPICfab_ZEP_EBL.EBL_travel([boxes[i] for i, c in order])
+
+    # a row of separate fields, in a random order: written from left to right
+    boxes = [pya.Box(x*2000, 0, x*2000+1000, 1000) for x in range(20)]
+    random.seed(0)
+    random.shuffle(boxes)
+    optimized = SiEPICfab_ZEP_EBL.optimize_EBL_order(boxes, SiEPICfab_ZEP_EBL.order_EBL_regions(boxes))
+    assert [boxes[i].left for i, c in optimized] == [x*2000 for x in range(20)]
+    assert SiEPICfab_ZEP_EBL.EBL_travel([boxes[i] for i, c in optimized]) == 19*2000
+
+    # a grid of touching fields: serpentine, with steps of one field
+    boxes = [pya.Box(x*1000, y*1000, (x+1)*1000, (y+1)*1000) for x in range(10) for y in range(10)]
+    random.shuffle(boxes)
+    optimized = SiEPICfab_ZEP_EBL.optimize_EBL_order(boxes, SiEPICfab_ZEP_EBL.order_EBL_regions(boxes))
+    assert SiEPICfab_ZEP_EBL.EBL_travel([boxes[i] for i, c in optimized]) == 99*1000
+
+
+def test_generate_EBL_regions():
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    topcell = ly.create_cell("Top")
+    layer_core = ly.layer(1, 0)
+    layer_wg = ly.layer(1, 99)
+    topcell.shapes(layer_core).insert(pya.DBox(0, 0, 2500, 2200).to_itype(ly.dbu))
+    # waveguides across the chip, at y = 990 and 1960 um
+    for y in (990.0, 1960.0):
+        topcell.shapes(layer_wg).insert(pya.DPath([pya.DPoint(0, y), pya.DPoint(2500, y)], 0.5).to_itype(ly.dbu))
+    # a Bragg grating at x = 800 to 1100 um
+    grating = ly.create_cell("ebeam_bragg_te1550")
+    grating.shapes(ly.layer(68, 0)).insert(pya.DBox(0, -2, 300, 2).to_itype(ly.dbu))
+    topcell.insert(pya.DCellInstArray(grating.cell_index(), pya.DTrans(pya.DVector(800, 500))))
+    # existing fields, replaced: in the topcell, and in a sub-cell
+    layer_ebl = ly.layer(8100, 0)
+    topcell.shapes(layer_ebl).insert(pya.Box(0, 0, 10, 10))
+    grating.shapes(layer_ebl).insert(pya.Box(0, 0, 10, 10))
+
+    boxes, crossings = SiEPICfab_ZEP_EBL.generate_EBL_regions(topcell, max_field_size=1000.0)
+    assert crossings == [4, 0]
+    assert topcell.shapes(layer_ebl).size() == len(boxes)
+    assert grating.shapes(layer_ebl).is_empty()
+    # a library cell keeps its fields: it is not part of this layout
+    lib = pya.Library()
+    lib_cell = lib.layout().create_cell("EBL_lib_cell")
+    lib_cell.shapes(lib.layout().layer(8100, 0)).insert(pya.Box(0, 0, 10, 10))
+    lib.register("SiEPICfab_ZEP_EBL_test_lib")
+    proxy = ly.create_cell("EBL_lib_cell", "SiEPICfab_ZEP_EBL_test_lib")
+    topcell.insert(pya.DCellInstArray(proxy.cell_index(), pya.DTrans(pya.DVector(3000, 3000))))
+    SiEPICfab_ZEP_EBL.generate_EBL_regions(topcell, max_field_size=1000.0)
+    assert proxy.is_proxy() and proxy.shapes(layer_ebl).size() == 1
+    ly.delete_cell(proxy.cell_index())
+    fields, travel = SiEPICfab_ZEP_EBL.extract_EBL_regions(topcell)
+    assert sorted(map(str, fields)) == sorted(map(str, boxes))
+    # the fields cover the layout, without overlaps, and are 1 mm or smaller
+    assert (pya.Region(boxes) - pya.Region(topcell.bbox_per_layer(layer_core))).area() == 0
+    assert (pya.Region(topcell.bbox_per_layer(layer_core)) - pya.Region(boxes)).is_empty()
+    assert sum(b.area() for b in boxes) == pya.Region(boxes).area()
+    assert all(b.width() <= 1000000 and b.height() <= 1000000 for b in boxes)
+    # the boundaries avoid the waveguides and the grating, on a 1 um grid
+    for b in boxes:
+        assert not (800000 < b.left < 1100000 or 800000 < b.right < 1100000)
+        for y in (990000, 1960000):
+            assert not (y-2250 <= b.bottom <= y+2250 or y-2250 <= b.top <= y+2250)
+        assert b.left % 1000 == 0 and b.bottom % 1000 == 0
+
+    # only the fields with shapes
+    topcell.shapes(layer_core).clear()
+    topcell.shapes(layer_core).insert(pya.DBox(0, 0, 100, 100).to_itype(ly.dbu))
+    topcell.shapes(layer_core).insert(pya.DBox(2400, 2100, 2500, 2200).to_itype(ly.dbu))
+    boxes, crossings = SiEPICfab_ZEP_EBL.generate_EBL_regions(topcell, max_field_size=1000.0)
+    assert len(boxes) == 2
+
+
+def test_extract_EBL_regions_example():
+    ly = pya.Layout()
+    ly.read(os.path.join(path, '..', 'extract_EBL_regions_example.gds'))
+    topcell = ly.top_cells()[0]
+    # the travel optimization is off by default
+    fields, travel = SiEPICfab_ZEP_EBL.extract_EBL_regions(topcell)
+    assert travel[0] == travel[1]
+    text_out = SiEPICfab_ZEP_EBL.EBL_field_control_text(fields, ly.dbu)
+    with open(os.path.join(path, '..', 'extract_EBL_regions_example_EBLfields.txt')) as f:
+        assert text_out == f.read()
+
+
+def test_stitching_crossings():
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    topcell = ly.create_cell("Top")
+    layer_core = ly.layer(1, 0)
+    layer_etch = ly.layer(100, 0)
+    # a waveguide across three fields
+    topcell.shapes(layer_core).insert(pya.Box(0, -250, 3000000, 250))
+    # a 2 um wide waveguide running along a field boundary
+    topcell.shapes(layer_core).insert(pya.Box(999000, 500000, 1001000, 600000))
+    # touching a field boundary, not crossing it
+    topcell.shapes(layer_core).insert(pya.Box(1999900, 700000, 2000000, 700060))
+    # a hole, in a sub-cell
+    hole = ly.create_cell("Hole")
+    hole.shapes(layer_etch).insert(pya.Polygon(pya.Box(-50, -50, 50, 50)))
+    topcell.insert(pya.CellInstArray(hole.cell_index(), pya.Trans(2000000, 800000)))
+    fields = [pya.Box(x*1000000, -500000, (x+1)*1000000, 1000000) for x in range(3)]
+
+    for tile_size in [300, 1000]:
+        crossings = SiEPICfab_ZEP_EBL.stitching_crossings(topcell, fields, tile_size=tile_size, threads=2)
+        assert [(c['severity'], c['layer'], round(c['width'], 3)) for c in crossings] == [
+            ('critical', 'Si_etch_highres', 0.1), ('high', 'Si_core', 0.5), ('high', 'Si_core', 0.5),
+            ('medium', 'Si_core', 2.0)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        rdb = SiEPICfab_ZEP_EBL.write_stitching_report(topcell, crossings, os.path.join(folder, 'stitching.lyrdb'),
+                                                       os.path.join(folder, 'stitching.csv'))
+        assert rdb.num_items() == 4
+        with open(os.path.join(folder, 'stitching.csv')) as f:
+            lines = f.read().splitlines()
+        assert lines[0].startswith('severity,layer,width_um')
+        assert lines[1] == 'critical,Si_etch_highres,0.100,2000.000,799.950,2000.000,800.050'
+        assert os.path.exists(os.path.join(folder, 'stitching.lyrdb'))
+
+
+def test_EBL_field_statistics():
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    topcell = ly.create_cell("Top")
+    layer_etch = ly.layer(100, 0)
+    # rows of holes, in a sub-cell, across the two fields and the tiles
+    hole = ly.create_cell("Hole")
+    hole.shapes(layer_etch).insert(pya.Polygon(pya.Box(-50, -50, 50, 50)))
+    topcell.insert(pya.CellInstArray(hole.cell_index(), pya.Trans(500, 500), pya.Vector(1000, 0), pya.Vector(0, 3000),
+                                     800, 10))
+    # a waveguide trench crossing the field boundary, as two overlapping shapes
+    topcell.shapes(layer_etch).insert(pya.Box(100000, 40000, 500000, 41000))
+    topcell.shapes(layer_etch).insert(pya.Box(400000, 40000, 700000, 41000))
+    fields = [pya.Box(0, 0, 600000, 100000), pya.Box(600000, 0, 1000000, 100000)]
+
+    statistics = SiEPICfab_ZEP_EBL.EBL_field_statistics(topcell, fields, beam_step=0.01, tile_size=25, threads=2)
+    assert len(statistics) == 2
+    for s, field in zip(statistics, fields):
+        # same as merging and clipping the whole layer
+        reference = (pya.Region(topcell.begin_shapes_rec(layer_etch)) & pya.Region(field)).merged()
+        l = s['layers']['Si_etch_highres']
+        assert abs(l['area'] - reference.area()*1e-6) < 1e-6
+        assert l['polygons'] == reference.count()
+        assert l['vertices'] == reference.edges().count()
+        assert l['shots'] == round(l['area']/0.01**2)
+        assert s['layers']['Si_etch_highres_nobias']['area'] == 0
+        assert s['shots'] == l['shots']
+    assert statistics[0]['layers']['Si_etch_highres']['polygons'] == 600*10 + 1
+
+    with tempfile.TemporaryDirectory() as folder:
+        SiEPICfab_ZEP_EBL.write_EBL_field_statistics(statistics, os.path.join(folder, 'stats.csv'))
+        with open(os.path.join(folder, 'stats.csv')) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 3
+        assert lines[1].startswith('R1,0.000,0.000,600.000,100.000,')
+
+
+def test_write_time_estimate():
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    topcell = ly.create_cell("Top")
+    # 100 um^2 high res in field 1, 400 um^2 low res in field 1 and 2, overlapping 50 um^2 with high res
+    topcell.shapes(ly.layer(100, 0)).insert(pya.Box(0, 0, 10000, 10000))
+    topcell.shapes(ly.layer(101, 0)).insert(pya.Box(5000, 0, 15000, 10000))
+    topcell.shapes(ly.layer(101, 0)).insert(pya.Box(100000, 0, 130000, 10000))
+    fields = [pya.Box(0, 0, 50000, 50000), pya.Box(50000, 0, 150000, 50000), pya.Box(0, 50000, 50000, 100000)]
+
+    estimate = SiEPICfab_ZEP_EBL.WriteTimeEstimate(topcell, fields, threads=2)
+    assert [s['area'] for s in estimate.statistics] == [
+        {'high': 100, 'low': 100, 'high+low': 150}, {'high': 0, 'low': 300, 'high+low': 300},
+        {'high': 0, 'low': 0, 'high+low': 0}]
+
+    conditions = {'high': {'current': 1.0, 'dose': 100.0, 'shot_pitch': 0.01},
+                  'low': {'current': 10.0, 'dose': 100.0, 'shot_pitch': 0.1}}
+    result = estimate.estimate(beam_conditions=conditions, settling_time=1.0, change_time=100.0, shot_frequency=1e9)
+    # dwell: 100 uC/cm^2 x (0.01 um)^2 / 1 nA = 1e-7 s, 1e6 shots in 100 um^2
+    assert abs(result['passes']['high']['dwell'] - 1e-7) < 1e-15
+    assert abs(result['passes']['high']['seconds'] - (1e6*1e-7 + 1)) < 1e-9
+    # dwell 1e-6 s; 400 um^2 / 0.01 um^2 = 4e4 shots; 2 fields
+    assert abs(result['passes']['low']['seconds'] - (4e4*1e-6 + 2)) < 1e-9
+    assert result['beam_changes'] == 1
+    assert abs(result['seconds'] - (1.1 + 2.04 + 100)) < 1e-9
+    assert result['fields'][2] == 0
+
+    # one pass, for the union of the layers; shots limited by the shot frequency
+    result = estimate.estimate(HighandLowRes=False, beam_conditions=conditions, settling_time=1.0,
+                               change_time=100.0, shot_frequency=1e6)
+    assert list(result['passes']) == ['high'] and result['beam_changes'] == 0
+    assert abs(result['seconds'] - (450/0.01**2*1e-6 + 2)) < 1e-9
+    assert 'total write time' in estimate.summary(result)
+
+    with tempfile.TemporaryDirectory() as folder:
+        estimate.save(os.path.join(folder, 'writetime.json'))
+        cached = SiEPICfab_ZEP_EBL.WriteTimeEstimate.load(os.path.join(folder, 'writetime.json'))
+        assert cached.estimate()['seconds'] == estimate.estimate()['seconds']
+
+        # command line, with the cache of the field areas, and the fields of the layout in the write order
+        for f in fields:
+            topcell.shapes(ly.layer(8100, 0)).insert(f)
+        file_in = os.path.join(folder, 'chip_static.oas')
+        ly.write(file_in)
+        assert write_time.main([file_in, '--current', 'high=5', '--no-highandlowres']) == 0
+        assert os.path.exists(os.path.join(folder, 'chip_static_writetime.json'))
+        cached = write_time.load_estimate(file_in)
+        assert sorted(map(str, cached.statistics)) == sorted(map(str, estimate.statistics))
+        assert cached.estimate()['seconds'] == estimate.estimate()['seconds']
+
+        # the cache is only reused for the same top cell and settings
+        file_cache = os.path.join(folder, 'chip_static_writetime.json')
+        with open(file_cache) as f:
+            data = json.load(f)
+        for field in data['fields']:
+            field['area'] = {name: 0 for name in field['area']}
+        with open(file_cache, 'w') as f:
+            json.dump(data, f)
+        assert write_time.load_estimate(file_in).estimate()['seconds'] == 0
+        # the write order doesn't change the areas
+        SiEPICfab_ZEP_EBL.optimize_travel = True
+        try:
+            assert write_time.load_estimate(file_in).estimate()['seconds'] == 0
+        finally:
+            SiEPICfab_ZEP_EBL.optimize_travel = False
+        cached = write_time.load_estimate(file_in, topcell_name='Top')
+        assert cached.estimate()['seconds'] == estimate.estimate()['seconds']
+        # a changed layout, here on a layer that is not exposed
+        with open(file_cache, 'w') as f:
+            json.dump(data, f)
+        topcell.shapes(ly.layer(99, 0)).insert(pya.Box(0, 0, 1000, 1000))
+        ly.write(file_in)
+        cached = write_time.load_estimate(file_in)
+        assert cached.estimate()['seconds'] == estimate.estimate()['seconds']
+
+        # malformed beam conditions
+        for argv in (['--current', 'high'], ['--dose', 'high=x']):
+            try:
+                write_time.main([file_in] + argv)
+                assert False
+            except SystemExit as e:
+                assert e.code == 2
+
+
+def test_extract_files():
+    with tempfile.TemporaryDirectory() as folder:
+        file_in = os.path.join(path, '..', 'extract_EBL_regions_example.gds')
+        results = extract_EBL_regions.extract_files([file_in], output_dir=folder, optimize=False)
+        file_in, file_out, fields, travel, seconds, error = results[0]
+        assert error is None and fields == 9
+        with open(file_out) as f, open(os.path.join(path, '..', 'extract_EBL_regions_example_EBLfields.txt')) as f_ref:
+            assert f.read() == f_ref.read()
+        assert extract_EBL_regions.main([file_in, '-o', folder, '-j', '1', '--stitching', '--statistics']) == 0
+        assert os.path.exists(os.path.join(folder, 'extract_EBL_regions_example_stitching.csv'))
+        assert os.path.exists(os.path.join(folder, 'extract_EBL_regions_example_EBLfields_stats.csv'))
+        assert extract_EBL_regions.main([os.path.join(folder, 'missing.gds'), '-o', folder, '-j', '1']) == 1
+
+
+if __name__ == "__main__":
+    test_order_EBL_regions()
+    test_order_EBL_regions_large()
+    test_optimize_EBL_order()
+    test_generate_EBL_regions()
+    test_extract_EBL_regions_example()
+    test_stitching_crossings()
+    test_EBL_field_statistics()
+    test_write_time_estimate()
+    test_extract_files()
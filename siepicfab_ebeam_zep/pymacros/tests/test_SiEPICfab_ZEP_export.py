@@ -0,0 +1,238 @@
+# Unit testing for the fabrication export: SiEPICfab_ZEP_export
+
+import os
+import sys
+import pathlib
+import tempfile
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(path, "../../..")))
+import siepicfab_ebeam_zep
+from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_export
+
+
+def make_test_layout():
+    # Hierarchical layout with Si_core / Si_clad waveguides and etch shapes
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    topcell = ly.create_cell("Top")
+    layer_core = ly.layer(1, 0)
+    layer_clad = ly.layer(1, 2)
+    layer_etch_high = ly.layer(100, 0)
+    layer_etch_low = ly.layer(101, 0)
+    layer_fp = ly.layer(99, 0)
+    layer_devrec = ly.layer(68, 0)
+
+    wg = ly.create_cell("Waveguide")
+    wg.shapes(layer_core).insert(pya.Box(0, -250, 10000, 250))
+    wg.shapes(layer_clad).insert(pya.Box(0, -2250, 10000, 2250))
+
+    ring = ly.create_cell("Ring")
+    ring.shapes(layer_core).insert(pya.Polygon(pya.Box(-5000, -5000, 5000, 5000)).sized(0))
+    ring.shapes(layer_core).insert(pya.Polygon(pya.Box(-4500, -4500, 4500, 4500)))
+    ring.shapes(layer_clad).insert(pya.Box(-7000, -7000, 7000, 7000))
+    ring.shapes(layer_devrec).insert(pya.Box(-7000, -7000, 7000, 7000))
+    ring.shapes(layer_etch_high).insert(pya.Box(-1000, -1000, 1000, 1000))
+    ring.shapes(layer_etch_low).insert(pya.Box(6000, -1000, 9000, 1000))
+    ring.insert(pya.CellInstArray(wg.cell_index(), pya.Trans(7000, 0)))
+
+    empty = ly.create_cell("Empty")
+    empty.shapes(layer_fp).insert(pya.Box(0, 0, 100, 100))
+
+    topcell.insert(pya.CellInstArray(ring.cell_index(), pya.Trans(0, 0),
+                                     pya.Vector(30000, 0), pya.Vector(0, 30000), 3, 2))
+    topcell.insert(pya.CellInstArray(wg.cell_index(), pya.Trans(pya.Trans.R90, -20000, 0)))
+    topcell.insert(pya.CellInstArray(empty.cell_index(), pya.Trans(0, 0)))
+    topcell.shapes(layer_clad).insert(pya.Box(-30000, -30000, -25000, -25000))
+    topcell.shapes(layer_etch_high).insert(pya.Box(-28000, -28000, -20000, -20000))
+    topcell.shapes(layer_fp).insert(pya.Box(-40000, -40000, 100000, 100000))
+    return ly, topcell
+
+
+def flat_region(cell, layerinfo):
+    return pya.Region(cell.begin_shapes_rec(cell.layout().layer(layerinfo)))
+
+
+def test_boolean_engines():
+    ly_in, topcell_in = make_test_layout()
+    for HighandLowRes in [True, False]:
+        SiEPICfab_ZEP_export.HighandLowRes = HighandLowRes
+        results = {}
+        for engine in ['ShapeProcessor', 'Region']:
+            ly, flag_longcellnames = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, engine=engine)
+            results[engine] = (ly, ly.top_cell())
+            assert not flag_longcellnames
+            # Si_core and Si_clad are consumed by the booleans
+            assert flat_region(ly.top_cell(), pya.LayerInfo(1, 0)).is_empty()
+            assert flat_region(ly.top_cell(), pya.LayerInfo(1, 2)).is_empty()
+        reference = results['ShapeProcessor'][1]
+        for engine, (ly, topcell) in results.items():
+            for layerinfo in [pya.LayerInfo(100, 0), pya.LayerInfo(101, 0), pya.LayerInfo(99, 0)]:
+                assert (flat_region(topcell, layerinfo) ^ flat_region(reference, layerinfo)).is_empty(), \
+                    "Engine %s differs on layer %s" % (engine, layerinfo)
+                assert flat_region(topcell, layerinfo).count() == flat_region(reference, layerinfo).count(), \
+                    "Engine %s gives other polygons on layer %s" % (engine, layerinfo)
+    SiEPICfab_ZEP_export.HighandLowRes = True
+
+
+def test_boolean_engine_tiled():
+    ly_in, topcell_in = make_test_layout()
+    for HighandLowRes in [True, False]:
+        SiEPICfab_ZEP_export.HighandLowRes = HighandLowRes
+        ly_ref, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, flatten=True, engine='ShapeProcessor')
+        # small tiles, so that shapes cross the tile boundaries
+        ly, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, flatten=True, engine='Tiled',
+                                                                  tile_size=7.0, threads=4)
+        assert len(list(ly.each_cell())) == 1
+        for layerinfo in [pya.LayerInfo(1, 0), pya.LayerInfo(1, 2), pya.LayerInfo(100, 0), pya.LayerInfo(101, 0)]:
+            assert (flat_region(ly.top_cell(), layerinfo) ^ flat_region(ly_ref.top_cell(), layerinfo)).is_empty(), \
+                "Tiled engine differs on layer %s" % layerinfo
+            # the polygons are not split at the tile boundaries
+            assert flat_region(ly.top_cell(), layerinfo).count() == flat_region(ly_ref.top_cell(), layerinfo).count(), \
+                "Tiled engine gives other polygons on layer %s" % layerinfo
+    SiEPICfab_ZEP_export.HighandLowRes = True
+
+
+def test_copy_layers():
+    ly_in, topcell_in = make_test_layout()
+    ly, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in)
+    # same hierarchy, without the layers that are not exported
+    assert sorted(c.name for c in ly.each_cell()) == sorted(c.name for c in ly_in.each_cell())
+    assert ly.find_layer(68, 0) is None
+    assert (flat_region(ly.top_cell(), pya.LayerInfo(99, 0)) ^ flat_region(topcell_in, pya.LayerInfo(99, 0))).is_empty()
+
+
+def test_deduplicate_cells():
+    ly_in, topcell_in = make_test_layout()
+    # a copy of the Waveguide cell, with a different name
+    wg = ly_in.cell("Waveguide")
+    wg2 = ly_in.create_cell("Waveguide$1")
+    wg2.copy_shapes(wg)
+    topcell_in.insert(pya.CellInstArray(wg2.cell_index(), pya.Trans(pya.Trans.R90, -25000, 0)))
+
+    ly, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in)
+    etch = flat_region(ly.top_cell(), pya.LayerInfo(100, 0))
+    assert SiEPICfab_ZEP_export.deduplicate_cells(ly.top_cell()) == 1
+    assert sorted(c.name for c in ly.each_cell()) == ['Empty', 'Ring', 'Top', 'Waveguide']
+    assert (flat_region(ly.top_cell(), pya.LayerInfo(100, 0)) ^ etch).is_empty()
+
+
+def test_replace_IP_cells():
+    # library with the IP cell
+    lib = pya.Library()
+    lib_cell = lib.layout().create_cell("IP_cell")
+    lib_cell.shapes(lib.layout().layer(100, 0)).insert(pya.Box(0, 0, 1000, 1000))
+    lib.register("SiEPICfab_ZEP_export_test_IP")
+
+    ly_in, topcell_in = make_test_layout()
+    bb = ly_in.create_cell("IP_cell_BB")
+    bb2 = ly_in.create_cell("IP_cell_BB$1")
+    other = ly_in.create_cell("IP_cell_BB_other")
+    for cell in [bb, bb2, other]:
+        cell.shapes(ly_in.layer(1, 0)).insert(pya.Box(0, 0, 10, 10))
+    ring = ly_in.cell("Ring")
+    ring.insert(pya.CellInstArray(bb.cell_index(), pya.Trans(0, 0)))
+    topcell_in.insert(pya.CellInstArray(bb2.cell_index(), pya.Trans(0, 0), pya.Vector(5000, 0), pya.Vector(0, 5000), 2, 3))
+    topcell_in.insert(pya.CellInstArray(other.cell_index(), pya.Trans(0, 0)))
+
+    cell_list = [["IP_cell_BB", "IP_cell", "SiEPICfab_ZEP_export_test_IP"]]
+    assert SiEPICfab_ZEP_export.replace_IP_cells(ly_in, cell_list) == 2
+    # the black box cells are deleted, no other top cells are left
+    assert len(ly_in.top_cells()) == 1
+    assert ly_in.cell("IP_cell_BB") is None and ly_in.cell("IP_cell_BB$1") is None
+    assert not other.is_top()
+    ip_cells = [c for c in ly_in.each_cell() if c.name == "IP_cell"]
+    assert len(ip_cells) == 1
+    assert ip_cells[0].parent_cells() == 2
+    inst = [i for i in topcell_in.each_inst() if i.cell.name == "IP_cell"][0]
+    assert inst.is_regular_array() and inst.na == 2 and inst.nb == 3
+
+
+def test_load_IP_replacement_list():
+    cell_list = SiEPICfab_ZEP_export.load_IP_replacement_list()
+    assert ['GC_1550_te_220', 'ebeam_GC_Air_te1550', 'SiEPICfab_EBeam_ZEP_UBC'] in cell_list
+    assert all(len(fields) == 3 for fields in cell_list)
+
+
+def test_export_topcell_for_fabrication(tmp_path):
+    ly_in, topcell_in = make_test_layout()
+    file_out = SiEPICfab_ZEP_export.export_topcell_for_fabrication(topcell_in, str(tmp_path / "Top_static.gds"))
+    assert file_out == str(tmp_path / "Top_static.oas")
+
+    # only the fabricated layers are in the output
+    ly = pya.Layout()
+    ly.read(file_out)
+    layers = [ly.get_info(li) for li in ly.layer_indexes() if not ly.top_cell().bbox_per_layer(li).empty()]
+    assert sorted(str(l) for l in layers) == ['100/0', '101/0', '99/0']
+
+
+def test_export_cache(tmp_path):
+    ly_in, topcell_in = make_test_layout()
+    ly_ref, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, engine='Region')
+
+    cache = SiEPICfab_ZEP_export.ExportCache(str(tmp_path))
+    ly, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, engine='Region', cache=cache)
+    assert cache.hits == 0 and cache.misses == 3
+
+    # change one cell; only this one is processed again
+    topcell_in.layout().cell("Ring").shapes(topcell_in.layout().layer(1, 2)).insert(pya.Box(8000, 8000, 9000, 9000))
+    cache = SiEPICfab_ZEP_export.ExportCache(str(tmp_path))
+    ly, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, engine='Region', cache=cache)
+    assert cache.hits == 2 and cache.misses == 1
+    ly_ref, flag = SiEPICfab_ZEP_export.boolean_layer_operations(topcell_in, engine='ShapeProcessor')
+    for layerinfo in [pya.LayerInfo(1, 0), pya.LayerInfo(1, 2), pya.LayerInfo(100, 0), pya.LayerInfo(101, 0)]:
+        assert (flat_region(ly.top_cell(), layerinfo) ^ flat_region(ly_ref.top_cell(), layerinfo)).is_empty()
+
+    # size limit: everything is evicted
+    cache = SiEPICfab_ZEP_export.ExportCache(str(tmp_path), max_size_mb=0)
+    assert cache.evict() == 0 and cache.evicted == 4
+
+
+def test_export_profile(tmp_path):
+    import json
+    ly_in, topcell_in = make_test_layout()
+    file_out = SiEPICfab_ZEP_export.export_topcell_for_fabrication(topcell_in, str(tmp_path / "Top_static.oas"),
+                                                                  engine='Region', profile=True)
+    with open(str(tmp_path / "Top_static_profile.json")) as f:
+        profile = json.load(f)
+    assert [e['name'] for e in profile['phases']] == ['copy', 'booleans', 'character replacement', 'write']
+    ring = [e for e in profile['cells'] if e['name'] == 'Ring'][0]
+    assert ring['polygons_in'] == 5 and ring['polygons_out'] == 3
+    with open(str(tmp_path / "Top_static_profile_trace.json")) as f:
+        assert len(json.load(f)['traceEvents']) == 4 + 4
+
+
+def test_short_cellnames(tmp_path):
+    ly_in, topcell_in = make_test_layout()
+    long_name = "ebeam_pcell_contra_directional_coupler_1000N-320.0nm_period_wg1=0.56_wg2=0.44"
+    ly_in.cell("Ring").name = long_name
+    file_out = SiEPICfab_ZEP_export.export_topcell_for_fabrication(topcell_in, str(tmp_path / "Top_static.oas"))
+    assert file_out.endswith('.oas')
+
+    with open(str(tmp_path / "Top_static_cellnames.csv")) as f:
+        lines = f.read().splitlines()
+    short_name, original_name = lines[1].split(',')
+    assert original_name == long_name.replace('=', '_')
+    assert len(short_name) == 64 and short_name.startswith(original_name[0:50])
+
+    ly = pya.Layout()
+    ly.read(file_out)
+    assert ly.has_cell(short_name)
+
+    # same names, for each export
+    SiEPICfab_ZEP_export.export_topcell_for_fabrication(topcell_in, str(tmp_path / "Top_static2.oas"))
+    with open(str(tmp_path / "Top_static2_cellnames.csv")) as f:
+        assert f.read().splitlines() == lines
+
+
+if __name__ == "__main__":
+    test_boolean_engines()
+    test_boolean_engine_tiled()
+    test_copy_layers()
+    test_deduplicate_cells()
+    test_replace_IP_cells()
+    test_load_IP_replacement_list()
+    for test in (test_export_topcell_for_fabrication, test_export_cache, test_export_profile, test_short_cellnames):
+        with tempfile.TemporaryDirectory() as folder:
+            test(pathlib.Path(folder))
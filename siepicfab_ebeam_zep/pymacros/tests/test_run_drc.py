@@ -0,0 +1,193 @@
+# Unit testing for the headless DRC: run_drc
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import pya
+import pytest
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(path, "../../..")))
+import siepicfab_ebeam_zep
+from siepicfab_ebeam_zep import run_drc
+
+
+def test_rdb_summary():
+    # markers in a sub cell with two instances, and in the top cell
+    rdb = pya.ReportDatabase('DRC')
+    top = rdb.create_cell('TOP')
+    sub = rdb.create_cell('SUB')
+    sub.add_reference(pya.RdbReference(pya.DCplxTrans(pya.DVector(100, 0)), top.rdb_id()))
+    sub.add_reference(pya.RdbReference(pya.DCplxTrans(pya.DVector(0, 200)), top.rdb_id()))
+    width = rdb.create_category('Si_width')
+    width.description = 'Si minimum feature size violation; min 60 nm'
+    rdb.create_category('M_space')
+    item = rdb.create_item(sub.rdb_id(), width.rdb_id())
+    item.add_value(pya.DEdgePair(pya.DEdge(0, 0, 1, 0), pya.DEdge(1, 0.05, 0, 0.05)))
+    item = rdb.create_item(top.rdb_id(), width.rdb_id())
+    item.add_value(pya.DPolygon(pya.DBox(-5, -5, -4, -4)))
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_rdb = os.path.join(folder, 'chip_drc.lyrdb')
+        rdb.save(file_rdb)
+        file_timing = os.path.join(folder, 'chip_drc_timing.txt')
+        with open(file_timing, 'w') as f:
+            f.write('Si_width\t1.5\t120.0\t250.5\t30.0\nBoundary\t0.5\t100.0\t\t\n')
+
+        rules = run_drc.rdb_summary(file_rdb, run_drc.read_rule_profile(file_timing))
+        assert [r['rule'] for r in rules] == ['Si_width', 'M_space', 'Boundary']
+        assert rules[0]['count'] == 2 and rules[0]['bbox'] == [-5.0, -5.0, 101.0, 200.05]
+        assert rules[0]['seconds'] == 1.5 and rules[0]['description'].startswith('Si minimum')
+        assert rules[0]['peak_memory'] == 250.5 and rules[0]['peak_increase'] == 30.0
+        assert rules[1]['count'] == 0 and rules[1]['bbox'] is None and rules[1]['seconds'] is None
+        assert rules[2]['seconds'] == 0.5 and rules[2]['memory'] == 100.0 and rules[2]['peak_memory'] is None
+
+        summary = {'file': 'chip.gds', 'deck': 'SiEPICfab_EBeam_ZEP', 'topcell': None, 'seconds': 2.0,
+                   'violations': 2, 'rules': rules}
+        run_drc.write_drc_summary(summary, file_json=os.path.join(folder, 'chip_drc.json'),
+                                  file_csv=os.path.join(folder, 'chip_drc.csv'))
+        with open(os.path.join(folder, 'chip_drc.json')) as f:
+            assert json.load(f) == summary
+        with open(os.path.join(folder, 'chip_drc.csv')) as f:
+            rows = list(csv.DictReader(f))
+        assert rows[0]['rule'] == 'Si_width' and rows[0]['count'] == '2' and rows[0]['right'] == '101.0'
+        assert rows[1]['left'] == '' and rows[1]['seconds'] == '' and rows[0]['peak_memory'] == '250.500'
+        table = run_drc.profile_table(summary).splitlines()
+        assert table[2].split()[:2] == ['Si_width', '1.500'] and table[3].split()[0] == 'Boundary'
+
+
+def test_drc_files():
+    file_in = os.path.join(path, '..', 'extract_EBL_regions_example.gds')
+    with tempfile.TemporaryDirectory() as folder:
+        if run_drc.find_klayout() is None:
+            # the DRC decks need the klayout executable
+            results = run_drc.drc_files([file_in], processes=1, output_dir=folder)
+            assert results[0][4].startswith('Exception: KLayout (klayout) not found')
+            assert run_drc.main([file_in, '-o', folder, '-j', '1']) == 1
+            return
+        for deck in run_drc.decks:
+            results = run_drc.drc_files([file_in], processes=1, output_dir=folder, deck=deck)
+            file_in, file_rdb, summary, seconds, error = results[0]
+            assert error is None and os.path.exists(file_rdb)
+            assert 'EBL-Regions_overlap' in [r['rule'] for r in summary['rules']]
+            assert all(r['seconds'] is not None for r in summary['rules'])
+        assert run_drc.main([os.path.join(folder, 'missing.gds'), '-o', folder, '-j', '1']) == 1
+
+
+def rdb_markers(file_rdb):
+    # the markers of each rule, as merged edges (dbu 0.001) in the top cell
+    rdb = pya.ReportDatabase('')
+    rdb.load(file_rdb)
+    markers = {}
+    memo = {}
+    for item in rdb.each_item():
+        name = rdb.category_by_id(item.category_id()).path().split('.')[0]
+        edges = markers.setdefault(name, pya.Edges())
+        for t in run_drc._cell_transformations(rdb, rdb.cell_by_id(item.cell_id()), memo):
+            t = pya.CplxTrans(0.001).inverted() * t
+            for value in item.each_value():
+                if value.is_edge_pair():
+                    edges.insert((t * value.edge_pair()).first)
+                    edges.insert((t * value.edge_pair()).second)
+                elif value.is_edge():
+                    edges.insert(t * value.edge())
+                elif value.is_polygon():
+                    edges.insert(pya.Region(t * value.polygon()).edges())
+    return {name: edges.merged() for name, edges in markers.items()}
+
+
+def violations_layout():
+    # Si and Metal violations in a cell placed many times, 1.5 mm wide;
+    # some instances straddle the tile boundaries
+    ly = pya.Layout()
+    ly.dbu = 0.001
+    top = ly.create_cell('TOP')
+    cell = ly.create_cell('VIOLATIONS')
+    si, m = ly.layer(1, 0), ly.layer(11, 0)
+    cell.shapes(si).insert(pya.DBox(0, 0, 0.04, 2).to_itype(ly.dbu))      # Si_width
+    cell.shapes(si).insert(pya.DBox(1, 0, 2, 2).to_itype(ly.dbu))
+    cell.shapes(si).insert(pya.DBox(2.05, 0, 3, 2).to_itype(ly.dbu))      # Si_space
+    cell.shapes(m).insert(pya.DBox(6, 0, 9, 20).to_itype(ly.dbu))         # M_width, Si - Metal spacing
+    cell.shapes(m).insert(pya.DBox(12, 0, 20, 20).to_itype(ly.dbu))       # M_space
+    top.insert(pya.DCellInstArray(cell.cell_index(), pya.DTrans(), pya.DVector(97, 0), pya.DVector(0, 260), 16, 5))
+    top.shapes(si).insert(pya.DBox(0, -10, 1500, -9.96).to_itype(ly.dbu))
+    return ly, top
+
+
+def test_tiling_processor():
+    # the width/space/separation rules of the deck, in tiles with borders, give the same
+    # markers as the flat and deep checks; runs without the klayout executable
+    ly, top = violations_layout()
+    si, m = ly.layer(1, 0), ly.layer(11, 0)
+    rules = {'Si_width': 'si.width_check(59, false, Metrics.Euclidian, 80)',
+             'Si_space': 'si.space_check(59)',
+             'M_width': 'm.width_check(5000, false, Metrics.Euclidian, 80)',
+             'M_space': 'm.space_check(5000)',
+             'Si - Metal spacing': 'si.separation_check(m, 5000)'}
+    tp = pya.TilingProcessor()
+    tp.input('si', ly, top.cell_index(), si)
+    tp.input('m', ly, top.cell_index(), m)
+    tp.dbu = ly.dbu
+    # as in the deck: 500 µm tiles, 10 µm borders
+    tp.tile_size(500, 500)
+    tp.tile_border(10, 10)
+    tp.threads = 2
+    tiled = {}
+    for i, (rule, check) in enumerate(rules.items()):
+        tiled[rule] = pya.Edges()
+        tp.output('o%d' % i, tiled[rule])
+        # the markers found in the tile borders are clipped away, as they belong to the neighbouring tiles
+        tp.queue('_output(o%d, %s.edges, true)' % (i, check))
+    tp.execute('Tiled DRC')
+
+    dss = pya.DeepShapeStore()
+    for regions in ({'si': pya.Region(top.begin_shapes_rec(si)), 'm': pya.Region(top.begin_shapes_rec(m))},
+                    {'si': pya.Region(top.begin_shapes_rec(si), dss), 'm': pya.Region(top.begin_shapes_rec(m), dss)}):
+        si_core, metal = regions['si'], regions['m']
+        checks = {'Si_width': si_core.width_check(59, False, pya.Metrics.Euclidian, 80),
+                  'Si_space': si_core.space_check(59),
+                  'M_width': metal.width_check(5000, False, pya.Metrics.Euclidian, 80),
+                  'M_space': metal.space_check(5000),
+                  'Si - Metal spacing': si_core.separation_check(metal, 5000)}
+        for rule, markers in checks.items():
+            edges = markers.edges()
+            edges.flatten()  # the deep markers are in the cells, the tiled ones in the top cell
+            assert not edges.is_empty()
+            assert (tiled[rule].merged() ^ edges.merged()).is_empty(), rule
+
+
+def test_tiled_mode():
+    # the tiled mode of the SiEPICfab_EBeam_ZEP deck gives the same markers as the deep mode
+    if run_drc.find_klayout() is None:
+        pytest.skip('the DRC decks need the klayout executable')
+    ly, top = violations_layout()
+
+    tiled_size = os.environ.get('SIEPICFAB_DRC_TILED_SIZE')
+    with tempfile.TemporaryDirectory() as folder:
+        file_in = os.path.join(folder, 'chip.gds')
+        ly.write(file_in)
+        markers = {}
+        try:
+            for mode, size in (('tiled', '1000'), ('deep', '100000')):
+                os.environ['SIEPICFAB_DRC_TILED_SIZE'] = size
+                file_rdb = os.path.join(folder, 'chip_%s.lyrdb' % mode)
+                run_drc.run_drc(file_in, file_rdb, threads=2)
+                markers[mode] = rdb_markers(file_rdb)
+        finally:
+            if tiled_size is None:
+                del os.environ['SIEPICFAB_DRC_TILED_SIZE']
+            else:
+                os.environ['SIEPICFAB_DRC_TILED_SIZE'] = tiled_size
+
+    for rule in ['Si_width', 'Si_space', 'M_width', 'M_space', 'Si - Metal spacing']:
+        assert not markers['deep'][rule].is_empty()
+        assert (markers['tiled'][rule] ^ markers['deep'][rule]).is_empty(), rule
+
+
+if __name__ == "__main__":
+    test_rdb_summary()
+    test_drc_files()
+    test_tiling_processor()
+    test_tiled_mode()
@@ -0,0 +1,70 @@
+# Unit testing for the PCells with unit-cell instances: the same geometry as the flat PCells
+
+import os
+import sys
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(path, "../../..")))
+import siepicfab_ebeam_zep
+
+
+def pcell_regions(library, pcell_name, params):
+    # the flattened geometry of each layer, and the number of shapes in the PCell variant
+    ly = pya.Layout()
+    ly.technology_name = 'SiEPICfab_EBeam_ZEP'
+    top = ly.create_cell('TOP')
+    cell = ly.create_cell(pcell_name, library, params)
+    top.insert(pya.CellInstArray(cell.cell_index(), pya.Trans()))
+    regions = {}
+    for li in ly.layer_indexes():
+        region = pya.Region(top.begin_shapes_rec(li))
+        if not region.is_empty():
+            regions[ly.get_info(li).to_s()] = region
+    n_shapes = sum(c.shapes(li).size() for c in ly.each_cell() for li in ly.layer_indexes())
+    return regions, n_shapes
+
+
+def check_unit_cells(library, pcell_name, params, option='unit_cells', ratio=0.25):
+    flat, n_flat = pcell_regions(library, pcell_name, dict(params, **{option: False}))
+    cells, n_cells = pcell_regions(library, pcell_name, dict(params, **{option: True}))
+    assert flat.keys() == cells.keys()
+    for layer in flat:
+        assert flat[layer].count() == cells[layer].count(), (pcell_name, params, layer)
+        assert (flat[layer] ^ cells[layer]).is_empty(), (pcell_name, params, layer)
+    assert n_cells < n_flat * ratio, (pcell_name, params, n_cells, n_flat)
+
+
+def test_apodized_gratings():
+    for sinusoidal in [False, True]:
+        check_unit_cells('SiEPICfab_EBeam_ZEP_Beta', 'ebeam_bragg_apodized',
+                         {'number_of_periods': 1000, 'sinusoidal': sinusoidal, 'misalignment': 0.05})
+        check_unit_cells('SiEPICfab_EBeam_ZEP_Beta', 'ebeam_pcell_contra_directional_coupler',
+                         {'number_of_periods': 1000, 'sinusoidal': sinusoidal, 'rib': False, 'wg1_width': 0.561})
+
+
+def test_bragg_holes():
+    check_unit_cells('SiEPICfab_EBeam_ZEP_Beta', 'BraggWaveguide_holes',
+                     {'number_of_periods': 500, 'grating_period': 0.2613, 'fill_factor': 0.37}, option='unit_cell')
+
+
+def test_nanobeam_holes():
+    pcells = [('SiEPICfab_EBeam_ZEP_Superconducting', 'ebeam_pcell_nanobeam_cavity'),
+              ('SiEPICfab_EBeam_ZEP_Superconducting', 'ebeam_pcell_taper_nanobeam'),
+              ('SiEPICfab_EBeam_ZEP_Superconducting', 'ebeam_pcell_taper_nanobeam_asym'),
+              ('SiEPICfab_EBeam_ZEP_Superconducting', 'ebeam_pcell_taper_nanobeam_cw'),
+              ('SiEPICfab_EBeam_ZEP_Superconducting', 'ebeam_pcell_taper_582'),
+              ('SiEPICfab_EBeam_ZEP_Superconducting', 'ebeam_pcell_symmetric_nanobeam'),
+              ('SiEPICfab_EBeam_ZEP_pkirwin', 'ebeam_pcell_symmetric_nanobeam_side_coupled')]
+    for library, pcell_name in pcells:
+        for n_vertices in [32, 17]:
+            check_unit_cells(library, pcell_name, {'n_vertices': n_vertices}, option='hole_cells', ratio=1)
+    # one copy of the helpers, shared by the PCell libraries
+    assert sys.modules['SiEPICfab_EBeam_ZEP_Superconducting_pcells'].insert_holes is \
+        sys.modules['SiEPICfab_EBeam_ZEP_pkirwin_pcells'].insert_holes
+
+
+if __name__ == "__main__":
+    test_apodized_gratings()
+    test_bragg_holes()
+    test_nanobeam_holes()
@@ -0,0 +1,384 @@
+'''
+Headless Design Rule Check (DRC) for SiEPICfab-EBeam-ZEP, without the KLayout application (GUI)
+
+Runs the same DRC decks as SiEPIC > Verification > "Design Rule Check (DRC) - SiEPICfab-ZEP"
+on many layouts in parallel worker processes, e.g., for the nightly check of the shuttle submissions.
+The DRC decks run in KLayout in batch mode (klayout -b), so the klayout executable is required;
+set the environment variable KLAYOUT or use --klayout if it is not on the PATH.
+
+Usage:
+  python -m siepicfab_ebeam_zep.run_drc chip1.gds chip2.oas
+  python -m siepicfab_ebeam_zep.run_drc designs/*.oas -o drc/ -j 8 --deck ELEC463-2021
+
+Each input in.gds gives the marker database in_drc.lyrdb (open it in KLayout with Tools > Marker Browser),
+and the summary of the violations in in_drc.json and in_drc.csv:
+the number of markers, their bounding box (microns, in the top cell), and the runtime and memory of each rule.
+With --profile, the rules are also listed by runtime in in_drc_profile.txt.
+
+With --incremental, only the Si and metal width/space rules are checked, with the standalone klayout
+Python module (see pymacros/SiEPICfab_ZEP_DRC.py). The markers of each cell are cached in in_drc_cache.json
+(or --cache), so after a local edit, only the changed cells and their interaction zones are checked again.
+'''
+
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+# the DRC decks, by name
+path_drc = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'drc')
+decks = {
+    'SiEPICfab_EBeam_ZEP': os.path.join(path_drc, 'SiEPICfab_EBeam_ZEP.lydrc'),
+    'ELEC463-2021': os.path.join(path_drc, 'ELEC463-2021.lydrc'),
+}
+
+# what to append at the end of the filename
+extra = 'drc'
+
+
+def find_klayout(klayout=None):
+    '''
+    The klayout executable: klayout, or the environment variable KLAYOUT, or klayout on the PATH.
+    Returns None if it is not found.
+    '''
+    klayout = klayout or os.environ.get('KLAYOUT') or 'klayout'
+    if os.path.isfile(klayout):
+        return klayout
+    return shutil.which(klayout)
+
+
+def deck_file(deck):
+    '''
+    The DRC deck file, from its name (see decks) or its path.
+    '''
+    if deck in decks:
+        return decks[deck]
+    if os.path.isfile(deck):
+        return deck
+    raise Exception("DRC deck %s not found; choose one of: %s, or the path to a .lydrc file." % (deck, ', '.join(decks)))
+
+
+def run_drc(file_in, file_rdb, deck='SiEPICfab_EBeam_ZEP', topcell_name=None, klayout=None,
+            threads=None, file_timing=None):
+    '''
+    Run a DRC deck on a layout file in KLayout batch mode, and save the markers in file_rdb.
+    The runtime and memory of each rule are saved in file_timing (see read_rule_profile).
+    threads: number of threads for the tiled mode of the SiEPICfab_EBeam_ZEP deck
+    Returns the runtime in seconds.
+    '''
+    executable = find_klayout(klayout)
+    if executable is None:
+        raise Exception("KLayout (klayout) not found; add it to the PATH, or set the environment variable KLAYOUT.")
+
+    cmd = [executable, '-b', '-r', deck_file(deck), '-rd', 'input=%s' % file_in, '-rd', 'report=%s' % file_rdb]
+    if topcell_name:
+        cmd += ['-rd', 'topcell=%s' % topcell_name]
+    if file_timing:
+        cmd += ['-rd', 'timing=%s' % file_timing]
+    env = dict(os.environ)
+    if threads:
+        env['SIEPICFAB_DRC_THREADS'] = str(threads)
+
+    t0 = time.time()
+    result = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    if result.returncode != 0 or not os.path.exists(file_rdb):
+        log = result.stdout.strip().splitlines()
+        raise Exception("DRC failed (exit code %s): %s" % (result.returncode, ' / '.join(log[-5:])))
+    return time.time()-t0
+
+
+# measurements of each rule, in the file written by the DRC deck
+profile_fields = ['seconds', 'memory', 'peak_memory', 'peak_increase']
+
+
+def read_rule_profile(file_timing):
+    '''
+    The runtime and memory of each rule, from the file written by the DRC deck (tab separated):
+    {rule: dict(seconds, memory (MB, after the rule), peak_memory (MB, peak of the process after the rule),
+                peak_increase (MB, increase of the peak during the rule))}; unknown values are None.
+    '''
+    rule_profile = {}
+    if file_timing and os.path.exists(file_timing):
+        with open(file_timing) as f:
+            for line in f:
+                if line.strip():
+                    values = line.rstrip('\n').split('\t')
+                    rule_profile[values[0]] = {name: float(v) if v else None
+                                               for name, v in zip(profile_fields, values[1:]+['']*4)}
+    return rule_profile
+
+
+def _value_bbox(value):
+    # bounding box of a marker value (microns)
+    import pya
+    if value.is_box():
+        return value.box()
+    if value.is_polygon():
+        return value.polygon().bbox()
+    if value.is_edge_pair():
+        return value.edge_pair().bbox()
+    if value.is_edge():
+        return value.edge().bbox()
+    if value.is_path():
+        return value.path().bbox()
+    if value.is_text():
+        return pya.DBox(value.text().position(), value.text().position())
+    return pya.DBox()
+
+
+def _cell_transformations(rdb, cell, memo):
+    # the transformations of an rdb cell into the top cell, following its references
+    if cell.rdb_id() in memo:
+        return memo[cell.rdb_id()]
+    import pya
+    memo[cell.rdb_id()] = [pya.DCplxTrans()]  # guards against cyclic references
+    transformations = []
+    for ref in cell.each_reference():
+        parent = rdb.cell_by_id(ref.parent_cell_id)
+        if parent is None:
+            transformations.append(ref.trans)
+        else:
+            transformations += [t * ref.trans for t in _cell_transformations(rdb, parent, memo)]
+    memo[cell.rdb_id()] = transformations or [pya.DCplxTrans()]
+    return memo[cell.rdb_id()]
+
+
+def rdb_summary(file_rdb, rule_profile=None):
+    '''
+    Summary of the markers in a DRC marker database, for each rule (category):
+      rule, description, count (number of markers; in deep mode, a marker inside
+      a cell is counted once for all its instances), bbox ([left, bottom, right, top] in microns,
+      in the top cell, or None), and the runtime and memory of the rule from rule_profile (see read_rule_profile)
+    Returns the list of rules, in the order of the DRC deck.
+    '''
+    import pya
+    rdb = pya.ReportDatabase('')
+    rdb.load(file_rdb)
+    rule_profile = rule_profile or {}
+
+    def rule_summary(name, description):
+        profile = rule_profile.get(name, {})
+        return dict({'rule': name, 'description': description, 'count': 0, 'bbox': None},
+                    **{field: profile.get(field) for field in profile_fields})
+
+    rules = {}
+    for category in rdb.each_category():
+        rules[category.name()] = rule_summary(category.name(), category.description)
+    # bounding box of the markers in each cell, then transformed into the top cell
+    cell_boxes = {}
+    for item in rdb.each_item():
+        category = rdb.category_by_id(item.category_id())
+        name = category.path().split('.')[0]
+        rules[name]['count'] += 1
+        box = pya.DBox()
+        for value in item.each_value():
+            box += _value_bbox(value)
+        key = (name, item.cell_id())
+        cell_boxes[key] = cell_boxes.get(key, pya.DBox()) + box
+    memo = {}
+    for (name, cell_id), box in cell_boxes.items():
+        if box.empty():
+            continue
+        bbox = pya.DBox()
+        for t in _cell_transformations(rdb, rdb.cell_by_id(cell_id), memo):
+            bbox += t * box
+        if rules[name]['bbox'] is not None:
+            bbox += pya.DBox(*rules[name]['bbox'])
+        rules[name]['bbox'] = [round(bbox.left, 4), round(bbox.bottom, 4), round(bbox.right, 4), round(bbox.top, 4)]
+    # rules that do not create a category when there are no markers
+    for name in rule_profile:
+        if name not in rules:
+            rules[name] = rule_summary(name, '')
+    return list(rules.values())
+
+
+def write_drc_summary(summary, file_json=None, file_csv=None):
+    '''
+    Save the DRC summary (see drc_file) as JSON, and the rules as CSV (one row per rule).
+    '''
+    if file_json:
+        with open(file_json, 'w') as f:
+            json.dump(summary, f, indent=1)
+    if file_csv:
+        with open(file_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['rule', 'count', 'left', 'bottom', 'right', 'top'] + profile_fields + ['description'])
+            for r in summary['rules']:
+                writer.writerow([r['rule'], r['count']] + (r['bbox'] or ['', '', '', '']) +
+                                ['' if r[field] is None else '%.3f' % r[field] for field in profile_fields] +
+                                [r['description']])
+
+
+def profile_table(summary):
+    '''
+    The rules of a DRC summary as a text table, slowest first.
+    '''
+    def value(v, format):
+        return '-' if v is None else format % v
+    lines = ['%s (%s, %.1f s)' % (summary['file'], summary['deck'], summary['seconds']),
+             '%-24s %10s %11s %11s %11s %9s' % ('rule', 'seconds', 'memory MB', 'peak MB', '+peak MB', 'count')]
+    for r in sorted(summary['rules'], key=lambda r: -(r['seconds'] or 0)):
+        lines.append('%-24s %10s %11s %11s %11s %9s' % (
+            r['rule'], value(r['seconds'], '%.3f'), value(r['memory'], '%.1f'), value(r['peak_memory'], '%.1f'),
+            value(r['peak_increase'], '%.1f'), r['count']))
+    return '\n'.join(lines)
+
+
+def run_incremental_drc(file_in, file_rdb, topcell_name=None, file_cache=None):
+    '''
+    Check the Si and metal width/space rules of a layout file incrementally (IncrementalDRC),
+    with the markers of the cells cached in file_cache, and save the markers in file_rdb.
+    Returns (the runtime in seconds, the runtime and memory of each rule (see read_rule_profile),
+             number of cells checked, number reused from the cache)
+    '''
+    import pya
+    from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_DRC
+
+    t0 = time.time()
+    ly = pya.Layout()
+    ly.read(file_in)
+    if topcell_name:
+        topcell = ly.cell(topcell_name)
+        if topcell is None:
+            raise Exception("Top cell %s not found in %s." % (topcell_name, file_in))
+    elif len(ly.top_cells()) == 1:
+        topcell = ly.top_cells()[0]
+    else:
+        raise Exception("You may only have one top cell in your hierarchy (%s). Choose the top cell using --topcell." % file_in)
+
+    drc = SiEPICfab_ZEP_DRC.IncrementalDRC(file_cache)
+    results = drc.run(topcell)
+    SiEPICfab_ZEP_DRC.write_markers(topcell, results, file_rdb)
+    drc.save()
+    return time.time()-t0, drc.profile, drc.checked, drc.reused
+
+
+def drc_file(file_in, output_dir=None, deck='SiEPICfab_EBeam_ZEP', topcell_name=None, klayout=None, threads=None,
+             incremental=False, file_cache=None, profile=False):
+    '''
+    Run the DRC on one layout file, and write the marker database (<file_in>_drc.lyrdb)
+    and the summary (<file_in>_drc.json, <file_in>_drc.csv).
+    incremental: check the Si and metal width/space rules incrementally (run_incremental_drc), instead of the deck,
+      with the cache file_cache (default: <file_in>_drc_cache.json)
+    profile: also write the runtime and memory of the rules as a table (<file_in>_drc_profile.txt, see profile_table)
+    Returns (the marker database filename, the summary)
+    '''
+    if not os.path.exists(file_in):
+        raise Exception("File %s not found." % file_in)
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(file_in))
+    name = os.path.join(output_dir, os.path.splitext(os.path.basename(file_in))[0]+'_%s' % extra)
+    file_rdb = name+'.lyrdb'
+
+    if incremental:
+        deck = 'incremental'
+        seconds, rule_profile, checked, reused = run_incremental_drc(
+            file_in, file_rdb, topcell_name=topcell_name, file_cache=file_cache or name+'_cache.json')
+        rules = rdb_summary(file_rdb, rule_profile)
+    else:
+        file_timing = name+'_timing.txt'
+        seconds = run_drc(file_in, file_rdb, deck=deck, topcell_name=topcell_name, klayout=klayout,
+                          threads=threads, file_timing=file_timing)
+        rules = rdb_summary(file_rdb, read_rule_profile(file_timing))
+        if os.path.exists(file_timing):
+            os.remove(file_timing)
+
+    summary = {'file': file_in, 'deck': deck, 'topcell': topcell_name, 'seconds': round(seconds, 3),
+               'violations': sum(r['count'] for r in rules), 'rules': rules}
+    write_drc_summary(summary, file_json=name+'.json', file_csv=name+'.csv')
+    if profile:
+        with open(name+'_profile.txt', 'w') as f:
+            f.write(profile_table(summary)+'\n')
+    return file_rdb, summary
+
+
+def _drc_file_worker(args):
+    file_in, kwargs = args
+    t0 = time.time()
+    try:
+        file_rdb, summary = drc_file(file_in, **kwargs)
+        return file_in, file_rdb, summary, time.time()-t0, None
+    except Exception as e:
+        return file_in, None, None, time.time()-t0, '%s: %s' % (type(e).__name__, e)
+
+
+def drc_files(files_in, processes=None, **kwargs):
+    '''
+    Run the DRC on many layout files, in a pool of worker processes.
+    kwargs are passed to drc_file.
+    Returns a list of (file_in, file_rdb, summary, seconds, error), in the order of files_in.
+    '''
+    jobs = [(f, kwargs) for f in files_in]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [_drc_file_worker(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_drc_file_worker, jobs))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m siepicfab_ebeam_zep.run_drc',
+        description='Run the SiEPICfab-EBeam-ZEP DRC decks on layouts, without the KLayout GUI.')
+    parser.add_argument('files', nargs='+', help='input layouts (GDS or OASIS)')
+    parser.add_argument('--deck', default='SiEPICfab_EBeam_ZEP',
+                        help='DRC deck: %s, or the path to a .lydrc file (default: SiEPICfab_EBeam_ZEP)' % ', '.join(decks))
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='folder for the marker databases and summaries (default: next to each input)')
+    parser.add_argument('--topcell', default=None,
+                        help='name of the top cell (default: the single top cell)')
+    parser.add_argument('--klayout', default=None,
+                        help='klayout executable (default: $KLAYOUT, or klayout on the PATH)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='number of threads per layout, for the tiled mode of large layouts')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='check the Si and metal width/space rules incrementally, reusing the markers of unchanged cells')
+    parser.add_argument('--cache', default=None,
+                        help='cache file for --incremental, shared by the inputs with -j 1 (default: <input>_drc_cache.json)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the runtime and memory of each rule, and save them in <input>_drc_profile.txt')
+    parser.add_argument('--fail-on-violations', action='store_true',
+                        help='return a non-zero exit code if there are DRC violations')
+    args = parser.parse_args(argv)
+    if args.cache and len(args.files) > 1 and (args.processes or os.cpu_count() or 1) > 1:
+        # the worker processes would read and write the same cache file at the same time
+        parser.error('--cache with several inputs needs -j 1; without --cache, each input has its own cache')
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = drc_files(args.files, processes=args.processes, output_dir=args.output_dir, deck=args.deck,
+                        topcell_name=args.topcell, klayout=args.klayout, threads=args.threads,
+                        incremental=args.incremental, file_cache=args.cache, profile=args.profile)
+
+    errors, violations = 0, 0
+    for file_in, file_rdb, summary, seconds, error in results:
+        if error:
+            errors += 1
+            print('FAILED  %s (%.1f s): %s' % (file_in, seconds, error))
+        else:
+            violations += 1 if summary['violations'] else 0
+            rules = ', '.join('%s: %s' % (r['rule'], r['count']) for r in summary['rules'] if r['count'])
+            print('OK      %s -> %s, %s violations%s (%.1f s)' %
+                  (file_in, file_rdb, summary['violations'], ' (%s)' % rules if rules else '', seconds))
+            if args.profile:
+                print(profile_table(summary))
+    print('Checked %s of %s layouts, %s with violations.' % (len(results)-errors, len(results), violations))
+    if errors or (args.fail_on_violations and violations):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+'''
+EBL write time estimate for SiEPICfab-EBeam-ZEP fabrication layouts, without the KLayout application (GUI)
+
+Runs on the exported layout (<layout>_static.oas, the output of the boolean operations), with its EBL-Regions.
+The exposed areas of the fields are cached in <layout>_writetime.json, so what-if runs with other
+beam conditions only evaluate the time model.
+
+Usage, with the standalone klayout Python module:
+  python -m siepicfab_ebeam_zep.write_time chip_static.oas
+  python -m siepicfab_ebeam_zep.write_time chip_static.oas --current high=5 low=50 --no-highandlowres
+'''
+
+import os
+import sys
+
+
+def _file_hash(filename):
+    import hashlib
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_estimate(file_in, topcell_name=None, cache=True, threads=None):
+    '''
+    The WriteTimeEstimate of a fabrication layout, using the cached areas (<file_in>_writetime.json)
+    if they were computed for the same layout contents, top cell and settings.
+    '''
+    from siepicfab_ebeam_zep.pymacros import SiEPICfab_ZEP_EBL
+    from siepicfab_ebeam_zep.pymacros.SiEPICfab_ZEP_EBL import WriteTimeEstimate
+
+    # the inputs of the field areas (EBL_field_statistics): the layout, with its fields, the layers and
+    # the tiling; not the write order of the fields, nor the beam conditions, which are only used by estimate()
+    parameters = {'layout': _file_hash(file_in),
+                  'topcell': topcell_name,
+                  'EBL_regions_layer': list(SiEPICfab_ZEP_EBL.EBL_regions_layer),
+                  'layers': {name: list(layer) for name, layer in WriteTimeEstimate.layers.items()},
+                  'tile_size': SiEPICfab_ZEP_EBL.statistics_tile_size,
+                  'tile_border': SiEPICfab_ZEP_EBL.statistics_tile_border}
+
+    file_cache = os.path.splitext(file_in)[0]+'_writetime.json'
+    if cache and os.path.exists(file_cache):
+        estimate = WriteTimeEstimate.load(file_cache, parameters)
+        if estimate is not None:
+            return estimate
+
+    import pya
+    ly = pya.Layout()
+    ly.read(file_in)
+    if topcell_name:
+        topcell = ly.cell(topcell_name)
+        if topcell is None:
+            raise Exception("Top cell %s not found in %s." % (topcell_name, file_in))
+    elif len(ly.top_cells()) == 1:
+        topcell = ly.top_cells()[0]
+    else:
+        raise Exception("You may only have one top cell in your hierarchy (%s). Choose the top cell using --topcell." % file_in)
+
+    estimate = WriteTimeEstimate(topcell, threads=threads)
+    if cache:
+        estimate.save(file_cache, parameters)
+    return estimate
+
+
+def _condition(v):
+    # argparse type: pass=value, e.g., high=2.0
+    import argparse
+    beam, sep, value = v.partition('=')
+    try:
+        if not beam or not sep:
+            raise ValueError
+        return beam, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected PASS=value, e.g., high=2.0: '%s'" % v)
+
+
+def _conditions(values, name, beam_conditions):
+    for beam, value in values or []:
+        beam_conditions.setdefault(beam, {})[name] = value
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m siepicfab_ebeam_zep.write_time',
+        description='Estimate the EBL write time of exported SiEPICfab-EBeam-ZEP layouts.')
+    parser.add_argument('files', nargs='+', help='exported layouts (<layout>_static.oas)')
+    parser.add_argument('--topcell', default=None, help='name of the top cell (default: the single top cell)')
+    parser.add_argument('--current', nargs='+', type=_condition, metavar='PASS=nA',
+                        help='beam current, e.g., high=2 low=20')
+    parser.add_argument('--dose', nargs='+', type=_condition, metavar='PASS=uC/cm2',
+                        help='dose, e.g., high=300')
+    parser.add_argument('--shot-pitch', nargs='+', type=_condition, metavar='PASS=um',
+                        help='shot pitch, e.g., high=0.005 low=0.02')
+    parser.add_argument('--settling', type=float, default=None, help='settling time per field, in seconds')
+    parser.add_argument('--no-highandlowres', dest='HighandLowRes', action='store_false',
+                        help='write Si_etch_highres_nobias in the high resolution pass')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='compute the field areas again, and do not save them')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads for the field areas')
+    args = parser.parse_args(argv)
+
+    beam_conditions = {}
+    _conditions(args.current, 'current', beam_conditions)
+    _conditions(args.dose, 'dose', beam_conditions)
+    _conditions(args.shot_pitch, 'shot_pitch', beam_conditions)
+
+    for file_in in args.files:
+        estimate = load_estimate(file_in, topcell_name=args.topcell, cache=args.cache, threads=args.threads)
+        result = estimate.estimate(HighandLowRes=args.HighandLowRes, beam_conditions=beam_conditions,
+                                   settling_time=args.settling)
+        print('%s:' % file_in)
+        print(estimate.summary(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())